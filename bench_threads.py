@@ -0,0 +1,75 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from vm_modules import vm_thread
+
+# ==============================
+#   spawn/joinのスレッド数によるスケーリング
+# ==============================
+# 合計total回のループをスレッド数で等分し，spawnで開始したスレッドで実行してjoinで合計する．
+# スレッド数毎に実行時間(最良値)と最初に指定したスレッド数に対する速度向上率を出力する．
+# フリースレッドの処理系(python3.13t等)で実行すると並列に実行され，GILのある処理系ではほぼ1倍になる
+#   python3.13t bench_threads.py --threads 1 2 4 8
+
+# n個のスレッドでそれぞれcount回ループし，各スレッドの戻り値(ループ回数)の合計を出力するプログラム
+def program(n, count):
+    # スレッドを開始してスレッド番号をグローバル変数1..nに格納し，順にjoinして合計する
+    lines = []
+    for i in range(n):
+        lines += [f"push_int {count}", "spawn {sub}", f"store_global {i + 1}"]
+    lines += ["push_int 0"]
+    for i in range(n):
+        lines += [f"load_global {i + 1}", "join", "add"]
+    lines += ["print", "exit"]
+    sub = len(lines) + 1
+    # サブルーチン: 引数の回数だけローカル変数を数え上げて返す
+    lines += [
+        "store_local 0",
+        "push_int 0",
+        "store_local 1",
+        "load_local 1",          # sub + 3
+        "push_int 1",
+        "add",
+        "dup",
+        "store_local 1",
+        "load_local 0",
+        f"if_equal {sub + 11}",
+        f"jump {sub + 3}",
+        "load_local 1",          # sub + 11
+        "exit",
+    ]
+    return "\n".join(line.format(sub=sub) for line in lines) + "\n"
+
+def measure(path, repeat):
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, main, path], check=True, stdout=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--total", type=int, default=2000000) # 全スレッドの合計のループ回数
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{sys.version.split()[0]} free-threaded: {vm_thread.free_threaded()} cpus: {os.cpu_count()}")
+    base = None
+    with tempfile.TemporaryDirectory() as directory:
+        for n in args.threads:
+            path = os.path.join(directory, f"threads_{n}.txt")
+            with open(path, "w", encoding="utf8") as f:
+                f.write(program(n, args.total // n))
+            elapsed = measure(path, args.repeat)
+            base = base or elapsed
+            print(f"threads {n:>3}: {elapsed:.3f}s  speedup {base / elapsed:.2f}x")
+
+if __name__ == '__main__':
+    main()
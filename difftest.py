@@ -0,0 +1,381 @@
+import io
+import multiprocessing
+import os
+import random
+import signal
+import sys
+from contextlib import redirect_stdout, redirect_stderr
+from vm_modules import virtual_machine
+from vm_modules import vm_jit
+
+# 差分テスト: ランダムに生成したプログラムを参照実装(VirtualMachine)と
+# 他の実行エンジンで実行し，出力・終了コード・エラーメッセージ・行番号を比較する
+# 実行コマンド
+# python difftest.py [-n プログラム数] [-seed 最初のシード] [-jobs 並列数] [-engines jit,...]
+
+
+# ==============================
+#          実行エンジン
+# ==============================
+# 名前 -> プログラムからVirtualMachineを作る関数
+ENGINES = {
+    "reference": lambda text: virtual_machine.VirtualMachine(text, False),
+    "jit": lambda text: virtual_machine.VirtualMachine(text, False, vm_jit.JIT(threshold=2)),
+    "inline": lambda text: _inlined(virtual_machine.VirtualMachine(text, False)),
+    "quicken": lambda text: _quickened(virtual_machine.VirtualMachine(text, False)),
+    "hoist": lambda text: _hoisted(virtual_machine.VirtualMachine(text, False)),
+}
+
+def _inlined(vm):
+    vm.inline = True
+    return vm
+
+def _quickened(vm):
+    vm.quicken = True
+    return vm
+
+def _hoisted(vm):
+    vm.hoist = True
+    return vm
+
+
+class _Timeout(Exception):
+    pass
+
+def _on_timeout(signum, frame):
+    raise _Timeout()
+
+# プログラムを実行して (標準出力, 終了コード, 標準エラー出力, 例外名, 行番号) を返す
+# 時間切れの場合はNone
+def execute(engine, text, timeout=2.0):
+    out = io.StringIO()
+    err = io.StringIO()
+    vm = None
+    code = None
+    exception = None
+    use_timer = hasattr(signal, "setitimer")
+    if use_timer:
+        previous = signal.signal(signal.SIGALRM, _on_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        with redirect_stdout(out), redirect_stderr(err):
+            try:
+                vm = ENGINES[engine](text)
+                vm.run()
+            except SystemExit as e:
+                code = e.code
+            except _Timeout:
+                return None
+            except RecursionError:
+                return None
+            except Exception as e:
+                code = 1
+                exception = type(e).__name__
+    finally:
+        if use_timer:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+    line = vm.program.source_index(vm.pc) + 1 if vm is not None else None
+    return (out.getvalue(), code, err.getvalue(), exception, line)
+
+
+# ==============================
+#        プログラム生成
+# ==============================
+# ジャンプ先のラベル (アセンブル時に行番号へ変換)
+class Label:
+    pass
+
+# 命令列を実行可能なテキストへ変換
+# program: (オペコード, オペランド)のタプルとLabelのリスト
+def assemble(program):
+    lines = {}
+    n_line = 1
+    for item in program:
+        if isinstance(item, Label):
+            lines[item] = n_line
+        else:
+            n_line += 1
+    text = []
+    for item in program:
+        if isinstance(item, Label):
+            continue
+        opcode, operand = item
+        if isinstance(operand, Label):
+            operand = lines.get(operand, n_line)
+        text.append(opcode if operand is None else f"{opcode} {operand}")
+    return "\n".join(text) + "\n"
+
+
+_INT_GLOBALS = range(0, 4)     # 整数を格納するグローバル変数
+_FLOAT_GLOBALS = range(4, 8)   # 実数を格納するグローバル変数
+_DYNAMIC_GLOBAL = 8            # 整数・実数のどちらも格納するグローバル変数
+_ARRAY_GLOBALS = range(20, 24) # 配列を格納するグローバル変数
+_STRING_GLOBAL = 24            # 文字型配列を格納するグローバル変数
+_STRING_LENGTH = 8
+_COUNTER_GLOBAL = 40           # ループカウンタ (サブルーチン・ネストの深さ毎に1つ)
+
+class Generator:
+    def __init__(self, rng):
+        self.rng = rng
+        self.arrays = {}         # 配列変数 -> (要素型, 長さ)
+        self.locals = None       # サブルーチン内のローカル変数 -> 型
+        self.counter = _COUNTER_GLOBAL # ループカウンタに使う最初のグローバル変数
+
+    def program(self):
+        code = []
+        # 変数の初期化
+        for slot in _INT_GLOBALS:
+            code += [("push_int", self.rng.randint(-9, 9)), ("store_global", slot)]
+        for slot in _FLOAT_GLOBALS:
+            code += [("push_float", self._float()), ("store_global", slot)]
+        code += [("push_int", 0), ("store_global", _DYNAMIC_GLOBAL)]
+        for slot in _ARRAY_GLOBALS:
+            element = self.rng.choice(["int", "float"])
+            length = self.rng.randint(1, 8)
+            self.arrays[slot] = (element, length)
+            code += [(f"new_array_{element}", length), ("store_global", slot)]
+            # 要素を要素型の値で初期化 (確保直後の要素は整数の0)
+            value = ("push_int", 0) if element == "int" else ("push_float", 0.0)
+            for index in range(length):
+                code += [value, ("push_int", index), ("store_global_array", slot)]
+
+        code += [("new_array_char", _STRING_LENGTH), ("store_global", _STRING_GLOBAL)]
+        for index in range(self.rng.randint(0, _STRING_LENGTH)):
+            code += [("push_char", self.rng.randint(65, 90)), ("push_int", index), ("store_global_array", _STRING_GLOBAL)]
+
+        # サブルーチンは後ろのものだけを呼び出す (再帰しない)
+        n_sub = self.rng.randint(0, 3)
+        labels = [Label() for _ in range(n_sub)]
+        bodies = []
+        for i in reversed(range(n_sub)):
+            self.locals = {0: "int", 1: "int", 2: "float", 3: "float"}
+            self.counter = _COUNTER_GLOBAL + 2 * (i + 1)
+            body = [labels[i], ("store_local", 0),
+                    ("push_int", 1), ("store_local", 1),
+                    ("push_float", 1.0), ("store_local", 2),
+                    ("push_float", 1.0), ("store_local", 3)]
+            # サブルーチン内のループは1重まで
+            body += self._block(self.rng.randint(1, 6), 1, labels[i + 1:])
+            body += self._expr("int", 2) + [("exit", None)]
+            bodies.insert(0, body)
+        self.locals = None
+        self.counter = _COUNTER_GLOBAL
+
+        code += self._block(self.rng.randint(3, 12), 0, labels)
+        code.append(("exit", None))
+        for body in bodies:
+            code += body
+        return code
+
+    def _float(self):
+        return self.rng.choice([0.5, 1.0, 2.5, -3.0, 0.25, 10.0, -1.5])
+
+    # ===== 式 (スタックに値を1つ積む) =====
+    def _expr(self, t, depth):
+        rng = self.rng
+        choice = rng.random() if depth < 3 else 0.0
+        if choice < 0.3:
+            if t == "int":
+                return [("push_int", rng.randint(-9, 9))]
+            return [("push_float", self._float())]
+        if choice < 0.55:
+            return [self._load(t)]
+        if choice < 0.65:
+            arrays = [slot for slot, (element, _) in self.arrays.items() if element == t]
+            if arrays:
+                slot = rng.choice(arrays)
+                index = rng.randrange(self.arrays[slot][1])
+                return [("push_int", index), ("load_global_array", slot)]
+            return [self._load(t)]
+        ops = ["add", "sub", "mul"] if t == "int" else ["add", "sub", "mul", "div"]
+        op = rng.choice(ops)
+        left = self._expr(t, depth + 1)
+        right = self._expr(t, depth + 1)
+        if op == "div":
+            # 0除算を避ける (エラーケースでは意図的に発生させる)
+            right = [("push_float", rng.choice([2.0, 4.0, 0.5, -8.0]))]
+        return right + left + [(op, None)]
+
+    def _load(self, t):
+        rng = self.rng
+        if self.locals is not None:
+            slots = [slot for slot, local_t in self.locals.items() if local_t == t]
+            if slots and rng.random() < 0.6:
+                return ("load_local", rng.choice(slots))
+        return ("load_global", rng.choice(_INT_GLOBALS if t == "int" else _FLOAT_GLOBALS))
+
+    # ===== 文 (スタックの深さを変えない) =====
+    def _block(self, n, depth, callees):
+        code = []
+        for _ in range(n):
+            code += self._statement(depth, callees)
+        return code
+
+    def _statement(self, depth, callees):
+        rng = self.rng
+        t = rng.choice(["int", "float"])
+        kind = rng.choices(
+            ["assign", "print", "array", "dynamic", "char", "string", "if", "loop", "call", "local", "error"],
+            [4, 4, 3, 1, 1, 1, 2, 2 if depth < 2 else 0, 2 if callees else 0, 2 if self.locals is not None else 0, 0.1]
+        )[0]
+        match kind:
+            case "assign":
+                slots = _INT_GLOBALS if t == "int" else _FLOAT_GLOBALS
+                return self._expr(t, 0) + [("store_global", rng.choice(slots))]
+            case "local":
+                slot = rng.choice([slot for slot, local_t in self.locals.items() if local_t == t])
+                return self._expr(t, 0) + [("store_local", slot)]
+            case "print":
+                return self._expr(t, 0) + [("print", None)]
+            case "array":
+                slot = rng.choice(list(self.arrays))
+                element, length = self.arrays[slot]
+                return self._expr(element, 1) + [("push_int", rng.randrange(length)), ("store_global_array", slot)]
+            case "dynamic":
+                return self._expr(t, 1) + [("load_global", _DYNAMIC_GLOBAL), ("add", None), ("dup", None), ("print", None), ("store_global", _DYNAMIC_GLOBAL)]
+            case "char":
+                return [("push_char", rng.randint(65, 90)), (rng.choice(["print", "print_char"]), None)]
+            case "string":
+                if rng.random() < 0.5:
+                    return [("print_global_array", _STRING_GLOBAL)]
+                start = rng.randint(0, _STRING_LENGTH)
+                count = rng.randint(0, _STRING_LENGTH - start)
+                return [("push_int", count), ("push_int", start), ("print_global_array_slice", _STRING_GLOBAL)]
+            case "if":
+                end = Label()
+                opcode = rng.choice(["if_equal", "if_greater", "if_less"])
+                return self._expr(t, 1) + self._expr(t, 1) + [(opcode, end)] + self._block(rng.randint(1, 3), depth, callees) + [end]
+            case "loop":
+                counter = self.counter + depth
+                top = Label()
+                return [("push_int", 0), ("store_global", counter), top]\
+                    + self._block(rng.randint(1, 4), depth + 1, callees)\
+                    + [("push_int", 1), ("load_global", counter), ("add", None), ("store_global", counter),
+                       ("push_int", rng.randint(1, 12)), ("load_global", counter), ("if_less", top)]
+            case "call":
+                return self._expr("int", 1) + [("call", rng.choice(callees)), ("print", None)]
+            case "error":
+                return self._error()
+
+    # 意図的なエラー
+    def _error(self):
+        rng = self.rng
+        match rng.choices(range(7), [3, 3, 3, 3, 3, 3, 1])[0]:
+            case 0:
+                return [("add", None)]                                  # 空のスタックからpop
+            case 1:
+                return [("load_global", 99), ("print", None)]           # 未定義の変数
+            case 2:
+                slot = rng.choice(list(self.arrays))
+                wrong = "push_float" if self.arrays[slot][0] == "int" else "push_int"
+                return [(wrong, 1), ("push_int", 0), ("store_global_array", slot)] # 型の不一致
+            case 3:
+                return [("push_int", 1), ("push_float", 0.0), ("div", None), ("print", None)] # 0除算
+            case 4:
+                slot = rng.choice(list(self.arrays))
+                return [("push_int", 100), ("load_global_array", slot), ("print", None)] # 範囲外の添字
+            case 5:
+                return [("undefined_opcode", None)]                     # 不明なオペコード
+            case 6:
+                return [("push_int", None)]                             # オペランドが不足 (実行前に検出)
+
+
+def generate(seed):
+    return Generator(random.Random(seed)).program()
+
+
+# ==============================
+#         比較・縮小
+# ==============================
+# 参照実装と結果が異なるエンジンの名前と両方の結果を返す (一致すればNone)
+def compare(program, engines, timeout=2.0):
+    text = assemble(program)
+    expected = execute("reference", text, timeout)
+    if expected is None:
+        return None
+    for engine in engines:
+        actual = execute(engine, text, timeout)
+        if actual is not None and actual != expected:
+            return engine, expected, actual
+    return None
+
+# 不一致が再現する範囲で命令を削除していく (ラベルは残す)
+# 削除で無限ループになった候補は短い時間切れで捨てる
+def shrink(program, engine, timeout=0.1):
+    chunk = len(program) // 2
+    while chunk >= 1:
+        i = 0
+        progress = False
+        while i < len(program):
+            candidate = program[:i] + [item for item in program[i:i + chunk] if isinstance(item, Label)] + program[i + chunk:]
+            if len(candidate) < len(program) and compare(candidate, [engine], timeout) is not None:
+                program = candidate
+                progress = True
+            else:
+                i += chunk
+        if not progress:
+            chunk //= 2
+    return program
+
+# シード1つ分の検査 (並列実行の単位)
+def check(args):
+    seed, engines = args
+    program = generate(seed)
+    mismatch = compare(program, engines)
+    if mismatch is None:
+        return None
+    engine = mismatch[0]
+    shrunk = shrink(program, engine)
+    result = compare(shrunk, [engine])
+    if result is None:
+        # 再実行で一致した(タイミングに依存する不一致)場合は縮小前のプログラムと最初の結果を返す
+        return seed, assemble(program), mismatch
+    return seed, assemble(shrunk), result
+
+
+# ==============================
+#        メイン処理
+# ==============================
+def run(n, seed=0, jobs=None, engines=None):
+    engines = engines or [name for name in ENGINES if name != "reference"]
+    tasks = [(s, engines) for s in range(seed, seed + n)]
+    jobs = jobs or os.cpu_count()
+    if jobs == 1:
+        results = map(check, tasks)
+        return [r for r in results if r is not None]
+    with multiprocessing.Pool(jobs) as pool:
+        return [r for r in pool.imap_unordered(check, tasks, chunksize=8) if r is not None]
+
+def main():
+    n, seed, jobs, engines = 500, 0, None, None
+    args = iter(sys.argv[1:])
+    for arg in args:
+        if arg == "-n":
+            n = int(next(args))
+        elif arg == "-seed":
+            seed = int(next(args))
+        elif arg == "-jobs":
+            jobs = int(next(args))
+        elif arg == "-engines":
+            engines = next(args).split(",")
+        else:
+            print(f"不明な引数です: {arg}")
+            sys.exit(2)
+    for engine in engines or []:
+        if engine not in ENGINES:
+            print(f"不明なエンジンです: {engine}")
+            sys.exit(2)
+
+    mismatches = run(n, seed, jobs, engines)
+    for seed, text, (engine, expected, actual) in sorted(mismatches, key=lambda m: m[0]):
+        print(f"===== seed {seed}: reference != {engine} =====")
+        print(text, end="")
+        print(f"--- reference: {expected!r}")
+        print(f"--- {engine}: {actual!r}")
+    print(f"{n} programs, {len(mismatches)} mismatches")
+    sys.exit(1 if mismatches else 0)
+
+# 実行
+if __name__ == '__main__':
+    main()
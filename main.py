@@ -1,6 +1,9 @@
 import os
 import sys
+import time
 from vm_modules import virtual_machine
+from vm_modules import vm_parallel
+from vm_modules import vm_result_cache
 
 
 # ==============================
@@ -15,27 +18,88 @@ def main():
         print(f"ファイルが存在しません: {sys.argv[1]}")
         sys.exit(1)
     
+    result_cache_dir = None   # 実行結果のキャッシュのディレクトリ (Noneならキャッシュしない)
+    result_cache_size = 64 << 20
+    result_cache_bypass = False # キャッシュを読み書きせずに実行する
+    result_cache_stats = False
     if len(sys.argv) > 1:
-        for arg in sys.argv[2:]:
+        args = iter(sys.argv[2:])
+        for arg in args:
             if arg == "-time":
                 virtual_machine.time_flag = True
+            elif arg == "-jit":
+                virtual_machine.jit_flag = True
+            elif arg == "-jit_threshold":
+                virtual_machine.jit_threshold = int(next(args))
+            elif arg == "-jit_stats":
+                virtual_machine.jit_stats_flag = True
+            elif arg == "-stats":
+                virtual_machine.stats_format = next(args)
+            elif arg == "-stats_out":
+                virtual_machine.stats_path = next(args)
+            elif arg == "-input":
+                virtual_machine.input_path = next(args)
+            elif arg == "-profile":
+                virtual_machine.profile_path = next(args)
+            elif arg == "-profile_interval":
+                virtual_machine.profile_interval = float(next(args))
+            elif arg == "-profile_every":
+                virtual_machine.profile_every = int(next(args))
+            elif arg == "-array_pool":
+                virtual_machine.array_pool_bytes = int(next(args))
+            elif arg == "-inline":
+                virtual_machine.inline_flag = True
+            elif arg == "-inline_report":
+                virtual_machine.inline_flag = True
+                virtual_machine.inline_report_flag = True
+            elif arg == "-memory_profile":
+                virtual_machine.memory_profile_path = next(args)
+            elif arg == "-monitor":
+                virtual_machine.monitor_flag = True
+            elif arg == "-heartbeat":
+                virtual_machine.heartbeat_interval = float(next(args))
+            elif arg == "-monitor_out":
+                virtual_machine.monitor_path = next(args)
+            elif arg == "-quicken":
+                virtual_machine.quicken_flag = True
+            elif arg == "-quicken_threshold":
+                virtual_machine.quicken_threshold = int(next(args))
+            elif arg == "-quicken_stats":
+                virtual_machine.quicken_flag = True
+                virtual_machine.quicken_stats_flag = True
+            elif arg == "-hoist_checks":
+                virtual_machine.hoist_flag = True
+            elif arg == "-workers":
+                vm_parallel.workers = int(next(args))
+            elif arg == "-result_cache":
+                result_cache_dir = next(args)
+            elif arg == "-result_cache_size":
+                result_cache_size = int(next(args))
+            elif arg == "-result_cache_bypass":
+                result_cache_bypass = True
+            elif arg == "-result_cache_stats":
+                result_cache_stats = True
     
     file_path = sys.argv[1]
 
     # ファイル読み込み
+    start_ns = time.perf_counter_ns()
     text = load_file(file_path)
-    # 実行
-    virtual_machine.run(text)
+    load_ns = time.perf_counter_ns() - start_ns
+    # 実行 (構文解析後はプログラムの文字列を保持しない)
+    if result_cache_dir is None or result_cache_bypass:
+        virtual_machine.run(text, load_ns, file_path)
+        return
+    cache = vm_result_cache.ResultCache(result_cache_dir, result_cache_size)
+    try:
+        vm_result_cache.run(cache, text, load_ns, file_path)
+    finally:
+        if result_cache_stats:
+            print("result_cache: " + " ".join(f"{k}={v}" for k, v in cache.stats().items()), file=sys.stderr)
 
-
-# ==============================
-#       ファイル読み込み
-# ==============================
 def load_file(file_name):
-    result = []
     with open(file_name, 'r', encoding="utf8") as f:
-        result = f.read()
-    return result
+        return f.read()
 
 # 実行
 if __name__ == '__main__':
@@ -0,0 +1,307 @@
+import collections
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import threading
+import time
+from contextlib import redirect_stdout, redirect_stderr
+from vm_modules import virtual_machine
+from vm_modules import vm_input
+from vm_modules import vm_jit
+
+# 常駐サーバー: 起動・import・パースのコストを1回だけ払い，リクエスト毎にプログラムを実行する
+# 実行コマンド
+# python server.py serve [-unix パス | -port 番号] [-workers 数] [-cache 件数]
+# python server.py run プログラムのパス [-input 入力ファイル] [-jit] [-unix パス | -port 番号]
+# python server.py stats [-unix パス | -port 番号]
+#
+# プロトコル: 4バイト(ビッグエンディアン)の長さ + UTF-8のJSON をリクエスト・レスポンスとも1つずつ送る
+# リクエスト:   {"source": プログラム} または {"path": ファイル}, 任意で "input": 標準入力の文字列, "jit": true
+#               {"command": "stats"} で統計を返す
+# レスポンス:   {"stdout", "stderr", "exit_code", "cached", "latency"} または {"error": メッセージ}
+
+DEFAULT_PORT = 8730
+_HEADER = struct.Struct(">I")
+
+
+# ==============================
+#          通信の補助
+# ==============================
+def send_message(sock, message):
+    data = json.dumps(message).encode("utf8")
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+def recv_message(sock):
+    header = _recv_exact(sock, _HEADER.size)
+    if header is None:
+        return None
+    data = _recv_exact(sock, _HEADER.unpack(header)[0])
+    if data is None:
+        return None
+    return json.loads(data.decode("utf8"))
+
+def _recv_exact(sock, n):
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+# ==============================
+#            ワーカー
+# ==============================
+# パース・構文チェック済みのプログラムをハッシュ値をキーにLRUで保持する
+class ProgramCache:
+    def __init__(self, size=128):
+        self.size = size
+        self.programs = collections.OrderedDict() # ハッシュ値 -> Program
+
+    def get(self, key):
+        program = self.programs.get(key)
+        if program is not None:
+            self.programs.move_to_end(key)
+        return program
+
+    def put(self, key, program):
+        self.programs[key] = program
+        self.programs.move_to_end(key)
+        while len(self.programs) > self.size:
+            self.programs.popitem(last=False)
+
+
+# プログラムを実行して結果を返す (プロセスは終了しない)
+def execute(cache, key, source, input_text="", jit=False):
+    program = cache.get(key)
+    cached = program is not None
+    if program is None:
+        program = virtual_machine.Program(source)
+    out = io.StringIO()
+    err = io.StringIO()
+    code = 0
+    with redirect_stdout(out), redirect_stderr(err):
+        try:
+            vm = virtual_machine.VirtualMachine(program, False, vm_jit.JIT() if jit else None)
+            vm.input = vm_input.Reader(io.BytesIO(input_text.encode("utf8")))
+            vm.run()
+        except SystemExit as e:
+            code = e.code
+        except Exception as e:
+            code = 1
+            print(f"{type(e).__name__}: {e}", file=sys.stderr)
+    # 構文チェックを通ったプログラムだけを保持する
+    if not cached and program.verified:
+        cache.put(key, program)
+    return {"stdout": out.getvalue(), "stderr": err.getvalue(), "exit_code": code, "cached": cached}
+
+def _worker(connection, cache_size):
+    cache = ProgramCache(cache_size)
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            return
+        connection.send(execute(cache, *request))
+
+
+# 各ワーカーは自身のキャッシュを持つため，同じプログラムは常に同じワーカーへ送る
+class WorkerPool:
+    def __init__(self, n_workers=None, cache_size=128):
+        n_workers = n_workers or os.cpu_count() or 1
+        self.workers = []
+        for _ in range(n_workers):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_worker, args=(child, cache_size), daemon=True)
+            process.start()
+            child.close()
+            self.workers.append((parent, threading.Lock(), process))
+
+    def execute(self, key, source, input_text="", jit=False):
+        connection, lock, _ = self.workers[int(key[:8], 16) % len(self.workers)]
+        with lock:
+            connection.send((key, source, input_text, jit))
+            return connection.recv()
+
+    def close(self):
+        for connection, _, process in self.workers:
+            connection.close()
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+
+
+# ==============================
+#            統計
+# ==============================
+class ServerStats:
+    def __init__(self, window=10000):
+        self.latencies = collections.deque(maxlen=window) # 直近のレイテンシ(秒)
+        self.requests = 0
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    def record(self, latency, cached):
+        with self.lock:
+            self.latencies.append(latency)
+            self.requests += 1
+            self.hits += cached
+
+    def report(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            return {
+                "requests": self.requests,
+                "cache_hits": self.hits,
+                "cache_misses": self.requests - self.hits,
+                "hit_rate": self.hits / self.requests if self.requests else 0.0,
+                "p50": _percentile(latencies, 50),
+                "p99": _percentile(latencies, 99),
+            }
+
+def _percentile(values, p):
+    if not values:
+        return None
+    return values[min(len(values) - 1, len(values) * p // 100)]
+
+
+# ==============================
+#           サーバー
+# ==============================
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                request = recv_message(self.request)
+            except (OSError, ValueError):
+                return
+            if request is None:
+                return
+            send_message(self.request, self.server.dispatch(request))
+
+
+class _Server(socketserver.ThreadingMixIn):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def dispatch(self, request):
+        if request.get("command") == "stats":
+            return self.stats.report()
+        start = time.perf_counter()
+        if "source" in request:
+            source = request["source"]
+        elif "path" in request:
+            try:
+                with open(request["path"], "r", encoding="utf8") as f:
+                    source = f.read()
+            except OSError as e:
+                return {"error": str(e)}
+        else:
+            return {"error": "source or path is required"}
+        key = hashlib.sha256(source.encode("utf8")).hexdigest()
+        reply = self.pool.execute(key, source, request.get("input", ""), bool(request.get("jit")))
+        reply["latency"] = time.perf_counter() - start
+        self.stats.record(reply["latency"], reply["cached"])
+        return reply
+
+class TCPServer(_Server, socketserver.TCPServer):
+    pass
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class UnixServer(_Server, socketserver.UnixStreamServer):
+        pass
+
+
+# addressは (ホスト, ポート) またはUnixドメインソケットのパス
+def create_server(address, n_workers=None, cache_size=128):
+    if isinstance(address, str):
+        # 前回のサーバーが残したソケットだけを削除する (通常のファイルは消さない)
+        if os.path.exists(address):
+            if not stat.S_ISSOCK(os.stat(address).st_mode):
+                raise FileExistsError(f"not a socket: {address}")
+            os.remove(address)
+        server = UnixServer(address, _Handler)
+    else:
+        server = TCPServer(address, _Handler)
+    server.pool = WorkerPool(n_workers, cache_size)
+    server.stats = ServerStats()
+    return server
+
+
+# ==============================
+#         クライアント
+# ==============================
+def connect(address):
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect(address)
+    return sock
+
+def request(address, message):
+    with connect(address) as sock:
+        send_message(sock, message)
+        return recv_message(sock)
+
+
+# ==============================
+#        メイン処理
+# ==============================
+def main():
+    if len(sys.argv) <= 1 or sys.argv[1] not in ("serve", "run", "stats"):
+        print("serve, run, statsのいずれかを指定してください")
+        sys.exit(1)
+    command = sys.argv[1]
+    address = ("127.0.0.1", DEFAULT_PORT)
+    n_workers = None
+    cache_size = 128
+    message = {}
+    args = iter(sys.argv[2:])
+    for arg in args:
+        if arg == "-unix":
+            address = next(args)
+        elif arg == "-port":
+            address = ("127.0.0.1", int(next(args)))
+        elif arg == "-workers":
+            n_workers = int(next(args))
+        elif arg == "-cache":
+            cache_size = int(next(args))
+        elif arg == "-input":
+            with open(next(args), "r", encoding="utf8") as f:
+                message["input"] = f.read()
+        elif arg == "-jit":
+            message["jit"] = True
+        else:
+            message["path"] = os.path.abspath(arg)
+
+    if command == "serve":
+        server = create_server(address, n_workers, cache_size)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            server.pool.close()
+    elif command == "stats":
+        print(json.dumps(request(address, {"command": "stats"}), indent=2))
+    else:
+        reply = request(address, message)
+        if "error" in reply:
+            print(reply["error"], file=sys.stderr)
+            sys.exit(1)
+        sys.stdout.write(reply["stdout"])
+        sys.stderr.write(reply["stderr"])
+        sys.exit(reply["exit_code"])
+
+if __name__ == '__main__':
+    main()
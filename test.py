@@ -648,3 +648,1869 @@ def test_error_mismatching_array_type(capsys):
     out, err = capsys.readouterr()
     assert err == f"{_color_red}syntax error (mismatching array type): line 5, \"store_local_array 0\"{_color_reset}\n"
     assert exit_info.value.code == 1
+
+# 範囲外・負・整数でない添字
+@pytest.mark.parametrize("array, index, opcode", [
+    ("new_array_int 5", "push_int 5", "load_local_array 0"),
+    ("new_array_int 5", "push_int -1", "load_local_array 0"),
+    ("new_array_float 5", "push_float 1", "load_local_array 0"),
+    ("new_array_char 5", "push_int -1", "load_local_array 0"),
+    ("new_array_int 5", "push_int 1\npush_int -5", "store_local_array 0"),
+    ("new_array_char 5", "push_char 65\npush_int 5", "store_local_array 0"),
+])
+def test_error_array_index_out_of_range(capsys, array, index, opcode):
+    text = f"{array}\n"\
+            "store_local 0\n"\
+           f"{index}\n"\
+           f"{opcode}\n"\
+            "exit\n"
+    n = len(text.splitlines()) - 1
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert err == f"{_color_red}index error (array index out of range): line {n}, \"{opcode}\"{_color_reset}\n"
+    assert exit_info.value.code == 1
+
+
+# ==============================
+#        デバッグ用フック
+# ==============================
+
+# トレース
+def test_hook_trace(capsys):
+    text = "push_int 1\n"\
+           "push_int 2\n"\
+           "add\n"\
+           "print\n"\
+           "exit\n"
+    vm = virtual_machine.VirtualMachine(text, False)
+    trace = []
+    vm.hooks.add_trace(lambda vm, line, opcode, operand: trace.append((line, opcode)))
+    with pytest.raises(SystemExit) as exit_info:
+        vm.run()
+
+    out, err = capsys.readouterr()
+    assert out == "3\n"
+    assert trace == [(1, "push_int"), (2, "push_int"), (3, "add"), (4, "print"), (5, "exit")]
+    assert exit_info.value.code == 0
+
+# ブレークポイント (フック解除後は通常のループに戻る)
+def test_hook_breakpoint(capsys):
+    text = "push_int 0\n"\
+           "push_int 1\n"\
+           "add\n"\
+           "dup\n"\
+           "push_int 3\n"\
+           "if_equal 8\n"\
+           "jump 2\n"\
+           "print\n"\
+           "exit\n"
+    vm = virtual_machine.VirtualMachine(text, False)
+    hits = []
+    def on_break(vm, line):
+        hits.append(list(vm.data_stack.items))
+        if len(hits) == 2:
+            vm.hooks.remove_breakpoint(3)
+    vm.hooks.add_breakpoint(3, on_break)
+    with pytest.raises(SystemExit) as exit_info:
+        vm.run()
+
+    out, err = capsys.readouterr()
+    assert out == "3\n"
+    assert hits == [[0, 1], [1, 1]]
+    assert not vm.hooks.is_active()
+    assert exit_info.value.code == 0
+
+# ウォッチポイント (ローカル変数・グローバル配列の要素)
+def test_hook_watchpoint(capsys):
+    text = "new_array_int 3\n"\
+           "store_global 0\n"\
+           "push_int 5\n"\
+           "push_int 1\n"\
+           "store_global_array 0\n"\
+           "push_int 6\n"\
+           "push_int 2\n"\
+           "store_global_array 0\n"\
+           "push_int 7\n"\
+           "store_local 0\n"\
+           "exit\n"
+    vm = virtual_machine.VirtualMachine(text, False)
+    events = []
+    def on_write(vm, area, slot, index, old, new):
+        events.append((vm.pc + 1, area, slot, index, old, new))
+    vm.hooks.add_watchpoint("global", 0, on_write, index=1)
+    vm.hooks.add_watchpoint("local", 0, on_write)
+    with pytest.raises(SystemExit) as exit_info:
+        vm.run()
+
+    assert events[0][:4] == (2, "global", 0, 1)
+    assert events[0][5] == 0
+    assert events[1] == (5, "global", 0, 1, 0, 5)
+    assert events[2][:4] == (10, "local", 0, None)
+    assert events[2][5] == 7
+    assert len(events) == 3
+    assert exit_info.value.code == 0
+
+# 配列への読み込みも監視する
+def test_hook_watchpoint_read(capsys, monkeypatch):
+    _stdin(monkeypatch, "5 6")
+    text = "new_array_int 3\n"\
+           "store_global 0\n"\
+           "push_int 2\n"\
+           "push_int 0\n"\
+           "read_global_array 0\n"\
+           "exit\n"
+    vm = virtual_machine.VirtualMachine(text, False)
+    events = []
+    def on_write(vm, area, slot, index, old, new):
+        events.append((vm.pc + 1, slot, index, old, new))
+    vm.hooks.add_watchpoint("global", 0, on_write, index=0)
+    with pytest.raises(SystemExit) as exit_info:
+        vm.run()
+
+    assert events[1] == (5, 0, 0, 0, 5)
+    assert len(events) == 2
+    assert exit_info.value.code == 0
+
+# 2次元配列の要素の監視 (添字は(行, 列))
+def test_hook_watchpoint_matrix(capsys):
+    text = "new_matrix_int 2 2\n"\
+           "store_global 1\n"\
+           "push_int 9\n"\
+           "push_int 1\n"\
+           "push_int 0\n"\
+           "store_global_matrix 1\n"\
+           "push_int 8\n"\
+           "push_int 0\n"\
+           "push_int 1\n"\
+           "store_global_matrix 1\n"\
+           "exit\n"
+    vm = virtual_machine.VirtualMachine(text, False)
+    events = []
+    def on_write(vm, area, slot, index, old, new):
+        events.append((vm.pc + 1, slot, index, old, new))
+    vm.hooks.add_watchpoint("global", 1, on_write, index=(0, 1))
+    with pytest.raises(SystemExit) as exit_info:
+        vm.run()
+
+    assert events[1] == (6, 1, (0, 1), 0, 9)
+    assert len(events) == 2
+    assert exit_info.value.code == 0
+
+# call/returnイベント
+def test_hook_call_event(capsys):
+    text = "call 4\n"\
+           "exit\n"\
+           "exit\n"\
+           "call 6\n"\
+           "exit\n"\
+           "exit\n"
+    vm = virtual_machine.VirtualMachine(text, False)
+    events = []
+    vm.hooks.add_call_hook(lambda vm, event, line, depth: events.append((event, line, depth)))
+    with pytest.raises(SystemExit) as exit_info:
+        vm.run()
+
+    assert events == [("call", 4, 1), ("call", 6, 2), ("return", 5, 1), ("return", 2, 0)]
+    assert exit_info.value.code == 0
+
+# 実行中に別スレッドから登録したフックも呼ばれる (JITのトレースの実行中を含む)
+# フックがグローバル変数0に1を格納するとループを抜ける
+@pytest.mark.parametrize("jit", [False, True])
+def test_hook_added_while_running(capsys, jit):
+    text = "push_int 0\n"\
+           "store_global 0\n"\
+           "push_int 0\n"\
+           "push_int 1\n"\
+           "add\n"\
+           "dup\n"\
+           "push_int 100000000\n"\
+           "if_equal 13\n"\
+           "load_global 0\n"\
+           "push_int 1\n"\
+           "if_equal 13\n"\
+           "jump 4\n"\
+           "print\n"\
+           "exit\n"
+    vm = virtual_machine.VirtualMachine(text, False, virtual_machine.vm_jit.JIT(2) if jit else None)
+    hits = []
+    def on_breakpoint(vm, line):
+        hits.append(vm.data_stack.items[-1])
+        vm.global_area.store(0, 1)
+        vm.hooks.remove_breakpoint(line, on_breakpoint)
+    timer = threading.Timer(0.01, vm.hooks.add_breakpoint, (6, on_breakpoint))
+    timer.start()
+    with pytest.raises(SystemExit) as exit_info:
+        vm.run()
+    timer.join()
+
+    out, err = capsys.readouterr()
+    assert len(hits) == 1
+    assert out == f"{hits[0]}\n"
+
+# フック実行中のエラー
+def test_hook_error(capsys):
+    text = "push_int 1\n"\
+           "add\n"\
+           "exit\n"
+    vm = virtual_machine.VirtualMachine(text, False)
+    vm.hooks.add_trace(lambda vm, line, opcode, operand: None)
+    with pytest.raises(SystemExit) as exit_info:
+        vm.run()
+
+    out, err = capsys.readouterr()
+    assert err == f"{_color_red}index error (pop from empty): line 2, \"add\"{_color_reset}\n"
+    assert exit_info.value.code == 1
+
+
+# ==============================
+#        トレーシングJIT
+# ==============================
+
+# JITあり・なしで実行して結果を比較
+def _run_with_jit(capsys, text, threshold=2):
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.VirtualMachine(text, False).run()
+    expected = capsys.readouterr()
+
+    jit = virtual_machine.vm_jit.JIT(threshold)
+    with pytest.raises(SystemExit) as jit_exit_info:
+        virtual_machine.VirtualMachine(text, False, jit).run()
+    out, err = capsys.readouterr()
+    assert (out, err) == expected
+    assert jit_exit_info.value.code == exit_info.value.code
+    return out, err, jit
+
+# ループ (グローバル変数の総和)
+def test_jit_loop(capsys):
+    text = "push_int 0\n"\
+           "store_global 0\n"\
+           "push_int 0\n"\
+           "store_global 1\n"\
+           "load_global 0\n"\
+           "load_global 1\n"\
+           "add\n"\
+           "store_global 1\n"\
+           "push_int 1\n"\
+           "load_global 0\n"\
+           "add\n"\
+           "store_global 0\n"\
+           "push_int 100\n"\
+           "load_global 0\n"\
+           "if_less 5\n"\
+           "load_global 1\n"\
+           "print\n"\
+           "exit\n"
+    out, err, jit = _run_with_jit(capsys, text)
+    assert out == "4950\n"
+    assert jit.stats == {"compiled": 1, "entered": 1, "aborted": 0}
+
+# ループ (スタック上の値を使うループ)
+def test_jit_stack_loop(capsys):
+    text = "push_float 0\n"\
+           "push_float 1\n"\
+           "add\n"\
+           "dup\n"\
+           "dup\n"\
+           "print\n"\
+           "push_float 10\n"\
+           "if_equal 10\n"\
+           "jump 2\n"\
+           "exit\n"
+    out, err, jit = _run_with_jit(capsys, text)
+    assert out == "".join(f"{i}.0\n" for i in range(1, 11))
+    assert jit.stats["compiled"] == 1
+
+# 型ガードが外れた場合 (整数のループ後に実数で再びループに入る)
+def test_jit_type_guard(capsys):
+    text = "push_int 0\n"\
+           "call 7\n"\
+           "push_float 0.5\n"\
+           "call 7\n"\
+           "exit\n"\
+           "\n"\
+           "store_local 0\n"\
+           "load_local 0\n"\
+           "push_int 1\n"\
+           "add\n"\
+           "store_local 0\n"\
+           "push_int 5\n"\
+           "load_local 0\n"\
+           "if_less 8\n"\
+           "load_local 0\n"\
+           "print\n"\
+           "exit\n"
+    out, err, jit = _run_with_jit(capsys, text)
+    assert out == "5\n5.5\n"
+    assert jit.stats["compiled"] == 1
+
+# ループ内でのエラー (配列に異なる型を格納)
+def test_jit_error_in_loop(capsys):
+    text = "new_array_float 10\n"\
+           "store_global 0\n"\
+           "push_float 1.5\n"\
+           "store_global 2\n"\
+           "push_int 0\n"\
+           "store_global 1\n"\
+           "load_global 2\n"\
+           "load_global 1\n"\
+           "store_global_array 0\n"\
+           "push_int 1\n"\
+           "load_global 1\n"\
+           "add\n"\
+           "store_global 1\n"\
+           "push_int 5\n"\
+           "load_global 1\n"\
+           "if_less 7\n"\
+           "push_int 7\n"\
+           "store_global 2\n"\
+           "push_int 0\n"\
+           "store_global 1\n"\
+           "jump 7\n"
+    out, err, jit = _run_with_jit(capsys, text)
+    assert err == f"{_color_red}syntax error (mismatching array type): line 9, \"store_global_array 0\"{_color_reset}\n"
+    assert jit.stats["entered"] == 2
+
+# ループ内で負の添字 (トレースから戻ってエラーにする)
+def test_jit_negative_index(capsys):
+    text = "new_array_int 4\n"\
+           "store_global 0\n"\
+           "push_int 3\n"\
+           "store_global 1\n"\
+           "load_global 1\n"\
+           "load_global_array 0\n"\
+           "print\n"\
+           "push_int -1\n"\
+           "load_global 1\n"\
+           "add\n"\
+           "store_global 1\n"\
+           "push_int -3\n"\
+           "load_global 1\n"\
+           "if_greater 5\n"\
+           "exit\n"
+    out, err, jit = _run_with_jit(capsys, text)
+    assert out == "0\n" * 4
+    assert err == f"{_color_red}index error (array index out of range): line 6, \"load_global_array 0\"{_color_reset}\n"
+    assert jit.stats["entered"] == 1
+
+
+# ==============================
+#          実行統計
+# ==============================
+import json
+
+# 正常終了
+def test_stats_json(capsys, monkeypatch):
+    monkeypatch.setattr(virtual_machine, "stats_format", "json")
+    text = "push_int 2\n"\
+           "call 6\n"\
+           "new_array_int 3\n"\
+           "print\n"\
+           "exit\n"\
+           "push_int 1\n"\
+           "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    stats = json.loads(err)
+    assert exit_info.value.code == 0
+    assert stats["exit_code"] == 0
+    assert stats["instructions_retired"] == 7
+    assert stats["max_data_stack_depth"] == 3
+    assert stats["max_return_stack_depth"] == 1
+    assert stats["calls"] == 1
+    assert stats["arrays_allocated"] == 1
+    assert set(stats["phases_ns"]) == {"load", "parse", "verify", "execute"}
+
+# エラー終了 (ファイルへ出力)
+def test_stats_error(capsys, monkeypatch, tmp_path):
+    path = tmp_path / "stats.json"
+    monkeypatch.setattr(virtual_machine, "stats_format", "json")
+    monkeypatch.setattr(virtual_machine, "stats_path", str(path))
+    text = "push_float 7\n"\
+           "add\n"\
+           "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    stats = json.loads(path.read_text())
+    assert err == f"{_color_red}index error (pop from empty): line 2, \"add\"{_color_reset}\n"
+    assert stats["exit_code"] == 1
+    assert stats["line"] == 2
+    assert stats["instructions_retired"] == 2
+
+# 構文エラーでも実行統計を出力する
+def test_stats_parse_error(capsys, monkeypatch, tmp_path):
+    path = tmp_path / "program.txt"
+    path.write_text("push_int 1x\n"\
+                    "exit\n")
+    monkeypatch.setattr(virtual_machine, "stats_format", "json")
+    with pytest.raises(ValueError):
+        virtual_machine.run(path.read_text(), 0, str(path))
+
+    out, err = capsys.readouterr()
+    stats = json.loads(err)
+    assert stats["exit_code"] == 1
+    assert stats["error"] == "ValueError"
+    assert stats["phases_ns"]["parse"] > 0
+
+
+# ==============================
+#      パース済みプログラム
+# ==============================
+# 文字列とファイルから同じ命令列を作る (末尾の改行の後の空行は命令に含めない)
+def test_program_file(tmp_path):
+    text = "push_int 1\n"\
+           "print # comment\n"\
+           "\n"
+    path = tmp_path / "program.txt"
+    path.write_text(text)
+    from_text = virtual_machine.Program(text)
+    from_file = virtual_machine.Program.load(str(path))
+    assert len(from_text) == 3
+    assert from_file.instructions() == from_text.instructions()
+    assert from_file.text is None
+    assert from_file.source_line(1) == from_text.source_line(1) == "print # comment"
+    assert from_file.source_line(2) == ""
+
+    empty = tmp_path / "empty.txt"
+    empty.write_text("")
+    assert len(virtual_machine.Program.load(str(empty))) == len(virtual_machine.Program("")) == 0
+
+# 命令名が256種類を超えると命令名の番号の配列を広げる
+def test_program_many_opcodes():
+    text = "".join(f"op{i} {i}\n" for i in range(300))
+    program = virtual_machine.Program(text)
+    assert program.opcodes.typecode == "H"
+    assert len(program) == 300
+    assert program.opcode(299) == "op299"
+    assert program.operand(299) == (299.0,)
+
+
+# ==============================
+#          差分テスト
+# ==============================
+import difftest
+
+# 掛け算を足し算として実行する誤ったエンジン
+class _BuggyVirtualMachine(virtual_machine.VirtualMachine):
+    def cmd_mul(self):
+        self.data_stack.push(self.data_stack.pop() + self.data_stack.pop())
+
+# 生成したプログラムが参照実装とJITで一致する
+def test_difftest_jit():
+    assert difftest.run(50, seed=0, jobs=1, engines=["jit"]) == []
+
+# 不一致を検出して最小のプログラムに縮小する
+def test_difftest_shrink(monkeypatch):
+    monkeypatch.setitem(difftest.ENGINES, "buggy", lambda text: _BuggyVirtualMachine(text, False))
+    mismatches = difftest.run(20, seed=0, jobs=1, engines=["buggy"])
+    assert mismatches
+    for seed, text, (engine, expected, actual) in mismatches:
+        assert engine == "buggy"
+        assert expected != actual
+        assert "mul" in text
+        assert len(text.splitlines()) <= 16
+
+# 縮小後の再実行で一致した場合は最初の不一致を報告する
+def test_difftest_flaky(monkeypatch):
+    results = iter([("flaky", "1\n", "2\n")])
+    monkeypatch.setattr(difftest, "compare", lambda program, engines, timeout=None: next(results, None))
+    seed, text, mismatch = difftest.check((0, ["flaky"]))
+    assert mismatch == ("flaky", "1\n", "2\n")
+    assert text == difftest.assemble(difftest.generate(0))
+
+
+# ==============================
+#          文字出力
+# ==============================
+
+# 文字コード・文字を改行なしで出力
+def test_print_char(capsys):
+    text = "push_float 10\n"\
+           "push_char 105\n"\
+           "push_int 72\n"\
+           "print_char\n"\
+           "print_char\n"\
+           "print_char\n"\
+           "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert out == "Hi\n"
+    assert exit_info.value.code == 0
+
+# 文字型配列をまとめて出力 ('\0'の手前まで・範囲指定)
+def test_print_array(capsys):
+    text = "new_array_char 8\n"\
+           "store_global 0\n"\
+           "push_char 65\n"\
+           "push_int 0\n"\
+           "store_global_array 0\n"\
+           "push_char 12354\n"\
+           "push_int 1\n"\
+           "store_global_array 0\n"\
+           "push_char 67\n"\
+           "push_int 2\n"\
+           "store_global_array 0\n"\
+           "print_global_array 0\n"\
+           "push_int 2\n"\
+           "push_int 1\n"\
+           "print_global_array_slice 0\n"\
+           "call 18\n"\
+           "exit\n"\
+           "new_array_char 2\n"\
+           "store_local 0\n"\
+           "push_char 120\n"\
+           "push_int 1\n"\
+           "store_local_array 0\n"\
+           "push_int 2\n"\
+           "push_int 0\n"\
+           "print_local_array_slice 0\n"\
+           "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert out == "AあCあC\0x"
+    assert exit_info.value.code == 0
+
+# 格納していない文字型配列の要素は'\0' (整数0ではない)
+def test_char_array_initial_value(capsys):
+    text = "new_array_char 3\n"\
+           "store_global 0\n"\
+           "push_int 0\n"\
+           "load_global_array 0\n"\
+           "dup\n"\
+           "dup\n"\
+           "push_char 0\n"\
+           "if_equal 10\n"\
+           "exit\n"\
+           "push_int 0\n"\
+           "if_equal 9\n"\
+           "print_char\n"\
+           "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert out == "\0"
+    assert exit_info.value.code == 0
+
+# 範囲外の出力
+def test_error_print_array_out_of_range(capsys):
+    text = "new_array_char 2\n"\
+           "store_global 0\n"\
+           "push_int 2\n"\
+           "push_int 1\n"\
+           "print_global_array_slice 0\n"\
+           "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert err == f"{_color_red}index error (array index out of range): line 5, \"print_global_array_slice 0\"{_color_reset}\n"
+    assert exit_info.value.code == 1
+
+# 文字型でない配列の出力
+def test_error_print_array_type(capsys):
+    text = "new_array_int 2\n"\
+           "store_global 0\n"\
+           "print_global_array 0\n"\
+           "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert err == f"{_color_red}syntax error (mismatching array type): line 3, \"print_global_array 0\"{_color_reset}\n"
+    assert exit_info.value.code == 1
+
+
+# ==============================
+#     メモリマップした配列
+# ==============================
+import array
+
+# ファイルパスを文字型配列としてグローバル変数nに格納するプログラム
+def _path_program(path, n):
+    path = str(path)
+    text = f"new_array_char {len(path) + 1}\n"\
+           f"store_global {n}\n"
+    for i, c in enumerate(path):
+        text += f"push_char {ord(c)}\n"\
+                f"push_int {i}\n"\
+                f"store_global_array {n}\n"
+    return text
+
+# 読み込み専用
+def test_map_file_read_only(capsys, tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(array.array("q", [10, 20, 30]).tobytes())
+    text = _path_program(path, 0)
+    n = len(text.splitlines())
+    text += "load_global 0\n"\
+            "map_file_int 0\n"\
+            "store_global 1\n"\
+            "push_int 2\n"\
+            "load_global_array 1\n"\
+            "push_int 0\n"\
+            "load_global_array 1\n"\
+            "add\n"\
+            "print\n"\
+            "push_int 1\n"\
+            "push_int 0\n"\
+            "store_global_array 1\n"\
+            "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert out == "40\n"
+    assert err == f"{_color_red}value error (read-only array): line {n + 12}, \"store_global_array 1\"{_color_reset}\n"
+    assert exit_info.value.code == 1
+
+# 書き込み可能 (syncでファイルに反映) とcopy-on-write (ファイルは変更しない)
+def test_map_file_writable(capsys, tmp_path):
+    shared = tmp_path / "shared.bin"
+    copy = tmp_path / "copy.bin"
+    shared.write_bytes(array.array("d", [1.5, 2.5]).tobytes())
+    copy.write_bytes(array.array("d", [1.5, 2.5]).tobytes())
+    text = _path_program(shared, 0) + _path_program(copy, 1)
+    text += "load_global 0\n"\
+            "map_file_float 2\n"\
+            "store_global 2\n"\
+            "load_global 1\n"\
+            "map_file_float 1\n"\
+            "store_global 3\n"\
+            "push_float 7.0\n"\
+            "push_int 1\n"\
+            "store_global_array 2\n"\
+            "sync_global_array 2\n"\
+            "push_float 8.0\n"\
+            "push_int 0\n"\
+            "store_global_array 3\n"\
+            "push_int 0\n"\
+            "load_global_array 3\n"\
+            "print\n"\
+            "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert out == "8.0\n"
+    assert exit_info.value.code == 0
+    assert list(array.array("d", shared.read_bytes())) == [1.5, 7.0]
+    assert list(array.array("d", copy.read_bytes())) == [1.5, 2.5]
+
+# 存在しないファイル
+def test_error_map_file(capsys, tmp_path):
+    text = _path_program(tmp_path / "none.bin", 0)
+    n = len(text.splitlines())
+    text += "load_global 0\n"\
+            "map_file_int 0\n"\
+            "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert err == f"{_color_red}io error (cannot map file): line {n + 2}, \"map_file_int 0\"{_color_reset}\n"
+    assert exit_info.value.code == 1
+
+
+# ==============================
+#            入力
+# ==============================
+import io
+import sys
+
+def _stdin(monkeypatch, data):
+    monkeypatch.setattr(sys, "stdin", io.TextIOWrapper(io.BytesIO(data.encode())))
+
+# 入力の終端まで1つずつ読み込む
+def test_read(capsys, monkeypatch):
+    _stdin(monkeypatch, "a 12\n-3 7\n")
+    text = "read_char\n"\
+           "print\n"\
+           "read_int\n"\
+           "dup\n"\
+           "push_eof\n"\
+           "if_equal 9\n"\
+           "print\n"\
+           "jump 3\n"\
+           "read_char\n"\
+           "push_eof\n"\
+           "if_equal 13\n"\
+           "exit\n"\
+           "push_int 0\n"\
+           "print\n"\
+           "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert out == "a\n12\n-3\n7\n0\n"
+    assert exit_info.value.code == 0
+
+# 空白を含む文字と実数の読み込み
+def test_read_char_float(capsys, monkeypatch):
+    _stdin(monkeypatch, " x1.5")
+    text = "read_char\n"\
+           "read_char\n"\
+           "read_float\n"\
+           "print\n"\
+           "print_char\n"\
+           "print_char\n"\
+           "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert out == "1.5\nx "
+    assert exit_info.value.code == 0
+
+# 配列にまとめて読み込む (ファイルから)
+def test_read_array(capsys, monkeypatch, tmp_path):
+    path = tmp_path / "input.txt"
+    path.write_text("1 2 3\n4 5\n")
+    monkeypatch.setattr(virtual_machine, "input_path", str(path))
+    text = "new_array_int 4\n"\
+           "store_global 0\n"\
+           "push_int 3\n"\
+           "push_int 1\n"\
+           "read_global_array 0\n"\
+           "print\n"\
+           "push_int 4\n"\
+           "push_int 0\n"\
+           "read_global_array 0\n"\
+           "print\n"\
+           "push_int 0\n"\
+           "load_global_array 0\n"\
+           "push_int 1\n"\
+           "load_global_array 0\n"\
+           "push_int 3\n"\
+           "load_global_array 0\n"\
+           "print\n"\
+           "print\n"\
+           "print\n"\
+           "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert out == "3\n2\n3\n5\n4\n"
+    assert exit_info.value.code == 0
+
+# 数値に変換できない入力
+def test_error_invalid_input(capsys, monkeypatch):
+    _stdin(monkeypatch, "1 x\n")
+    text = "read_int\n"\
+           "read_int\n"\
+           "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert err == f"{_color_red}value error (invalid input): line 2, \"read_int\"{_color_reset}\n"
+    assert exit_info.value.code == 1
+
+
+# ==============================
+#    サンプリングプロファイラ
+# ==============================
+from vm_modules import vm_profiler
+
+# 命令数毎のサンプリング
+def test_profiler_every(capsys):
+    text = "call 4\n"\
+           "call 4\n"\
+           "exit\n"\
+           "call 6\n"\
+           "exit\n"\
+           "push_int 1\n"\
+           "print\n"\
+           "exit\n"
+    vm = virtual_machine.VirtualMachine(text, False)
+    profiler = vm_profiler.SamplingProfiler(every=1)
+    profiler.start(vm)
+    with pytest.raises(SystemExit) as exit_info:
+        vm.run()
+    profiler.stop()
+
+    assert profiler.collapsed() == "main 3\nmain;sub_4 4\nmain;sub_4;sub_6 6\n"
+    table = profiler.table().splitlines()
+    assert table[1].split() == ["13", "100.0%", "3", "23.1%", "main"]
+    assert table[2].split() == ["10", "76.9%", "4", "30.8%", "sub_4"]
+    assert table[3].split() == ["6", "46.2%", "6", "46.2%", "sub_6"]
+    assert not vm.hooks.is_active()
+
+# タイマーによるサンプリング (ファイルへ出力)
+def test_profiler_timer(capsys, monkeypatch, tmp_path):
+    path = tmp_path / "profile.txt"
+    monkeypatch.setattr(virtual_machine, "profile_path", str(path))
+    monkeypatch.setattr(virtual_machine, "profile_interval", 0.001)
+    text = "push_int 0\n"\
+           "call 5\n"\
+           "print\n"\
+           "exit\n"\
+           "push_int 1\n"\
+           "add\n"\
+           "dup\n"\
+           "push_int 30000\n"\
+           "if_equal 11\n"\
+           "jump 5\n"\
+           "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert out == "30000\n"
+    assert "total samples" in err
+    samples = dict(line.rsplit(" ", 1) for line in path.read_text().splitlines())
+    assert int(samples["main;sub_5"]) > 0
+
+
+# ==============================
+#          常駐サーバー
+# ==============================
+import server
+import threading
+
+# 同じプログラムの2回目以降はキャッシュ済みのプログラムを実行する
+def test_server(tmp_path):
+    path = tmp_path / "program.txt"
+    path.write_text("read_int\n"\
+                    "push_int 1\n"\
+                    "add\n"\
+                    "print\n"\
+                    "exit\n")
+    address = str(tmp_path / "vm.sock")
+    vm_server = server.create_server(address, n_workers=2)
+    thread = threading.Thread(target=vm_server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        first = server.request(address, {"path": str(path), "input": "41"})
+        second = server.request(address, {"source": path.read_text(), "input": "1", "jit": True})
+        error = server.request(address, {"source": "pop\n"})
+        missing = server.request(address, {"path": str(tmp_path / "missing.txt")})
+        stats = server.request(address, {"command": "stats"})
+    finally:
+        vm_server.shutdown()
+        vm_server.server_close()
+        vm_server.pool.close()
+
+    assert (first["stdout"], first["exit_code"], first["cached"]) == ("42\n", 0, False)
+    assert (second["stdout"], second["exit_code"], second["cached"]) == ("2\n", 0, True)
+    assert error["exit_code"] == 1
+    assert "undefined opcode" in error["stderr"]
+    assert "error" in missing
+    assert (stats["requests"], stats["cache_hits"], stats["hit_rate"]) == (3, 1, 1 / 3)
+    assert 0 < stats["p50"] <= stats["p99"]
+
+# Unixドメインソケットのパスに既存のファイルがあれば削除せずにエラー
+def test_server_existing_file(tmp_path):
+    path = tmp_path / "data.txt"
+    path.write_text("keep")
+    with pytest.raises(FileExistsError):
+        server.create_server(str(path), n_workers=1)
+    assert path.read_text() == "keep"
+
+# LRUで古いプログラムから捨てる
+def test_server_cache():
+    cache = server.ProgramCache(2)
+    for key in ("a", "b", "c"):
+        reply = server.execute(cache, key, "push_int 1\nprint\nexit\n")
+        assert (reply["stdout"], reply["cached"]) == ("1\n", False)
+    assert cache.get("a") is None
+    assert server.execute(cache, "c", "")["cached"]
+
+
+# ==============================
+#         データ並列実行
+# ==============================
+from vm_modules import vm_parallel
+
+# 各添字の戻り値を配列に格納し，標準出力は添字の順に出力する
+@pytest.mark.parametrize("workers", [1, 2])
+def test_parallel_for(capsys, monkeypatch, workers):
+    monkeypatch.setattr(vm_parallel, "workers", workers)
+    text = "new_array_int 10\n"\
+           "store_global 0\n"\
+           "push_int 3\n"\
+           "store_global 1\n"\
+           "push_int 9\n"\
+           "push_int 1\n"\
+           "parallel_for 17 0\n"\
+           "push_int 9\n"\
+           "load_global_array 0\n"\
+           "print\n"\
+           "push_int 0\n"\
+           "load_global_array 0\n"\
+           "print\n"\
+           "load_global 1\n"\
+           "print\n"\
+           "exit\n"\
+           "dup\n"\
+           "print\n"\
+           "load_global 1\n"\
+           "mul\n"\
+           "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert out == "".join(f"{i}\n" for i in range(1, 10)) + "27\n0\n3\n"
+    assert exit_info.value.code == 0
+
+# 最初にエラーになった添字までの出力とエラーメッセージ
+@pytest.mark.parametrize("workers", [1, 3])
+def test_parallel_for_error(capsys, monkeypatch, workers):
+    monkeypatch.setattr(vm_parallel, "workers", workers)
+    text = "new_array_int 8\n"\
+           "store_global 0\n"\
+           "push_int 8\n"\
+           "push_int 0\n"\
+           "parallel_for 7 0\n"\
+           "exit\n"\
+           "dup\n"\
+           "dup\n"\
+           "print\n"\
+           "push_int 5\n"\
+           "if_equal 13\n"\
+           "exit\n"\
+           "load_local 0\n"\
+           "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert out == "0\n1\n2\n3\n4\n5\n"
+    assert err == f"{_color_red}syntax error (undefined variable): line 13, \"load_local 0\"{_color_reset}\n"
+    assert exit_info.value.code == 1
+
+# 各呼び出しは開始時点のグローバル変数から始まる (ワーカー数に関わらず同じ結果)
+@pytest.mark.parametrize("workers", [1, 2])
+def test_parallel_for_global_store(capsys, monkeypatch, workers):
+    monkeypatch.setattr(vm_parallel, "workers", workers)
+    text = "new_array_int 4\n"\
+           "store_global 0\n"\
+           "push_int 3\n"\
+           "store_global 1\n"\
+           "push_int 4\n"\
+           "push_int 0\n"\
+           "parallel_for 14 0\n"\
+           "push_int 3\n"\
+           "load_global_array 0\n"\
+           "print\n"\
+           "load_global 1\n"\
+           "print\n"\
+           "exit\n"\
+           "load_global 1\n"\
+           "add\n"\
+           "dup\n"\
+           "store_global 1\n"\
+           "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert out == "6\n3\n"
+    assert exit_info.value.code == 0
+
+# ワーカーはファイルをマップした配列を同じファイルのマップとして読み書きする
+def test_parallel_for_mapped(capsys, monkeypatch, tmp_path):
+    monkeypatch.setattr(vm_parallel, "workers", 2)
+    path = tmp_path / "data.bin"
+    path.write_bytes(array.array("q", [0] * 6).tobytes())
+    text = _path_program(path, 0)
+    n = len(text.splitlines())
+    text += "load_global 0\n"\
+            "map_file_int 2\n"\
+            "store_global 1\n"\
+            "push_int 6\n"\
+            "push_int 0\n"\
+            f"parallel_for {n + 12} 1\n"\
+            "sync_global_array 1\n"\
+            "push_int 5\n"\
+            "load_global_array 1\n"\
+            "print\n"\
+            "exit\n"\
+            "dup\n"\
+            "mul\n"\
+            "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert out == "25\n"
+    assert exit_info.value.code == 0
+    assert list(array.array("q", path.read_bytes())) == [0, 1, 4, 9, 16, 25]
+
+# サブルーチンから到達できる命令が参照するグローバル変数 (callの飛び先を含む)
+def test_parallel_referenced_globals():
+    text = "push_int 1\n"\
+           "store_global 5\n"\
+           "exit\n"\
+           "load_global 1\n"\
+           "push_int 0\n"\
+           "if_equal 8\n"\
+           "call 10\n"\
+           "load_global_array 2\n"\
+           "exit\n"\
+           "load_global 3\n"\
+           "exit\n"
+    vm = virtual_machine.VirtualMachine(text, False)
+    vm.check_syntax()
+    assert vm_parallel.referenced_globals(vm.program, 4) == {1, 2, 3}
+
+
+
+# ==============================
+#          VMスレッド
+# ==============================
+# lock・unlockで囲んだグローバル変数の更新はスレッド間で失われない
+def _thread_program(n):
+    return "push_int 0\n"\
+           "store_global 0\n"\
+           f"push_int {n}\n"\
+           "spawn 18\n"\
+           "store_global 1\n"\
+           f"push_int {n}\n"\
+           "spawn 18\n"\
+           "store_global 2\n"\
+           "load_global 1\n"\
+           "join\n"\
+           "load_global 2\n"\
+           "join\n"\
+           "add\n"\
+           "print\n"\
+           "load_global 0\n"\
+           "print\n"\
+           "exit\n"\
+           "store_local 0\n"\
+           "push_int 0\n"\
+           "store_local 1\n"\
+           "lock 0\n"\
+           "load_global 0\n"\
+           "push_int 1\n"\
+           "add\n"\
+           "store_global 0\n"\
+           "unlock 0\n"\
+           "load_local 1\n"\
+           "push_int 1\n"\
+           "add\n"\
+           "dup\n"\
+           "store_local 1\n"\
+           "load_local 0\n"\
+           "if_equal 35\n"\
+           "jump 21\n"\
+           "load_local 1\n"\
+           "exit\n"
+
+def test_thread(capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(_thread_program(2000))
+
+    out, err = capsys.readouterr()
+    assert out == "4000\n4000\n"
+    assert exit_info.value.code == 0
+
+# スレッドのエラーはそのスレッドの行で出力し，joinしたスレッドも終了する
+def test_thread_error(capsys):
+    text = "push_int 1\n"\
+           "spawn 5\n"\
+           "join\n"\
+           "exit\n"\
+           "add\n"\
+           "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert err == f"{_color_red}index error (pop from empty): line 5, \"add\"{_color_reset}\n"
+    assert exit_info.value.code == 1
+
+@pytest.mark.parametrize("text, message", [
+    ("push_int 7\njoin\nexit\n", "value error (invalid thread): line 2, \"join\""),
+    ("unlock 3\nexit\n", "value error (release unlocked lock): line 1, \"unlock 3\""),
+])
+def test_error_thread(capsys, text, message):
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert err == f"{_color_red}{message}{_color_reset}\n"
+    assert exit_info.value.code == 1
+
+
+# ==============================
+#        配列の再利用プール
+# ==============================
+# サブルーチンで確保したローカル配列を再利用する (0埋めされる)
+def _pool_program(leave):
+    return "push_int 0\n"\
+           "store_global 0\n"\
+           "call 12\n"\
+           "load_global 0\n"\
+           "push_int 1\n"\
+           "add\n"\
+           "dup\n"\
+           "store_global 0\n"\
+           "push_int 5\n"\
+           "if_greater 3\n"\
+           "exit\n"\
+           "new_array_int 4\n"\
+           "store_local 0\n"\
+           "push_int 1\n"\
+           "load_local_array 0\n"\
+           "print\n"\
+           "push_int 7\n"\
+           "push_int 1\n"\
+           "store_local_array 0\n" + leave +\
+           "exit\n"
+
+@pytest.mark.skipif(not virtual_machine.vm_array.pool_supported(), reason="プールを使わない処理系")
+@pytest.mark.parametrize("leave, hits", [
+    ("", 4),
+    ("free_local 0\n", 4),
+    ("load_local 0\nstore_global 1\n", 0), # グローバル変数に格納
+    ("load_local 0\n", 0),                 # スタックに残す
+])
+def test_array_pool(capsys, monkeypatch, leave, hits):
+    monkeypatch.setattr(virtual_machine, "array_pool_bytes", 1 << 20)
+    vm = virtual_machine.VirtualMachine(_pool_program(leave), False)
+    with pytest.raises(SystemExit) as exit_info:
+        vm.run()
+
+    out, err = capsys.readouterr()
+    assert out == "0\n" * 5
+    assert (vm.array_pool.hits, vm.array_pool.misses) == (hits, 5 - hits)
+
+# 上限を超える配列はプールしない
+@pytest.mark.skipif(not virtual_machine.vm_array.pool_supported(), reason="プールを使わない処理系")
+def test_array_pool_limit(capsys, monkeypatch):
+    monkeypatch.setattr(virtual_machine, "array_pool_bytes", 16)
+    vm = virtual_machine.VirtualMachine(_pool_program(""), False)
+    with pytest.raises(SystemExit) as exit_info:
+        vm.run()
+
+    assert vm.array_pool.stats() == {"hits": 0, "misses": 5, "pooled_bytes": 0}
+
+# 参照カウントでの判定を確認していない処理系ではプールしない
+def test_array_pool_unsupported(capsys, monkeypatch):
+    monkeypatch.setattr(virtual_machine, "array_pool_bytes", 1 << 20)
+    monkeypatch.setattr(sys, "version_info", (3, 14, 0))
+    vm = virtual_machine.VirtualMachine(_pool_program(""), False)
+    with pytest.raises(SystemExit) as exit_info:
+        vm.run()
+
+    assert vm.array_pool is None
+    assert exit_info.value.code == 0
+
+
+# ==============================
+#          インライン展開
+# ==============================
+from vm_modules import vm_inliner
+
+# 呼び出しを展開しても結果は同じ (ローカル変数は付け替える)
+def test_inline(capsys, monkeypatch):
+    monkeypatch.setattr(virtual_machine, "inline_flag", True)
+    monkeypatch.setattr(virtual_machine, "inline_report_flag", True)
+    text = "push_int 5\n"\
+           "store_local 0\n"\
+           "push_int 1\n"\
+           "call 10\n"\
+           "push_int 2\n"\
+           "call 10\n"\
+           "load_local 0\n"\
+           "print\n"\
+           "exit\n"\
+           "store_local 0\n"\
+           "load_local 0\n"\
+           "load_local 0\n"\
+           "mul\n"\
+           "print\n"\
+           "exit\n"\
+           "call 16\n"\
+           "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert out == "1\n4\n5\n"
+    assert err == "inline: sub_10 (5 instructions) at line 4, 6\n"\
+                  "inline: sub_16 skipped (recursive)\n"
+    assert exit_info.value.code == 0
+
+# プロファイラのサブルーチン名は元のプログラムの行で表す
+def test_inline_profile(capsys):
+    text = "call 5\n"\
+           "call 8\n"\
+           "exit\n"\
+           "exit\n"\
+           "push_int 1\n"\
+           "print\n"\
+           "exit\n"\
+           "push_int 2\n"\
+           "dup\n"\
+           "push_int 2\n"\
+           "if_equal 13\n"\
+           "exit\n"\
+           "print\n"\
+           "exit\n"
+    vm = virtual_machine.VirtualMachine(text, False)
+    vm.inline = True
+    profiler = vm_profiler.SamplingProfiler(every=1)
+    profiler.start(vm)
+    with pytest.raises(SystemExit) as exit_info:
+        vm.run()
+    profiler.stop()
+
+    assert vm.program.inlined[0]["line"] == 5
+    assert {stack[-1] for stack in profiler.samples} == {"main", "sub_8"}
+    assert exit_info.value.code == 0
+
+# 展開した命令のエラーは元の行番号で表示する
+def test_inline_error_line(capsys):
+    text = "push_int 1\n"\
+           "call 5\n"\
+           "print\n"\
+           "exit\n"\
+           "push_int 0\n"\
+           "div\n"\
+           "pop\n"\
+           "exit\n"
+    vm = virtual_machine.VirtualMachine(text, False)
+    vm.inline = True
+    with pytest.raises(SystemExit) as exit_info:
+        vm.run()
+
+    out, err = capsys.readouterr()
+    assert vm.program.inlined == [{"line": 5, "size": 3, "sites": [2]}]
+    assert vm.program.opcode(3) == "pop"
+    assert err == f"{_color_red}syntax error (undefined opcode): line 7, \"pop\"{_color_reset}\n"
+    assert exit_info.value.code == 1
+
+# 格納前に参照するローカル変数・複数のexitがあれば展開しない
+def test_inline_skipped():
+    text = "call 4\n"\
+           "call 6\n"\
+           "exit\n"\
+           "load_local 0\n"\
+           "exit\n"\
+           "push_int 1\n"\
+           "if_equal 9\n"\
+           "exit\n"\
+           "exit\n"
+    vm = virtual_machine.VirtualMachine(text, False)
+    vm.check_syntax()
+    program = vm_inliner.inline(vm.program)
+
+    assert program.inlined == []
+    assert program.inline_skipped == {4: "local used before store", 6: "multiple exits"}
+
+
+# ==============================
+#           2次元配列
+# ==============================
+from vm_modules import vm_matrix
+
+# 2x3の行列 [[1, 2, 3], [4, 5, 6]] をグローバル変数0に作るプログラム
+def _matrix_program():
+    text = "new_matrix_int 2 3\n"\
+           "store_global 0\n"
+    for row in range(2):
+        for col in range(3):
+            text += f"push_int {row * 3 + col + 1}\n"\
+                    f"push_int {col}\n"\
+                    f"push_int {row}\n"\
+                    "store_global_matrix 0\n"
+    return text
+
+@pytest.fixture(params=["numpy", "list"])
+def matrix_backend(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(vm_matrix, "numpy", None)
+
+# 添字2つでの読み書きと行列演算
+def test_matrix(capsys, matrix_backend):
+    text = _matrix_program() +\
+           "push_int 2\n"\
+           "push_int 1\n"\
+           "load_global_matrix 0\n"\
+           "print\n"\
+           "load_global 0\n"\
+           "transpose\n"\
+           "load_global 0\n"\
+           "matmul\n"\
+           "print\n"\
+           "load_global 0\n"\
+           "dup\n"\
+           "add\n"\
+           "push_int 1\n"\
+           "sub\n"\
+           "print\n"\
+           "load_global 0\n"\
+           "push_float 2\n"\
+           "div\n"\
+           "print\n"\
+           "load_global 0\n"\
+           "row_sum\n"\
+           "store_global 1\n"\
+           "push_int 1\n"\
+           "load_global_array 1\n"\
+           "print\n"\
+           "load_global 0\n"\
+           "col_sum\n"\
+           "store_global 1\n"\
+           "push_int 2\n"\
+           "load_global_array 1\n"\
+           "print\n"\
+           "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert out == "6\n"\
+                  "14 32\n32 77\n"\
+                  "-1 -3 -5\n-7 -9 -11\n"\
+                  "2.0 1.0 0.6666666666666666\n0.5 0.4 0.3333333333333333\n"\
+                  "15\n"\
+                  "9\n"
+    assert exit_info.value.code == 0
+
+# 範囲外の添字・型の異なる値・大きさの合わない演算
+# 64ビットに収まらない整数も桁あふれしない (どちらの実装でも同じ結果)
+def test_matrix_big_int(capsys, matrix_backend):
+    text = "new_matrix_int 1 1\n"\
+           "store_global 0\n"\
+           "push_int 1099511627776\n"\
+           "push_int 0\n"\
+           "push_int 0\n"\
+           "store_global_matrix 0\n"\
+           "load_global 0\n"\
+           "load_global 0\n"\
+           "matmul\n"\
+           "print\n"\
+           "push_int 18446744073709551616\n"\
+           "push_int 0\n"\
+           "push_int 0\n"\
+           "store_global_matrix 0\n"\
+           "push_int 0\n"\
+           "push_int 0\n"\
+           "load_global_matrix 0\n"\
+           "print\n"\
+           "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert out == f"{2 ** 80}\n{2 ** 64}\n"
+    assert exit_info.value.code == 0
+
+@pytest.mark.parametrize("code, message", [
+    ("push_int 0\npush_int 3\npush_int 0\nstore_global_matrix 0\n", "index error (array index out of range)"),
+    ("push_int -1\npush_int 0\nload_global_matrix 0\n", "index error (array index out of range)"),
+    ("push_float 1\npush_int 0\npush_int 0\nstore_global_matrix 0\n", "syntax error (mismatching array type)"),
+    ("load_global 0\nload_global 0\nmatmul\n", "value error (mismatching matrix shape)"),
+    ("load_global 0\ntranspose\nload_global 0\nadd\n", "value error (mismatching matrix shape)"),
+])
+def test_matrix_error(capsys, matrix_backend, code, message):
+    text = _matrix_program() + code + "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    n_line = len(text.splitlines()) - 1
+    assert err.startswith(f"{_color_red}{message}: line {n_line},")
+    assert exit_info.value.code == 1
+
+
+# ==============================
+#       実行中の状態の出力
+# ==============================
+from vm_modules import vm_monitor
+import signal
+
+# SIGUSR1を受け取ると実行中の位置・スタックの深さ・配列のバイト数を出力する
+@pytest.mark.skipif(not hasattr(signal, "SIGUSR1"), reason="SIGUSR1がない環境")
+def test_monitor_signal(capsys):
+    text = "new_array_int 10\n"\
+           "store_global 0\n"\
+           "push_int 1\n"\
+           "push_int 2\n"\
+           "call 7\n"\
+           "exit\n"\
+           "new_array_float 4\n"\
+           "print\n"\
+           "exit\n"
+    vm = virtual_machine.VirtualMachine(text, False)
+    monitor = vm_monitor.Monitor()
+    monitor.start(vm)
+    def on_instruction(vm, line, opcode, operand):
+        if line == 8:
+            signal.raise_signal(signal.SIGUSR1)
+    vm.hooks.add_trace(on_instruction)
+    with pytest.raises(SystemExit) as exit_info:
+        vm.run()
+    monitor.stop()
+
+    out, err = capsys.readouterr()
+    report = dict(line.split(": ", 1) for line in err.splitlines()[1:] if ": " in line)
+    assert report["line"] == "8"
+    assert report["code"] == "print"
+    assert report["instructions_retired"] == "6"
+    assert report["data_stack_depth"] == "3"
+    assert report["return_stack_depth"] == "1"
+    assert report["live_array_bytes"] == str(10 * 8 + 4 * 8)
+    assert signal.getsignal(signal.SIGUSR1) is not monitor._on_signal
+
+# 一定時間毎にファイルへ追記する (実行ループの途中の命令数を数える)
+def test_monitor_heartbeat(capsys, monkeypatch, tmp_path):
+    path = tmp_path / "monitor.txt"
+    monkeypatch.setattr(virtual_machine, "heartbeat_interval", 0.05)
+    monkeypatch.setattr(virtual_machine, "monitor_path", str(path))
+    text = "push_int 0\n"\
+           "push_int 1\n"\
+           "add\n"\
+           "dup\n"\
+           "push_int 100000\n"\
+           "if_equal 8\n"\
+           "jump 2\n"\
+           "print\n"\
+           "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert out == "100000\n"
+    assert err == ""
+    dumps = path.read_text().split("monitor: ")[1:]
+    assert len(dumps) >= 2
+    retired = [int(line.split(": ")[1]) for dump in dumps for line in dump.splitlines()
+               if line.startswith("instructions_retired")]
+    assert 0 < retired[0] < retired[1]
+    assert "hot_lines:" in dumps[0]
+
+# JITのトレースの実行中はトレースの先頭の行を出力し，命令数はループ1周毎に数える
+def test_monitor_jit(capsys, tmp_path):
+    path = tmp_path / "monitor.txt"
+    text = "push_int 0\n"\
+           "push_int 1\n"\
+           "add\n"\
+           "dup\n"\
+           "push_int 2000000\n"\
+           "if_equal 8\n"\
+           "jump 2\n"\
+           "print\n"\
+           "exit\n"
+    vm = virtual_machine.VirtualMachine(text, False, virtual_machine.vm_jit.JIT(2))
+    monitor = vm_monitor.Monitor(0.05, str(path))
+    monitor.start(vm)
+    with pytest.raises(SystemExit) as exit_info:
+        vm.run()
+    monitor.stop()
+
+    out, err = capsys.readouterr()
+    assert out == "2000000\n"
+    dumps = [dict(line.split(": ", 1) for line in dump.splitlines()[1:] if ": " in line)
+             for dump in path.read_text().split("monitor: ")[1:]]
+    traced = [report for report in dumps if report["jit_trace"] != "None"]
+    assert traced
+    assert traced[0]["jit_trace"] == traced[0]["line"] == "2"
+    assert traced[0]["code"] == "push_int 1"
+    retired = [int(report["instructions_retired"]) for report in traced]
+    assert 0 < retired[0] <= retired[-1] < 6 * 2000000
+
+
+# ==============================
+#       メモリプロファイラ
+# ==============================
+from vm_modules import vm_memory
+
+# 終了時に生存している配列・フレームを確保した位置毎に集計する (エラー終了でも出力する)
+def test_memory_profile(capsys, monkeypatch, tmp_path):
+    path = tmp_path / "memory.json"
+    monkeypatch.setattr(virtual_machine, "memory_profile_path", str(path))
+    text = "new_array_int 10\n"\
+           "store_global 0\n"\
+           "push_int 3\n"\
+           "call 6\n"\
+           "exit\n"\
+           "new_array_float 4\n"\
+           "store_local 0\n"\
+           "new_array_char 16\n"\
+           "store_local 1\n"\
+           "new_array_int 2\n"\
+           "store_local 1\n"\
+           "store_local 2\n"\
+           "push_int 1\n"\
+           "load_local 2\n"\
+           "sub\n"\
+           "dup\n"\
+           "push_int 0\n"\
+           "if_equal 21\n"\
+           "call 6\n"\
+           "exit\n"\
+           "add\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert exit_info.value.code == 1
+    assert "line 6 new_array_float" in err
+    snapshot = json.loads(path.read_text())
+    assert snapshot["live"] == {
+        "line 1 new_array_int": {"count": 1, "bytes": 80},
+        "line 6 new_array_float": {"count": 3, "bytes": 96},
+        "line 10 new_array_int": {"count": 3, "bytes": 48},
+    }
+    assert snapshot["allocated"]["line 8 new_array_char"] == {"count": 3, "bytes": 48}
+    assert snapshot["frames"] == {
+        "line 4 call": {"count": 1, "bytes": vm_memory.FRAME_BYTES},
+        "line 19 call": {"count": 2, "bytes": 2 * vm_memory.FRAME_BYTES},
+    }
+    assert snapshot["live_bytes"] == 80 + 96 + 48 + 3 * vm_memory.FRAME_BYTES
+    assert snapshot["peak_bytes"] >= snapshot["live_bytes"]
+
+# 2つのスナップショットの比較 (増加が大きい順)
+def test_memory_compare():
+    profiler = vm_memory.MemoryProfiler()
+    text = "new_array_int 10\n"\
+           "new_array_int 100\n"\
+           "exit\n"
+    vm = virtual_machine.VirtualMachine(text, False, memory=profiler)
+    vm.pc = 0
+    vm.cmd_new_array_int([10])
+    before = profiler.snapshot()
+    vm.pc = 1
+    vm.cmd_new_array_int([100])
+    vm.data_stack.pop()
+    vm.data_stack.pop()
+    after = profiler.snapshot()
+
+    assert vm_memory.compare(before, after) == [(-80, -1, "line 1 new_array_int")]
+    assert vm_memory.compare(after, before) == [(80, 1, "line 1 new_array_int")]
+    assert profiler.snapshot()["allocated"]["line 2 new_array_int"] == {"count": 1, "bytes": 800}
+
+
+# ==============================
+#      実行時の命令の特殊化
+# ==============================
+# 整数だけを見た命令を特殊化し，統計を表示する
+def test_quicken(capsys, monkeypatch):
+    monkeypatch.setattr(virtual_machine, "quicken_flag", True)
+    monkeypatch.setattr(virtual_machine, "quicken_stats_flag", True)
+    text = "push_int 0\n"\
+           "push_int 1\n"\
+           "add\n"\
+           "dup\n"\
+           "push_int 100\n"\
+           "if_equal 8\n"\
+           "jump 2\n"\
+           "print\n"\
+           "exit\n"
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert out == "100\n"
+    assert err.splitlines()[0] == "quicken: specializations=2 hits=186 deopts=0"
+    assert "  add_int specializations=1 hits=93 deopts=0" in err.splitlines()
+
+# 型の前提が崩れると汎用版で実行し直す (プログラムは書き換えない)
+def test_quicken_deopt(capsys, monkeypatch):
+    monkeypatch.setattr(virtual_machine, "quicken_threshold", 2)
+    monkeypatch.setattr(virtual_machine, "quicken_stats_flag", True)
+    text = "push_int 1\n"\
+           "push_int 2\n"\
+           "call 12\n"\
+           "push_int 3\n"\
+           "call 12\n"\
+           "push_int 4\n"\
+           "call 12\n"\
+           "push_float 0.5\n"\
+           "call 12\n"\
+           "print\n"\
+           "exit\n"\
+           "add\n"\
+           "exit\n"
+    vm = virtual_machine.VirtualMachine(text, False)
+    vm.quicken = True
+    opcodes = list(vm.program.opcodes)
+    with pytest.raises(SystemExit) as exit_info:
+        vm.run()
+
+    out, err = capsys.readouterr()
+    assert out == "10.5\n"
+    assert vm.quickener.stats["add_int"] == [1, 3, 1] # 特殊化した回数, 実行回数, 脱最適化した回数
+    assert vm.quickener.names[vm.quickener.opcodes[11]] == "add_adaptive"
+    assert list(vm.program.opcodes) == opcodes
+
+# キャッシュした配列はグローバル変数が別の配列に変わると使わない
+def test_quicken_global_array(capsys, monkeypatch):
+    monkeypatch.setattr(virtual_machine, "quicken_threshold", 2)
+    monkeypatch.setattr(virtual_machine, "quicken_stats_flag", True)
+    text = "new_array_int 1\n"\
+           "store_global 0\n"\
+           "push_int 5\n"\
+           "push_int 0\n"\
+           "store_global_array 0\n"\
+           "call 20\n"\
+           "call 20\n"\
+           "call 20\n"\
+           "add\n"\
+           "add\n"\
+           "print\n"\
+           "new_array_int 1\n"\
+           "store_global 0\n"\
+           "push_int 7\n"\
+           "push_int 0\n"\
+           "store_global_array 0\n"\
+           "call 20\n"\
+           "print\n"\
+           "exit\n"\
+           "push_int 0\n"\
+           "load_global_array 0\n"\
+           "exit\n"
+    vm = virtual_machine.VirtualMachine(text, False)
+    vm.quicken = True
+    with pytest.raises(SystemExit) as exit_info:
+        vm.run()
+
+    out, err = capsys.readouterr()
+    assert out == "15\n7\n"
+    assert vm.quickener.stats["load_global_array_cached"] == [1, 3, 1]
+
+
+# ==============================
+#     プログラムの実行結果のキャッシュ
+# ==============================
+from vm_modules import vm_result_cache
+import os
+
+def _run_cached(cache, text):
+    with pytest.raises(SystemExit) as exit_info:
+        vm_result_cache.run(cache, text)
+    return exit_info.value.code
+
+# 2回目は実行せずに同じ出力・終了コードを返す (エラーも保存する)
+def test_result_cache(capsys, monkeypatch, tmp_path):
+    cache = vm_result_cache.ResultCache(str(tmp_path))
+    text = "push_int 3\n"\
+           "push_int 4\n"\
+           "add\n"\
+           "print\n"\
+           "push_int 1\n"\
+           "load_global 0\n"\
+           "exit\n"
+    first = _run_cached(cache, text)
+    first_out = capsys.readouterr()
+    monkeypatch.setattr(virtual_machine.VirtualMachine, "run", lambda self: pytest.fail("executed"))
+    second = _run_cached(cache, text)
+
+    assert capsys.readouterr() == first_out
+    assert first_out.out == "7\n"
+    assert "undefined variable" in first_out.err
+    assert first == second == 1
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+# 入力はキーに含める．ファイル・スレッドを使うプログラムはキャッシュしない
+def test_result_cache_key(capsys, monkeypatch, tmp_path):
+    cache = vm_result_cache.ResultCache(str(tmp_path / "cache"))
+    path = tmp_path / "input.txt"
+    monkeypatch.setattr(virtual_machine, "input_path", str(path))
+    text = "read_int\n"\
+           "print\n"\
+           "exit\n"
+    for value in ["5", "6", "5"]:
+        path.write_text(value)
+        assert _run_cached(cache, text) == 0
+        assert capsys.readouterr().out == value + "\n"
+    text = "push_int 0\n"\
+           "spawn 4\n"\
+           "exit\n"\
+           "exit\n"
+    _run_cached(cache, text)
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["uncacheable"], stats["entries"]) == (1, 2, 1, 2)
+
+# 合計サイズを超えると最後に使ったのが古いエントリから削除する
+def test_result_cache_evict(tmp_path):
+    result = {"stdout": "x" * 100, "stderr": "", "exit_code": 0}
+    size = len(json.dumps(result))
+    cache = vm_result_cache.ResultCache(str(tmp_path), max_bytes=2 * size)
+    cache.put("a", result)
+    cache.put("b", result)
+    os.utime(tmp_path / "a.json", ns=(1, 1))
+    os.utime(tmp_path / "b.json", ns=(2, 2))
+    assert cache.get("a") == result # aを使った (bが最も古くなる)
+    cache.put("c", result)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == result and cache.get("c") == result
+    assert cache.stats()["evictions"] == 1
+
+# 負の添字は特殊化版から汎用版に戻ってエラーにする
+def test_quicken_negative_index(capsys, monkeypatch):
+    monkeypatch.setattr(virtual_machine, "quicken_threshold", 1)
+    monkeypatch.setattr(virtual_machine, "quicken_stats_flag", True)
+    text = "new_array_int 2\n"\
+           "store_global 0\n"\
+           "push_int 0\n"\
+           "call 9\n"\
+           "push_int -1\n"\
+           "call 9\n"\
+           "print\n"\
+           "exit\n"\
+           "load_global_array 0\n"\
+           "exit\n"
+    vm = virtual_machine.VirtualMachine(text, False)
+    vm.quicken = True
+    with pytest.raises(SystemExit) as exit_info:
+        vm.run()
+
+    out, err = capsys.readouterr()
+    assert err == f"{_color_red}index error (array index out of range): line 9, \"load_global_array 0\"{_color_reset}\n"
+    assert vm.quickener.stats["load_global_array_cached"] == [1, 2, 1] # 特殊化した回数, 実行回数, 脱最適化した回数
+
+
+# ==============================
+#     ループの配列の検査の巻き上げ
+# ==============================
+from vm_modules import vm_hoist
+from vm_modules import vm_array
+
+# 配列a(4要素)の各要素にiを格納してa[3]を出力する各形のループ
+_HOIST_LOOPS = {
+    # i < 4の間繰り返す
+    "less": "new_array_int 4\n"\
+            "store_global 0\n"\
+            "push_int 0\n"\
+            "store_global 1\n"\
+            "load_global 1\n"\
+            "load_global 1\n"\
+            "store_global_array 0\n"\
+            "push_int 1\n"\
+            "load_global 1\n"\
+            "add\n"\
+            "store_global 1\n"\
+            "push_int 4\n"\
+            "load_global 1\n"\
+            "if_less 5\n",
+    # i == 4で終了 (前判定)
+    "equal": "new_array_int 4\n"\
+             "store_local 0\n"\
+             "push_int 0\n"\
+             "store_local 1\n"\
+             "push_int 4\n"\
+             "load_local 1\n"\
+             "if_equal 16\n"\
+             "load_local 1\n"\
+             "load_local 1\n"\
+             "store_local_array 0\n"\
+             "push_int 1\n"\
+             "load_local 1\n"\
+             "add\n"\
+             "store_local 1\n"\
+             "jump 5\n"\
+             "load_local 0\n"\
+             "store_global 0\n",
+    # i > 3で終了 (前判定，上限は変数)
+    "greater": "new_array_int 4\n"\
+               "store_global 0\n"\
+               "push_int 3\n"\
+               "store_global 2\n"\
+               "push_int 0\n"\
+               "store_global 1\n"\
+               "load_global 2\n"\
+               "load_global 1\n"\
+               "if_greater 18\n"\
+               "load_global 1\n"\
+               "load_global 1\n"\
+               "store_global_array 0\n"\
+               "push_int 1\n"\
+               "load_global 1\n"\
+               "add\n"\
+               "store_global 1\n"\
+               "jump 7\n",
+    # i == 4で終了 (後判定)
+    "until": "new_array_int 4\n"\
+             "store_global 0\n"\
+             "push_int 0\n"\
+             "store_global 1\n"\
+             "load_global 1\n"\
+             "load_global 1\n"\
+             "store_global_array 0\n"\
+             "push_int 1\n"\
+             "load_global 1\n"\
+             "add\n"\
+             "store_global 1\n"\
+             "load_global 1\n"\
+             "push_int 4\n"\
+             "if_equal 16\n"\
+             "jump 5\n",
+}
+_HOIST_PRINT = "push_int 3\n"\
+               "load_global_array 0\n"\
+               "print\n"\
+               "exit\n"
+
+# 入口で範囲を確かめたループでは配列の検査(Array.store)を呼ばない
+@pytest.mark.parametrize("form", list(_HOIST_LOOPS))
+def test_hoist(capsys, monkeypatch, form):
+    monkeypatch.setattr(virtual_machine, "hoist_flag", True)
+    monkeypatch.setattr(vm_array.Array, "store", lambda self, index, value: pytest.fail("checked store"))
+    vm = virtual_machine.VirtualMachine(_HOIST_LOOPS[form] + _HOIST_PRINT, False)
+    with pytest.raises(SystemExit) as exit_info:
+        vm.run()
+
+    out, err = capsys.readouterr()
+    assert out == "3\n"
+    assert exit_info.value.code == 0
+    [loop] = vm.program.loops
+    assert loop.form == form
+    assert [kind for _, kind, _ in loop.accesses] == ["store_typed"]
+
+# 入口で範囲外と分かったループは通常の検査でエラーにする
+def test_hoist_out_of_range(capsys, monkeypatch):
+    monkeypatch.setattr(virtual_machine, "hoist_flag", True)
+    text = _HOIST_LOOPS["less"].replace("new_array_int 4", "new_array_int 3") + _HOIST_PRINT
+    with pytest.raises(SystemExit) as exit_info:
+        virtual_machine.run(text)
+
+    out, err = capsys.readouterr()
+    assert err == f"{_color_red}index error (array index out of range): line 7, \"store_global_array 0\"{_color_reset}\n"
+    assert exit_info.value.code == 1
+
+# 格納する値の型が決まらない場合は要素型を検査する
+def test_hoist_unknown_type(capsys, monkeypatch):
+    monkeypatch.setattr(virtual_machine, "hoist_flag", True)
+    text = _HOIST_LOOPS["less"].replace("load_global 1\nload_global 1\n", "load_global 0\nload_global 1\n")
+    vm = virtual_machine.VirtualMachine(text, False)
+    with pytest.raises(SystemExit) as exit_info:
+        vm.run()
+
+    out, err = capsys.readouterr()
+    assert err == f"{_color_red}syntax error (mismatching array type): line 7, \"store_global_array 0\"{_color_reset}\n"
+    assert [kind for _, kind, _ in vm.program.loops[0].accesses] == ["store"]
+
+# 本体で呼び出し・配列変数の書き換えがあるループ，外から本体へ分岐するループは対象外
+@pytest.mark.parametrize("old, new", [
+    ("store_global_array 0\n", "store_global_array 0\ncall 20\n"),
+    ("store_global_array 0\n", "store_global_array 0\nload_global 0\nstore_global 0\n"),
+    ("new_array_int 4\n", "jump 8\nnew_array_int 4\n"),
+])
+def test_hoist_rejected(old, new):
+    text = _HOIST_LOOPS["less"].replace(old, new, 1) + _HOIST_PRINT + "exit\n"
+    vm = virtual_machine.VirtualMachine(text, False)
+    vm.check_syntax()
+    assert vm_hoist.analyze(vm.program) == []
@@ -2,20 +2,174 @@ from . import vm_error
 from . import vm_stack
 from . import vm_address_space
 from . import vm_array
-import re
+from . import vm_debugger
+from . import vm_jit
+from . import vm_stats
+from . import vm_input
+from . import vm_profiler
+from . import vm_parallel
+from . import vm_thread
+from . import vm_inliner
+from . import vm_matrix
+from . import vm_monitor
+from . import vm_memory
+from . import vm_quicken
+from . import vm_hoist
+from .vm_program import Program
+import array
+import sys
 import time
 
-__all__ = ["run"]
+__all__ = ["run", "Program"]
 
 time_flag = False
+jit_flag = False      # トレーシングJITを有効にする
+jit_threshold = 50    # トレースの記録を開始する後方分岐の回数
+jit_stats_flag = False # 終了時にJITの統計を表示する
+stats_format = None   # 実行統計の出力形式 ("json", "text", Noneなら出力しない)
+stats_path = None     # 実行統計の出力先ファイル (Noneなら標準エラー出力)
+input_path = None     # read_*命令の入力元ファイル (Noneなら標準入力)
+profile_path = None   # サンプリングプロファイラの出力先ファイル (Noneなら計測しない)
+profile_interval = 0.005 # サンプリング間隔(CPU秒)
+profile_every = None  # 指定した場合は命令数毎にサンプリング
+array_pool_bytes = 0  # 再利用のために保持する配列の合計バイト数の上限 (0ならプールしない)
+inline_flag = False   # 小さなサブルーチンを呼び出し箇所にインライン展開する
+inline_report_flag = False # インライン展開の記録を表示する
+monitor_flag = False  # SIGUSR1を受け取ったときに実行中の状態を出力する
+heartbeat_interval = None # 実行中の状態を出力する間隔(秒) (Noneなら定期的には出力しない)
+monitor_path = None   # 実行中の状態の出力先ファイル (Noneなら標準エラー出力)
+memory_profile_path = None # メモリプロファイラのスナップショットの出力先ファイル (Noneなら計測しない)
+quicken_flag = False  # 実行時に命令を特殊化する
+quicken_threshold = 8 # 命令を特殊化するまでの実行回数
+quicken_stats_flag = False # 終了時に特殊化の統計を表示する
+hoist_flag = False    # カウントループの配列の検査をループの入口にまとめる
+
+# オペランドを取る命令
+OPCODES_WITH_OPERAND = {
+    "push_int",
+    "push_float",
+    "push_char",
+    "store_global",
+    "load_global",
+    "free_global",
+    "store_local",
+    "load_local",
+    "free_local",
+    "new_array_int",
+    "new_array_float",
+    "new_array_char",
+    "new_matrix_int",
+    "new_matrix_float",
+    "store_global_matrix",
+    "store_local_matrix",
+    "load_global_matrix",
+    "load_local_matrix",
+    "store_local_array",
+    "store_global_array",
+    "load_local_array",
+    "load_global_array",
+    "map_file_int",
+    "map_file_float",
+    "sync_global_array",
+    "sync_local_array",
+    "read_global_array",
+    "read_local_array",
+    "print_global_array",
+    "print_local_array",
+    "print_global_array_slice",
+    "print_local_array_slice",
+    "if_equal",
+    "if_greater",
+    "if_less",
+    "jump",
+    "call",
+    "parallel_for",
+    "spawn",
+    "lock",
+    "unlock",
+}
+# オペランドを取らない命令
+OPCODES_WITHOUT_OPERAND = {
+    "add",
+    "sub",
+    "mul",
+    "div",
+    "dup",
+    "matmul",
+    "transpose",
+    "row_sum",
+    "col_sum",
+    "read_int",
+    "read_float",
+    "read_char",
+    "push_eof",
+    "print",
+    "print_char",
+    "exit",
+    "join",
+}
 
 # ==============================
 #     バーチャルマシン実行
 # ==============================
-def run(text):
-    start_time = time.time()
-    virtual_machine = VirtualMachine(text, time_flag)
-    virtual_machine.run()
+# textはプログラムの文字列またはProgram，load_nsはファイル読み込みにかかった時間(ns)
+# pathはtextを読み込んだファイル (構文解析後は文字列を保持せず，エラーメッセージの行はファイルから読む)
+def run(text, load_ns=0, path=None):
+    jit = vm_jit.JIT(jit_threshold) if jit_flag else None
+    metrics = vm_stats.Metrics(load_ns) if stats_format else None
+    profiler = vm_profiler.SamplingProfiler(profile_interval, profile_every) if profile_path else None
+    monitor = vm_monitor.Monitor(heartbeat_interval, monitor_path) if monitor_flag or heartbeat_interval else None
+    memory = vm_memory.MemoryProfiler() if memory_profile_path else None
+    virtual_machine = None
+    try:
+        if path is not None:
+            if metrics is not None:
+                metrics.enter("parse")
+            text = Program(text, path)
+        virtual_machine = VirtualMachine(text, time_flag, jit, metrics, memory)
+        if profiler is not None:
+            profiler.start(virtual_machine)
+        if monitor is not None:
+            monitor.start(virtual_machine)
+        virtual_machine.run()
+    except SystemExit as e:
+        if metrics is not None:
+            metrics.exit_code = e.code
+        raise
+    except BaseException as e:
+        if metrics is not None:
+            metrics.exit_code = 1
+            metrics.error = type(e).__name__
+        raise
+    finally:
+        if monitor is not None:
+            monitor.stop()
+        if profiler is not None:
+            profiler.stop()
+            profiler.write(profile_path)
+            print(profiler.table(), file=sys.stderr)
+        if memory is not None:
+            memory.write(memory_profile_path)
+            print(memory.table(), file=sys.stderr)
+        if jit is not None and jit_stats_flag:
+            print("jit: " + " ".join(f"{k}={v}" for k, v in jit.stats.items()), file=sys.stderr)
+        if quicken_stats_flag and virtual_machine is not None and virtual_machine.quickener is not None:
+            print(virtual_machine.quickener.report(), file=sys.stderr)
+        if metrics is not None:
+            metrics.finish()
+            metrics.emit(virtual_machine, stats_format, stats_path)
+
+
+# 実行中にフックが登録された (実行ループを抜けて切り替える)
+class _HooksChanged(Exception):
+    pass
+
+# 空行・コメント行
+def _nop(operand):
+    pass
+
+def _undefined_opcode(operand):
+    raise vm_error.Error("ERROR_UNDEFINED_OPCODE")
 
 
 # ==============================
@@ -24,151 +178,200 @@ def run(text):
 class VirtualMachine:
 
     # ===== 初期化 =====
-    def __init__(self, text, time_flag):
+    # textはプログラムの文字列またはProgram
+    # memoryはメモリプロファイラ (Noneなら計測しない)
+    def __init__(self, text, time_flag, jit=None, metrics=None, memory=None):
         self.time_flag = time_flag
         self.start_time = time.time()
-        self.lines = text.split("\n") # 改行区切りのリスト
-        self.progmem = self._parseLines(self.lines) # パース済み命令リスト
-        self.data_stack = vm_stack.Stack() # スタック
-        self.return_stack = vm_stack.Stack() # リターンスタック
+        self.metrics = metrics # 実行統計 (Noneなら計測しない)
+        if metrics is not None:
+            metrics.enter("parse")
+        self.program = text if isinstance(text, Program) else Program(text)
+        # 実行統計を取る場合はスタックの最大の深さを記録する
+        stack_class = vm_stack.Stack if metrics is None else vm_stack.TrackedStack
+        self.data_stack = stack_class() if memory is None else memory.stack() # スタック
+        self.return_stack = stack_class() # リターンスタック
 
         self.pc = -1 # プログラムカウンタ
         self.local_area_stack = vm_stack.Stack() # ローカル変数領域のスタック
         self.local_area = vm_address_space.AddressSpace() # ローカル変数領域
         self.global_area = vm_address_space.AddressSpace() # グローバル変数領域
+        self.hooks = vm_debugger.Hooks() # デバッグ用フック
+        self.threads = vm_thread.Threads() # spawnで開始したスレッドとロック (スレッド間で共有する)
+        self.jit = jit # トレーシングJIT (Noneなら無効)
+        self.input = None # read_*命令の入力 (最初の読み込み時に開く)
+        self.handlers = {} # 命令名 -> 実行する関数
+
+        self.retired = 0 # 実行した命令数
+        self.calls = 0 # サブルーチン呼び出し回数
+        self.arrays_allocated = 0 # 確保した配列の数
+        # 配列の再利用プール (参照カウントで判定できない処理系では使わない)
+        self.array_pool = vm_array.ArrayPool(array_pool_bytes) if array_pool_bytes and vm_array.pool_supported() else None
+        self.inline = inline_flag # 構文チェック後にインライン展開する
+        self.quicken = quicken_flag # 高速な実行ループで命令を特殊化する
+        self.quickener = None
+        self.hoist = hoist_flag # 高速な実行ループでカウントループの配列の検査を入口にまとめる (JITと併用しない)
+        self.memory = memory
+        if memory is not None:
+            memory.start(self)
 
     
     # ===== 実行 =====
     def run(self):
-        self.check_syntax()
-        program_lenght = len(self.progmem)
-        while True:
+        if self.metrics is not None:
+            self.metrics.enter("verify")
+        if not self.program.verified:
+            self.check_syntax()
+            self.program.verified = True
+        if self.inline and self.program.inlined is None:
+            vm_inliner.inline(self.program)
+            if inline_report_flag:
+                print(vm_inliner.report(self.program), file=sys.stderr)
+        if self.hoist and self.program.loops is None:
+            self.program.loops = vm_hoist.analyze(self.program)
+        if self.metrics is not None:
+            self.metrics.enter("execute")
+        try:
+            # フックの有無に応じて実行ループを切り替える (実行中にフックが登録されると切り替え直す)
+            while True:
+                self.hooks.changed = False
+                try:
+                    if self.hooks.is_active():
+                        self._run_traced()
+                    else:
+                        self._run_fast()
+                except _HooksChanged:
+                    pass
+        except vm_error.Error as e:
+            self._error(e)
+        finally:
+            if self.metrics is not None:
+                self.metrics.finish()
+
+    # フックなしの実行ループ (命令毎のフック判定を行わない)
+    def _run_fast(self):
+        program = self.program
+        program_lenght = len(program)
+        # 命令名の番号で引く実行関数の表
+        handlers = []
+        for name in program.names:
+            handler = self.handlers.get(name)
+            if handler is None:
+                handler = self.handlers[name] = self._handler(name)
+            handlers.append(handler)
+        opcodes = program.opcodes
+        if self.quicken:
+            # 特殊化した命令の番号の配列と実行関数の表 (実行ループに入り直しても引き継ぐ)
+            if self.quickener is None:
+                self.quickener = vm_quicken.Quickener(self, handlers, quicken_threshold, count_hits=quicken_stats_flag)
+            handlers = self.quickener.handlers
+            opcodes = self.quickener.opcodes
+        if self.hoist and self.jit is None and program.loops:
+            # ループの入口の検査と検査なしの配列命令を表に追加する
+            handlers, opcodes = vm_hoist.install(self, program.loops, handlers, opcodes, self.quickener)
+        constants = program.constants
+        operands = program.operands
+        retired = 0
+        try:
+            while True:
+                # プログラムカウンタを進める
+                self.pc+=1
+
+                if self.pc >= program_lenght:
+                     vm_error.index_error_pc(program.source_index(self.pc) + 1)
+
+                retired += 1
+                handlers[opcodes[self.pc]](constants[operands[self.pc]])
+        finally:
+            self.retired += retired
+
+    # フックありの実行ループ (全てのフックが解除されると戻る)
+    def _run_traced(self):
+        program = self.program
+        program_lenght = len(program)
+        hooks = self.hooks
+        while hooks.is_active():
             # プログラムカウンタを進める
             self.pc+=1
 
             if self.pc >= program_lenght:
-                 vm_error.index_error_pc(self.pc + 1)
+                 vm_error.index_error_pc(program.source_index(self.pc) + 1)
 
-            opcode = self.progmem[self.pc]["opcode"]
-            operand = self.progmem[self.pc]["operand"]
-            try:
-                # オペランドに応じて実行
-                match opcode:
-                    case "":
-                        pass
-                    case "push_int":
-                        self.cmd_push_int(operand)
-                    case "push_float":
-                        self.cmd_push_float(operand)
-                    case "push_char":
-                        self.cmd_push_char(operand)
-                    case "add":
-                        self.cmd_add()
-                    case "sub":
-                        self.cmd_sub()
-                    case "mul":
-                        self.cmd_mul()
-                    case "div":
-                        self.cmd_div()
-                    case "dup":
-                        self.cmd_dup()
-                    case "store_global":
-                        self.cmd_store_global(operand)
-                    case "load_global":
-                        self.cmd_load_global(operand)
-                    case "free_global":
-                        self.cmd_free_global(operand)
-                    case "store_local":
-                        self.cmd_store_local(operand)
-                    case "load_local":
-                        self.cmd_load_local(operand)
-                    case "free_local":
-                        self.cmd_free_local(operand)
-                    case "new_array_int":
-                        self.cmd_new_array_int(operand)
-                    case "new_array_float":
-                        self.cmd_new_array_float(operand)
-                    case "new_array_char":
-                        self.cmd_new_array_char(operand)
-                    case "store_local_array":
-                        self.cmd_store_local_array(operand)
-                    case "store_global_array":
-                        self.cmd_store_global_array(operand)
-                    case "load_local_array":
-                        self.cmd_load_local_array(operand)
-                    case "load_global_array":
-                        self.cmd_load_global_array(operand)
-                    case "print":
-                        self.cmd_print()
-                    case "print_char":
-                        self.cmd_print_char()
-                    case "if_equal":
-                        self.cmd_if_equal(operand)
-                    case "if_greater":
-                        self.cmd_if_greater(operand)
-                    case "if_less":
-                        self.cmd_if_less(operand)
-                    case "jump":
-                        self.cmd_jump(operand)
-                    case "call":
-                        self.cmd_call(operand)
-                    case "exit":
-                        self.cmd_exit()
-                    case _:
-                        raise vm_error.Error("ERROR_UNDEFINED_OPCODE")
-            except vm_error.Error as e:
-                n_line = self.pc + 1       # 行番号
-                code = self.lines[self.pc] # エラーが発生したコード
-                match e.args[0]:
-                    case "ERROR_POP_FROM_EMPTY_STACK":
-                        vm_error.index_error_pop(n_line, code)
-                    case "ERROR_UNDEFINED_OPCODE":
-                        vm_error.syntax_error_undefined_opcode(n_line, code)
-                    case "ERROR_MISMATCHING_ARRAY_TYPE":
-                        vm_error.syntax_error_mismatching_array_type(n_line, code)
-                    case "ERROR_UNDEFINED_VAR":
-                        vm_error.syntax_error_undefined_var(n_line, code)
-                    case _:
-                        vm_error.unknown_error(n_line, code)
-    
-    # ===== 構文解析 =====
-    def _parseLines(self, lines):
-        result = []
-        if lines[-1] == "":
-            lines = lines[:-1]
+            opcode = program.opcode(self.pc)
+            operand = program.operand(self.pc)
+            line = program.source_index(self.pc) + 1
+            hooks.before(self, line, opcode, operand)
+            watched = hooks.watch_before(self, opcode, operand)
+            depth = len(self.return_stack.items)
+            self.retired += 1
+            hooks.changed = False # このループでは登録されたフックを次の命令から呼ぶ
+            self._execute(opcode, operand)
+            if watched:
+                hooks.watch_after(self, watched)
+            if opcode == "call":
+                hooks.call_event(self, "call", self.program.source_index(self.pc + 1) + 1, depth + 1)
+            elif opcode == "exit":
+                hooks.call_event(self, "return", self.program.source_index(self.pc + 1) + 1, depth - 1)
 
-        for line in lines:
-            line = re.sub(r"#.*","", line) # コメント除去
-            data = line.split()
+    # 1命令実行
+    def _execute(self, opcode, operand):
+        handler = self.handlers.get(opcode)
+        if handler is None:
+            handler = self.handlers[opcode] = self._handler(opcode)
+        handler(operand)
 
-            opcode = data[0] if len(data) else "" # オペコードがあれば取得
-            operand = [float(x) for x in data[1:] if x != ''] # オペランドがあれば取得
-            result.append({"opcode":opcode, "operand":operand})
-        return result
+    # 命令名に対応する，オペランドを受け取って実行する関数
+    def _handler(self, opcode):
+        if opcode == "":
+            return _nop
+        if opcode in OPCODES_WITHOUT_OPERAND:
+            method = getattr(self, "cmd_" + opcode)
+            return lambda operand: method()
+        if opcode in OPCODES_WITH_OPERAND:
+            return getattr(self, "cmd_" + opcode)
+        return _undefined_opcode
 
+    # エラーメッセージを出力して終了
+    def _error(self, e):
+        index = self.program.source_index(self.pc)
+        n_line = index + 1       # 行番号
+        code = self.program.source_line(index) # エラーが発生したコード
+        match e.args[0]:
+            case "ERROR_POP_FROM_EMPTY_STACK":
+                vm_error.index_error_pop(n_line, code)
+            case "ERROR_UNDEFINED_OPCODE":
+                vm_error.syntax_error_undefined_opcode(n_line, code)
+            case "ERROR_MISMATCHING_ARRAY_TYPE":
+                vm_error.syntax_error_mismatching_array_type(n_line, code)
+            case "ERROR_UNDEFINED_VAR":
+                vm_error.syntax_error_undefined_var(n_line, code)
+            case "ERROR_ARRAY_INDEX_OUT_OF_RANGE":
+                vm_error.index_error_array(n_line, code)
+            case "ERROR_INVALID_CHAR":
+                vm_error.value_error_invalid_char(n_line, code)
+            case "ERROR_READ_ONLY_ARRAY":
+                vm_error.value_error_read_only_array(n_line, code)
+            case "ERROR_MAP_FILE":
+                vm_error.io_error_map_file(n_line, code)
+            case "ERROR_INPUT":
+                vm_error.io_error_input(n_line, code)
+            case "ERROR_INVALID_INPUT":
+                vm_error.value_error_invalid_input(n_line, code)
+            case "ERROR_MATRIX_SHAPE":
+                vm_error.value_error_matrix_shape(n_line, code)
+            case "ERROR_INVALID_THREAD":
+                vm_error.value_error_invalid_thread(n_line, code)
+            case "ERROR_UNLOCKED_LOCK":
+                vm_error.value_error_unlocked_lock(n_line, code)
+            case _:
+                vm_error.unknown_error(n_line, code)
+    
+    # ===== 構文チェック =====
     def check_syntax(self):
-        opcode_with_operand = [
-            "push_int",
-            "push_float",
-            "push_char",
-            "store_global",
-            "load_global",
-            "free_global",
-            "store_local",
-            "load_local",
-            "free_local",
-            "new_array_int",
-            "new_array_float",
-            "new_array_char",
-            "store_local_array",
-            "store_global_array",
-            "load_local_array",
-            "load_global_array",
-            "if_equal",
-            "if_greater",
-            "if_less",
-            "jump",
-            "call"
+        opcode_with_two_operands = [
+            "new_matrix_int",
+            "new_matrix_float",
+            "parallel_for"
         ]
         opcode_with_operand_int = [
             "push_int",
@@ -181,15 +384,35 @@ class VirtualMachine:
             "new_array_int",
             "new_array_float",
             "new_array_char",
+            "new_matrix_int",
+            "new_matrix_float",
+            "store_global_matrix",
+            "store_local_matrix",
+            "load_global_matrix",
+            "load_local_matrix",
             "store_local_array",
             "store_global_array",
             "load_local_array",
             "load_global_array",
+            "map_file_int",
+            "map_file_float",
+            "sync_global_array",
+            "sync_local_array",
+            "read_global_array",
+            "read_local_array",
+            "print_global_array",
+            "print_local_array",
+            "print_global_array_slice",
+            "print_local_array_slice",
             "if_equal",
             "if_greater",
             "if_less",
             "jump",
-            "call"
+            "call",
+            "parallel_for",
+            "spawn",
+            "lock",
+            "unlock"
         ]
         opcode_with_operand_float = [
             "push_float"
@@ -198,21 +421,41 @@ class VirtualMachine:
             "push_char"
         ]
         
-        for i, line in enumerate(self.progmem):
-            opcode = line["opcode"]
-            operand = line["operand"]
+        # オペランドを命令に応じた型に変換した定数表を作る (同じ命令・同じオペランドは共有)
+        program = self.program
+        constants = []
+        operands = array.array(program.operands.typecode)
+        converted = {} # (オペランドの番号, 命令名) -> 変換後のオペランドの番号
+        for i in range(len(program)):
+            opcode = program.opcode(i)
+            operand = program.operand(i)
 
-            if opcode in opcode_with_operand:
+            if opcode in OPCODES_WITH_OPERAND:
                 if not operand:
-                    code = self.lines[i]
+                    code = program.source_line(i)
+                    vm_error.syntax_error_missing_operand(i+1, code)
+            if opcode in opcode_with_two_operands:
+                if len(operand) < 2:
+                    code = program.source_line(i)
                     vm_error.syntax_error_missing_operand(i+1, code)
-            
-            if opcode in opcode_with_operand_int:
-                line["operand"][0] = int(line["operand"][0])
-            elif opcode in opcode_with_operand_float:
-                line["operand"][0] = float(line["operand"][0])
-            elif opcode in opcode_with_operand_char:
-                line["operand"][0] = chr(int(line["operand"][0]))
+
+            key = (program.operands[i], opcode)
+            arg = converted.get(key)
+            if arg is None:
+                operand = list(operand)
+                if opcode in opcode_with_two_operands:
+                    operand[1] = int(operand[1])
+                if opcode in opcode_with_operand_int:
+                    operand[0] = int(operand[0])
+                elif opcode in opcode_with_operand_float:
+                    operand[0] = float(operand[0])
+                elif opcode in opcode_with_operand_char:
+                    operand[0] = chr(int(operand[0]))
+                arg = converted[key] = len(constants)
+                constants.append(tuple(operand))
+            operands.append(arg)
+        program.operands = operands
+        program.constants = constants
 
 
     # ==============================
@@ -228,13 +471,114 @@ class VirtualMachine:
         self.data_stack.push(operand[0])
     
     def cmd_new_array_int(self, operand):
-        self.data_stack.push(vm_array.Array(int, operand[0]))
+        self.arrays_allocated += 1
+        self.data_stack.push(self._new_array(int, operand[0]))
     
     def cmd_new_array_float(self, operand):
-        self.data_stack.push(vm_array.Array(float, operand[0]))
+        self.arrays_allocated += 1
+        self.data_stack.push(self._new_array(float, operand[0]))
     
     def cmd_new_array_char(self, operand):
-        self.data_stack.push(vm_array.Array(str, operand[0]))
+        self.arrays_allocated += 1
+        if self.array_pool is None:
+            array = vm_array.CharArray(operand[0])
+        else:
+            array = self.array_pool.acquire_char(operand[0])
+        self.data_stack.push(self._allocated(array))
+    
+    def _new_array(self, array_type, size):
+        if self.array_pool is None:
+            return self._allocated(vm_array.Array(array_type, size))
+        return self._allocated(self.array_pool.acquire(array_type, size))
+    
+    # メモリプロファイラに確保した配列を記録
+    def _allocated(self, value):
+        if self.memory is not None:
+            self.memory.allocate(value)
+        return value
+    
+    # r行c列の2次元配列をpush
+    def cmd_new_matrix_int(self, operand):
+        self.arrays_allocated += 1
+        self.data_stack.push(self._allocated(vm_matrix.Matrix(int, operand[0], operand[1])))
+    
+    def cmd_new_matrix_float(self, operand):
+        self.arrays_allocated += 1
+        self.data_stack.push(self._allocated(vm_matrix.Matrix(float, operand[0], operand[1])))
+    
+    # スタックから3つpop(row, col, value)して，2次元配列変数nのrow行col列に値valueを格納
+    def cmd_store_global_matrix(self, operand):
+        self._matrix(self.global_area, operand).store(self.data_stack.pop(), self.data_stack.pop(), self.data_stack.pop())
+    
+    def cmd_store_local_matrix(self, operand):
+        self._matrix(self.local_area, operand).store(self.data_stack.pop(), self.data_stack.pop(), self.data_stack.pop())
+    
+    # スタックから2つpop(row, col)して，2次元配列変数nのrow行col列の値をpush
+    def cmd_load_global_matrix(self, operand):
+        matrix = self._matrix(self.global_area, operand)
+        self.data_stack.push(matrix.load(self.data_stack.pop(), self.data_stack.pop()))
+    
+    def cmd_load_local_matrix(self, operand):
+        matrix = self._matrix(self.local_area, operand)
+        self.data_stack.push(matrix.load(self.data_stack.pop(), self.data_stack.pop()))
+    
+    # スタックから2つpop(a, b)して，行列の積a×bをpush
+    def cmd_matmul(self):
+        a = self._pop_matrix()
+        b = self._pop_matrix()
+        self.data_stack.push(self._allocated(a.matmul(b)))
+    
+    def cmd_transpose(self):
+        self.data_stack.push(self._allocated(self._pop_matrix().transpose()))
+    
+    # スタックから2次元配列をpopして，行毎・列毎の合計の配列をpush
+    def cmd_row_sum(self):
+        self.data_stack.push(self._allocated(self._pop_matrix().row_sum()))
+    
+    def cmd_col_sum(self):
+        self.data_stack.push(self._allocated(self._pop_matrix().col_sum()))
+    
+    # 2次元配列変数を取得
+    def _matrix(self, area, operand):
+        matrix = area.load(operand[0])
+        if not isinstance(matrix, vm_matrix.Matrix):
+            raise vm_error.Error("ERROR_MISMATCHING_ARRAY_TYPE")
+        return matrix
+    
+    def _pop_matrix(self):
+        matrix = self.data_stack.pop()
+        if not isinstance(matrix, vm_matrix.Matrix):
+            raise vm_error.Error("ERROR_MISMATCHING_ARRAY_TYPE")
+        return matrix
+    
+    # スタックから文字型配列(ファイルパス)をpopして，ファイルをメモリマップした配列をpush
+    def cmd_map_file_int(self, operand):
+        self.arrays_allocated += 1
+        self.data_stack.push(vm_array.MappedArray(self._path(), int, operand[0]))
+    
+    def cmd_map_file_float(self, operand):
+        self.arrays_allocated += 1
+        self.data_stack.push(vm_array.MappedArray(self._path(), float, operand[0]))
+    
+    def cmd_sync_global_array(self, operand):
+        self._mapped_array(self.global_area, operand).sync()
+    
+    def cmd_sync_local_array(self, operand):
+        self._mapped_array(self.local_area, operand).sync()
+    
+    # スタックからファイルパスの文字型配列をpop
+    def _path(self):
+        path = self.data_stack.pop()
+        if not isinstance(path, vm_array.CharArray):
+            raise vm_error.Error("ERROR_MISMATCHING_ARRAY_TYPE")
+        return path.string()
+    
+    # メモリマップした配列変数を取得
+    def _mapped_array(self, area, operand):
+        array = area.load(operand[0])
+        if not isinstance(array, vm_array.MappedArray):
+            raise vm_error.Error("ERROR_MISMATCHING_ARRAY_TYPE")
+        return array
     
     def cmd_store_global_array(self, operand):
         array = self.global_area.load(operand[0])
@@ -265,10 +609,16 @@ class VirtualMachine:
         self.data_stack.push(self.local_area.load(operand[0]))
     
     def cmd_free_global(self, operand):
+        value = self.global_area.load(operand[0])
         self.global_area.free(operand[0])
+        if self.array_pool is not None:
+            self.array_pool.release(value)
     
     def cmd_free_local(self, operand):
+        value = self.local_area.load(operand[0])
         self.local_area.free(operand[0])
+        if self.array_pool is not None:
+            self.array_pool.release(value)
     
     def cmd_add(self):
         self.data_stack.push(self.data_stack.pop() + self.data_stack.pop())
@@ -289,29 +639,143 @@ class VirtualMachine:
     
     def cmd_if_equal(self, operand):
         if self.data_stack.pop() == self.data_stack.pop():
-            self.pc = operand[0] -2
+            self._branch(operand[0])
     
     def cmd_if_greater(self, operand):
         if self.data_stack.pop() > self.data_stack.pop():
-            self.pc = operand[0] -2
+            self._branch(operand[0])
     
     def cmd_if_less(self, operand):
         if self.data_stack.pop() < self.data_stack.pop():
-            self.pc = operand[0] -2
+            self._branch(operand[0])
     
     def cmd_jump(self, operand):
-        self.pc = operand[0] -2
+        self._branch(operand[0])
+    
+    # n行目へ分岐 (後方分岐はJITに通知し，フックが登録されていれば実行ループを切り替える)
+    def _branch(self, n_line):
+        backward = n_line <= self.pc + 1
+        self.pc = n_line -2
+        if backward:
+            if self.jit is not None:
+                self.jit.backward(self, n_line)
+            if self.hooks.changed:
+                raise _HooksChanged()
+    
+    # 入力から値を1つ読み込んでpush (入力の終端ではpush_eofと同じ値をpush)
+    def cmd_read_int(self):
+        values = self._reader().ints(1)
+        self.data_stack.push(values[0] if values else vm_input.EOF)
+    
+    def cmd_read_float(self):
+        values = self._reader().floats(1)
+        self.data_stack.push(values[0] if values else vm_input.EOF)
+    
+    def cmd_read_char(self):
+        self.data_stack.push(self._reader().char())
+    
+    def cmd_push_eof(self):
+        self.data_stack.push(vm_input.EOF)
+    
+    def cmd_read_global_array(self, operand):
+        self._read_array(self.global_area.load(operand[0]))
+    
+    def cmd_read_local_array(self, operand):
+        self._read_array(self.local_area.load(operand[0]))
+    
+    # スタックから2つpop(start, count)して，配列のstart番から最大count個の値を読み込み，読み込んだ個数をpush
+    def _read_array(self, array):
+        start = self.data_stack.pop()
+        count = self.data_stack.pop()
+        if start < 0 or count < 0 or start + count > len(array.items):
+            raise vm_error.Error("ERROR_ARRAY_INDEX_OUT_OF_RANGE")
+        reader = self._reader()
+        if array.type is int:
+            values = reader.ints(count)
+        elif array.type is float:
+            values = reader.floats(count)
+        else:
+            values = reader.chars(count)
+        array.store_many(start, values)
+        self.data_stack.push(len(values))
+    
+    def _reader(self):
+        if self.input is None:
+            self.input = vm_input.open_input(input_path)
+        return self.input
     
     def cmd_print(self):
         print(self.data_stack.pop())
     
+    # 文字(または文字コード)を改行なしで出力
+    def cmd_print_char(self):
+        value = self.data_stack.pop()
+        if type(value) is not str:
+            try:
+                value = chr(int(value))
+            except (ValueError, OverflowError):
+                raise vm_error.Error("ERROR_INVALID_CHAR")
+        sys.stdout.write(value)
+    
+    def cmd_print_global_array(self, operand):
+        sys.stdout.write(self._char_array(self.global_area, operand).string())
+    
+    def cmd_print_local_array(self, operand):
+        sys.stdout.write(self._char_array(self.local_area, operand).string())
+    
+    def cmd_print_global_array_slice(self, operand):
+        array = self._char_array(self.global_area, operand)
+        sys.stdout.write(array.text(self.data_stack.pop(), self.data_stack.pop()))
+    
+    def cmd_print_local_array_slice(self, operand):
+        array = self._char_array(self.local_area, operand)
+        sys.stdout.write(array.text(self.data_stack.pop(), self.data_stack.pop()))
+    
+    # 文字型配列変数を取得
+    def _char_array(self, area, operand):
+        array = area.load(operand[0])
+        if not isinstance(array, vm_array.CharArray):
+            raise vm_error.Error("ERROR_MISMATCHING_ARRAY_TYPE")
+        return array
+    
     def cmd_call(self, operand):
+        self.calls += 1
+        if self.memory is not None:
+            self.memory.call()
         # メモリ領域確保
         self.local_area_stack.push(self.local_area)
         self.local_area = vm_address_space.AddressSpace()
         # プログラムカウンタ変更
         self.return_stack.push(self.pc)
         self.pc = operand[0] -2
+        if self.hooks.changed:
+            raise _HooksChanged()
+    
+    # スタックから2つpop(start, count)して，start番からcount個の添字についてn行目のサブルーチンを並列に呼び出し，
+    # 戻り値をグローバル配列変数mの各添字の要素に格納
+    def cmd_parallel_for(self, operand):
+        array = self.global_area.load(operand[1])
+        start = self.data_stack.pop()
+        count = self.data_stack.pop()
+        if not isinstance(array, vm_array.Array):
+            raise vm_error.Error("ERROR_MISMATCHING_ARRAY_TYPE")
+        if start < 0 or count < 0 or start + count > len(array.items):
+            raise vm_error.Error("ERROR_ARRAY_INDEX_OUT_OF_RANGE")
+        vm_parallel.parallel_for(self, operand[0], operand[1], start, count)
+    
+    # スタックから引数をpopして，n行目のサブルーチンを新しいスレッドで呼び出し，スレッド番号をpush
+    def cmd_spawn(self, operand):
+        self.data_stack.push(self.threads.spawn(self, operand[0], self.data_stack.pop()))
+    
+    # スタックからスレッド番号をpopして，スレッドの終了を待ち，戻り値をpush
+    def cmd_join(self):
+        self.data_stack.push(self.threads.join(self, self.data_stack.pop()))
+    
+    def cmd_lock(self, operand):
+        self.threads.acquire(operand[0])
+    
+    def cmd_unlock(self, operand):
+        self.threads.release(operand[0])
     
     def cmd_exit(self):
         if self.return_stack.is_empty():
@@ -319,6 +783,10 @@ class VirtualMachine:
                 print("time: " + str(time.time() - self.start_time))
             exit(0)
         # 呼び出し前のメモリ領域に戻す
+        if self.memory is not None:
+            self.memory.exit()
+        if self.array_pool is not None:
+            self.array_pool.release_space(self.local_area)
         self.local_area = self.local_area_stack.pop()
         # プログラムカウンタを戻す
         self.pc = self.return_stack.pop()
\ No newline at end of file
@@ -1,4 +1,3 @@
-import gc
 from . import vm_error
 
 class AddressSpace:
@@ -19,5 +18,4 @@ class AddressSpace:
             raise vm_error.Error("ERROR_UNDEFINED_VAR")
         
         del self.items[name]
-        gc.collect()
 
@@ -1,5 +1,10 @@
+import array
+import mmap
+import sys
+from multiprocessing import shared_memory
 from . import vm_error
 
+# 添字は0以上・長さ未満の整数 (負の添字は末尾から数えずにエラーにする)
 class Array:
     def __init__(self, array_type, size):
         self.items = [0] * size
@@ -8,9 +13,220 @@ class Array:
     def store(self, index, value):
         if type(value) is not self.type:
             raise vm_error.Error("ERROR_MISMATCHING_ARRAY_TYPE")
+        if type(index) is not int or not 0 <= index < len(self.items):
+            raise vm_error.Error("ERROR_ARRAY_INDEX_OUT_OF_RANGE")
         self.items[index] = value
     
     def load(self, index):    
+        if type(index) is not int or not 0 <= index < len(self.items):
+            raise vm_error.Error("ERROR_ARRAY_INDEX_OUT_OF_RANGE")
         return self.items[index]
 
+    # start番目から要素型の値のリストをまとめて格納
+    def store_many(self, start, values):
+        self.items[start:start + len(values)] = values
 
+# 文字型配列
+# 1文字1バイトのbytearrayに格納し，U+00FFを超える文字が格納されたら4バイトのarray('I')に広げる
+class CharArray(Array):
+    def __init__(self, size):
+        self.items = bytearray(size) # 各要素は'\0'で初期化
+        self.type = str
+
+    def store(self, index, value):
+        if type(value) is not str or len(value) != 1:
+            raise vm_error.Error("ERROR_MISMATCHING_ARRAY_TYPE")
+        if type(index) is not int or not 0 <= index < len(self.items):
+            raise vm_error.Error("ERROR_ARRAY_INDEX_OUT_OF_RANGE")
+        code = ord(value)
+        if code > 0xff and type(self.items) is bytearray:
+            self.items = array.array("I", list(self.items))
+        self.items[index] = code
+
+    def load(self, index):
+        if type(index) is not int or not 0 <= index < len(self.items):
+            raise vm_error.Error("ERROR_ARRAY_INDEX_OUT_OF_RANGE")
+        return chr(self.items[index])
+
+    def store_many(self, start, values):
+        codes = [ord(c) for c in values]
+        if codes and max(codes) > 0xff and type(self.items) is bytearray:
+            self.items = array.array("I", list(self.items))
+        if type(self.items) is bytearray:
+            self.items[start:start + len(codes)] = bytes(codes)
+        else:
+            self.items[start:start + len(codes)] = array.array("I", codes)
+
+    # start番目からcount文字を文字列として取り出す
+    def text(self, start, count):
+        if start < 0 or count < 0 or start + count > len(self.items):
+            raise vm_error.Error("ERROR_ARRAY_INDEX_OUT_OF_RANGE")
+        items = self.items[start:start + count]
+        if type(items) is bytearray:
+            return items.decode("latin-1")
+        return "".join(map(chr, items))
+
+    # 先頭から'\0'の手前までを文字列として取り出す
+    def string(self):
+        items = self.items
+        end = items.index(0) if 0 in items else len(items)
+        return self.text(0, end)
+
+# ==============================
+#       配列の再利用プール
+# ==============================
+# サブルーチンから戻ったフレームや解放した変数の配列を，要素型と長さ毎に保持して
+# new_array_*で0埋めして再利用する．他から参照されている(グローバル変数への格納・
+# スタック上に残っている等)配列は参照カウントで判定してプールに入れない．
+# 参照カウントの値は処理系の実装に依存するため，判定を確認したGIL有りのCPython 3.11～3.13以外ではプールしない
+def pool_supported():
+    if sys.implementation.name != "cpython" or not (3, 11) <= sys.version_info[:2] <= (3, 13):
+        return False
+    # フリースレッド版は参照カウントの扱いが異なる
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is None or is_gil_enabled()
+
+class ArrayPool:
+    def __init__(self, max_bytes=1 << 24):
+        self.max_bytes = max_bytes # プールに保持する配列の合計バイト数の上限
+        self.pooled_bytes = 0
+        self.free = {}             # (配列の型, 要素型, 長さ) -> 配列のリスト
+        self.zeros = {}            # (配列の型, 長さ) -> 0埋め用のデータ
+        self.hits = 0
+        self.misses = 0
+
+    # ===== 取得 =====
+    def acquire(self, array_type, size):
+        arrays = self.free.get((Array, array_type, size))
+        if not arrays:
+            self.misses += 1
+            return Array(array_type, size)
+        self.hits += 1
+        array = arrays.pop()
+        self.pooled_bytes -= _nbytes(array)
+        array.items[:] = self._zeros(Array, size)
+        return array
+
+    def acquire_char(self, size):
+        arrays = self.free.get((CharArray, str, size))
+        if not arrays:
+            self.misses += 1
+            return CharArray(size)
+        self.hits += 1
+        array = arrays.pop()
+        self.pooled_bytes -= _nbytes(array)
+        if type(array.items) is bytearray:
+            array.items[:] = self._zeros(CharArray, size)
+        else:
+            array.items = bytearray(size)
+        return array
+
+    def _zeros(self, cls, size):
+        zeros = self.zeros.get((cls, size))
+        if zeros is None:
+            zeros = [0] * size if cls is Array else bytes(size)
+            self.zeros[(cls, size)] = zeros
+        return zeros
+
+    # ===== 返却 =====
+    # 呼び出し元以外から参照されていない配列だけをプールに入れる
+    # (参照は呼び出し元の変数・引数・getrefcountの引数の3つ)
+    def release(self, value):
+        cls = type(value)
+        if cls is not Array and cls is not CharArray:
+            return
+        if sys.getrefcount(value) > 3:
+            return
+        nbytes = _nbytes(value)
+        if self.pooled_bytes + nbytes > self.max_bytes:
+            return
+        self.free.setdefault((cls, value.type, len(value.items)), []).append(value)
+        self.pooled_bytes += nbytes
+
+    # 戻ったフレーム(AddressSpace)の配列をプールに入れる (フレームは空になる)
+    def release_space(self, space):
+        items = space.items
+        while items:
+            _, value = items.popitem()
+            self.release(value)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "pooled_bytes": self.pooled_bytes}
+
+def _nbytes(array):
+    items = array.items
+    if type(items) is list:
+        return len(items) * 8
+    if type(items) is bytearray:
+        return len(items)
+    return len(items) * items.itemsize
+
+
+# ファイルをメモリマップした配列 (要素はネイティブのバイト順の8バイト整数・倍精度実数)
+# 読み込みはmmap上のmemoryviewを直接参照するため，ファイルの大きさに関わらずコピーしない
+MAP_READ_ONLY = 0  # 読み込み専用
+MAP_COPY = 1       # 書き込みはプロセス内だけに反映 (copy-on-write)
+MAP_SHARED = 2     # 書き込みをファイルに反映 (syncで書き出し)
+
+class MappedArray(Array):
+    def __init__(self, path, array_type, mode):
+        access = {
+            MAP_READ_ONLY: mmap.ACCESS_READ,
+            MAP_COPY: mmap.ACCESS_COPY,
+            MAP_SHARED: mmap.ACCESS_WRITE,
+        }.get(mode)
+        if access is None or array_type not in (int, float):
+            raise vm_error.Error("ERROR_MAP_FILE")
+        try:
+            with open(path, "r+b" if mode == MAP_SHARED else "rb") as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=access)
+            self.items = memoryview(self.map).cast("q" if array_type is int else "d")
+        except (OSError, ValueError, TypeError):
+            # ファイルが存在しない・空・大きさが要素の倍数でない
+            raise vm_error.Error("ERROR_MAP_FILE")
+        self.type = array_type
+        self.mode = mode
+        self.path = path # parallel_forのワーカープロセスは同じファイルをマップし直す
+
+    def store(self, index, value):
+        if type(value) is not self.type:
+            raise vm_error.Error("ERROR_MISMATCHING_ARRAY_TYPE")
+        if self.mode == MAP_READ_ONLY:
+            raise vm_error.Error("ERROR_READ_ONLY_ARRAY")
+        if type(index) is not int or not 0 <= index < len(self.items):
+            raise vm_error.Error("ERROR_ARRAY_INDEX_OUT_OF_RANGE")
+        self.items[index] = value
+
+    def store_many(self, start, values):
+        if self.mode == MAP_READ_ONLY:
+            raise vm_error.Error("ERROR_READ_ONLY_ARRAY")
+        self.items[start:start + len(values)] = array.array(self.items.format, values)
+
+    # 書き込みをファイルへ反映
+    def sync(self):
+        if self.mode == MAP_SHARED:
+            self.map.flush()
+
+# 共有メモリ上の配列 (parallel_forのワーカープロセス間で同じ領域を読み書きする)
+# nameを指定しなければ新しい領域を確保する
+class SharedArray(Array):
+    def __init__(self, array_type, size, name=None):
+        itemsize = 8 # 8バイト整数・倍精度実数
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=max(size, 1) * itemsize)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.view = self.memory.buf.cast("q" if array_type is int else "d")
+        self.items = self.view[:size]
+        self.type = array_type
+
+    def store_many(self, start, values):
+        self.items[start:start + len(values)] = array.array(self.items.format, values)
+
+    # 共有メモリを閉じる (unlinkなら領域も解放する)
+    def close(self, unlink=False):
+        self.items.release()
+        self.view.release()
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
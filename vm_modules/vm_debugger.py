@@ -0,0 +1,131 @@
+from . import vm_error
+
+# ストア系命令が書き換える変数領域と，変数番号のオペランドの位置
+_WRITE_OPCODES = {
+    "store_global": ("global", 0),
+    "free_global": ("global", 0),
+    "store_global_array": ("global", 0),
+    "store_global_matrix": ("global", 0),
+    "read_global_array": ("global", 0),
+    "parallel_for": ("global", 1),
+    "store_local": ("local", 0),
+    "free_local": ("local", 0),
+    "store_local_array": ("local", 0),
+    "store_local_matrix": ("local", 0),
+    "read_local_array": ("local", 0),
+}
+
+# 未定義の変数・要素を表す値
+UNDEFINED = object()
+
+
+# ==============================
+#        デバッグ用フック
+# ==============================
+# フックが1つでも登録されている間，VirtualMachineはトレース用ループで実行される
+class Hooks:
+    def __init__(self):
+        self.traces = []      # 命令毎のコールバック: callback(vm, line, opcode, operand)
+        self.steps = []       # 次の1命令だけ呼ばれるコールバック: callback(vm, line, opcode, operand)
+        self.breakpoints = {} # 行番号 -> コールバックのリスト: callback(vm, line)
+        self.watchpoints = [] # (領域, 変数番号, 添字, コールバック): callback(vm, area, slot, index, old, new)
+                              # 2次元配列の要素の添字は(行, 列)
+        self.calls = []       # call/return時のコールバック: callback(vm, event, line, depth)
+        self.changed = False  # 登録したか (実行中に登録されると，VMは後方分岐・callでフックありの実行ループへ切り替える)
+
+    def is_active(self):
+        return bool(self.traces or self.steps or self.breakpoints or self.watchpoints or self.calls)
+
+    # ===== 登録・解除 =====
+    def add_trace(self, callback):
+        self.traces.append(callback)
+        self.changed = True
+
+    def remove_trace(self, callback):
+        self.traces.remove(callback)
+
+    def add_step(self, callback):
+        self.steps.append(callback)
+        self.changed = True
+
+    def add_breakpoint(self, line, callback):
+        self.breakpoints.setdefault(line, []).append(callback)
+        self.changed = True
+
+    def remove_breakpoint(self, line, callback=None):
+        if callback is None:
+            del self.breakpoints[line]
+            return
+        self.breakpoints[line].remove(callback)
+        if not self.breakpoints[line]:
+            del self.breakpoints[line]
+
+    def add_watchpoint(self, area, slot, callback, index=None):
+        if area not in ("global", "local"):
+            raise ValueError(f"unknown area: {area}")
+        self.watchpoints.append((area, slot, index, callback))
+        self.changed = True
+
+    def remove_watchpoint(self, area, slot, callback, index=None):
+        self.watchpoints.remove((area, slot, index, callback))
+
+    def add_call_hook(self, callback):
+        self.calls.append(callback)
+        self.changed = True
+
+    def remove_call_hook(self, callback):
+        self.calls.remove(callback)
+
+    def clear(self):
+        self.traces = []
+        self.steps = []
+        self.breakpoints = {}
+        self.watchpoints = []
+        self.calls = []
+
+    # ===== 実行前後の通知 =====
+    def before(self, vm, line, opcode, operand):
+        if self.steps:
+            steps, self.steps = self.steps, []
+            for callback in steps:
+                callback(vm, line, opcode, operand)
+        for callback in tuple(self.traces):
+            callback(vm, line, opcode, operand)
+        for callback in tuple(self.breakpoints.get(line, ())):
+            callback(vm, line)
+
+    # 書き換えられる可能性のある監視対象と，書き換え前の値を返す
+    def watch_before(self, vm, opcode, operand):
+        target = _WRITE_OPCODES.get(opcode)
+        if target is None or not self.watchpoints:
+            return []
+        area, position = target
+        return [(watch, _watch_value(vm, watch))
+                for watch in self.watchpoints
+                if watch[0] == area and watch[1] == operand[position]]
+
+    def watch_after(self, vm, watched):
+        for watch, old in watched:
+            new = _watch_value(vm, watch)
+            if new is not old and new != old:
+                area, slot, index, callback = watch
+                callback(vm, area, slot, index, old, new)
+
+    def call_event(self, vm, event, line, depth):
+        for callback in tuple(self.calls):
+            callback(vm, event, line, depth)
+
+
+# 監視対象の現在の値を取得
+def _watch_value(vm, watch):
+    area, slot, index, _ = watch
+    space = vm.global_area if area == "global" else vm.local_area
+    try:
+        value = space.load(slot)
+        if type(index) is tuple:
+            value = value.load(*index)
+        elif index is not None:
+            value = value.load(index)
+    except (vm_error.Error, AttributeError, IndexError, TypeError):
+        return UNDEFINED
+    return value
@@ -32,6 +32,10 @@ def syntax_error_undefined_var(n_line, code):
 def index_error_pop(n_line, code):
     _error(f"index error (pop from empty): line {n_line}, \"{code}\"")
 
+# 配列の添字が範囲外
+def index_error_array(n_line, code):
+    _error(f"index error (array index out of range): line {n_line}, \"{code}\"")
+
 # プログラムカウンタが範囲外
 def index_error_pc(n_line):
     _error(f"index error (program counter out of range): line {n_line}")
@@ -39,6 +43,38 @@ def index_error_pc(n_line):
 def syntax_error_mismatching_array_type(n_line, code):
     _error(f"syntax error (mismatching array type): line {n_line}, \"{code}\"")
 
+# 文字に変換できない値
+def value_error_invalid_char(n_line, code):
+    _error(f"value error (invalid character): line {n_line}, \"{code}\"")
+
+# 読み込み専用の配列に格納
+def value_error_read_only_array(n_line, code):
+    _error(f"value error (read-only array): line {n_line}, \"{code}\"")
+
+# ファイルをメモリマップできない
+def io_error_map_file(n_line, code):
+    _error(f"io error (cannot map file): line {n_line}, \"{code}\"")
+
+# 入力を開けない
+def io_error_input(n_line, code):
+    _error(f"io error (cannot open input): line {n_line}, \"{code}\"")
+
+# 入力を数値に変換できない
+def value_error_invalid_input(n_line, code):
+    _error(f"value error (invalid input): line {n_line}, \"{code}\"")
+
+# 2次元配列の大きさが演算に合わない
+def value_error_matrix_shape(n_line, code):
+    _error(f"value error (mismatching matrix shape): line {n_line}, \"{code}\"")
+
+# 存在しない・join済みのスレッド番号
+def value_error_invalid_thread(n_line, code):
+    _error(f"value error (invalid thread): line {n_line}, \"{code}\"")
+
+# 獲得していないロックを解放
+def value_error_unlocked_lock(n_line, code):
+    _error(f"value error (release unlocked lock): line {n_line}, \"{code}\"")
+
 # 不明なエラー
 def unknown_error(n_line, code):
     _error(f"unknown error: line {n_line} \"{code}\"")
@@ -0,0 +1,363 @@
+import array
+from . import vm_array
+from . import vm_error
+
+# ==============================
+#   ループの配列の検査の巻き上げ
+# ==============================
+# 構文チェック後のプログラムから，カウンタ変数iを1ずつ増やして上限nと比較するループ(カウントループ)を探し，
+# 本体の配列命令のうち添字がiまたは定数のものについて，毎回の添字の範囲・要素型の検査を
+# ループの入口(iを初期化するstore)での1回の検査にまとめる．認識するループ ({a, b}は順不同):
+#   store i / H: {n, i} if_equal E / 本体 / {push_int 1, load i} add store i / jump H / E:       (i == nで終了)
+#   store i / H: n i if_greater E (i n if_less E) / 本体 / {push_int 1, load i} add store i / jump H / E:  (i > nで終了)
+#   store i / H: 本体 / {push_int 1, load i} add store i / n i if_less H (i n if_greater H)    (i < nの間繰り返す)
+#   store i / H: 本体 / {push_int 1, load i} add store i / {n, i} if_equal E / jump H / E:    (後判定でi == nで終了)
+# nはpush_intの定数または変数．本体でi(増分以外)・n・配列変数に格納・解放しない，call・spawn・parallel_forを
+# 含まない，ループの外から本体へ分岐しないことを条件とする (spawnを含むプログラムではグローバル変数を使うループは対象外)．
+# 入口では i・nが整数，配列が要素型の配列(Array)で，本体で取りうる添字が全て範囲内であることを確かめ，
+# 成り立てば本体の配列命令を検査なしの版に，成り立たなければ通常の版に切り替える．
+# 格納する値の型がプログラムから決まる(定数・i・整数の配列の要素とそれらの四則演算)場合は要素型の検査も省く
+# (実数の配列は初期値が整数の0のため，読み出した値の型は決まらないものとして扱う)．
+# 高速な実行ループだけで使い，フックありの実行ループ・JITは通常の検査を行う
+
+_LINE_OPCODES = {"jump", "if_equal", "if_greater", "if_less", "call", "parallel_for", "spawn"}
+_CALL_OPCODES = {"call", "parallel_for", "spawn"}
+_REBIND_OPCODES = {"store_local", "store_global", "free_local", "free_global"}
+
+_COUNTER = ("counter",) # スタック上のカウンタ変数の値
+_UNKNOWN = ("unknown",) # 値・型の分からない値
+
+
+class Loop:
+    def __init__(self, guard, counter, bound, form):
+        self.guard = guard     # 入口の検査を行う位置 (カウンタ変数を初期化するstore)
+        self.counter = counter # カウンタ変数 (領域, 番号)
+        self.bound = bound     # 上限 ("const", 値) または変数 (領域, 番号)
+        self.form = form       # "equal": i == nで終了, "greater": i > nで終了, "less": i < nの間繰り返す, "until": 後判定でi == nで終了
+        self.accesses = []     # 検査を省く配列命令 (位置, "load"/"store"/"store_typed", 配列変数)
+        self.arrays = {}       # 配列変数 -> [要素型 (Noneなら検査しない), 添字にiを使うか, 定数の添字の最大値]
+
+    # ループの入口で，本体の配列命令の検査を省けるか
+    def valid(self, vm):
+        i = _space(vm, self.counter[0]).get(self.counter[1])
+        if self.bound[0] == "const":
+            n = self.bound[1]
+        else:
+            n = _space(vm, self.bound[0]).get(self.bound[1])
+        if type(i) is not int or type(n) is not int:
+            return False
+        match self.form:
+            case "equal":
+                if i > n:
+                    return False # 終了しない
+                last = n - 1
+            case "greater":
+                last = n
+            case "less":
+                last = max(i, n - 1)
+            case "until":
+                if i >= n:
+                    return False
+                last = n - 1
+        for (area, slot), (element, counted, constant) in self.arrays.items():
+            array = _space(vm, area).get(slot)
+            if type(array) is not vm_array.Array or (element is not None and array.type is not element):
+                return False
+            if counted and (i < 0 or last >= len(array.items)):
+                return False
+            if constant >= len(array.items):
+                return False
+        return True
+
+def _space(vm, area):
+    return vm.global_area.items if area == "global" else vm.local_area.items
+
+
+# ==============================
+#           解析
+# ==============================
+# 検査をまとめられるループのリスト
+def analyze(program):
+    code = program.instructions()
+    sources = {} # 分岐先 -> 分岐元
+    for pc, (opcode, operand) in enumerate(code):
+        if opcode in _LINE_OPCODES:
+            sources.setdefault(operand[0] - 1, []).append(pc)
+    threaded = any(opcode == "spawn" for opcode, _ in code)
+    loops = []
+    for pc, (opcode, operand) in enumerate(code):
+        if opcode in ("jump", "if_less", "if_greater") and operand[0] - 1 <= pc:
+            loop = _loop(code, sources, threaded, operand[0] - 1, pc)
+            # 同じ入口から複数の後方分岐があるループは最初の1つだけ
+            if loop is not None and loop.accesses and all(loop.guard != other.guard for other in loops):
+                loops.append(loop)
+    return loops
+
+# 変数を参照・格納する命令の (領域, 番号)
+def _var(opcode, operand):
+    return opcode.split("_")[1], operand[0]
+
+def _is(instruction, opcode, value):
+    return instruction[0] == opcode and instruction[1][0] == value
+
+def _is_counter(instruction, counter):
+    opcode, operand = instruction
+    return opcode in ("load_local", "load_global") and _var(opcode, operand) == counter
+
+# {push_int 1, load i} add store i ならi
+def _increment(code, pc):
+    if code[pc + 2][0] != "add" or code[pc + 3][0] not in ("store_local", "store_global"):
+        return None
+    counter = _var(*code[pc + 3])
+    first, second = code[pc], code[pc + 1]
+    if (_is(first, "push_int", 1) and _is_counter(second, counter)) or (_is_counter(first, counter) and _is(second, "push_int", 1)):
+        return counter
+    return None
+
+# push_int定数またはi以外の変数なら上限
+def _bound(instruction, counter):
+    opcode, operand = instruction
+    if opcode == "push_int":
+        return "const", operand[0]
+    if opcode in ("load_local", "load_global") and _var(opcode, operand) != counter:
+        return _var(opcode, operand)
+    return None
+
+# pc・pc+1でpushする2つの値の一方がi (orderはiをpushする順: "first"・"last"・"any") なら他方の上限
+def _compare(code, pc, counter, order):
+    first, second = code[pc], code[pc + 1]
+    if order in ("last", "any") and _is_counter(second, counter):
+        return _bound(first, counter)
+    if order in ("first", "any") and _is_counter(first, counter):
+        return _bound(second, counter)
+    return None
+
+# headからbackまでのループ (backは後方分岐の位置)
+def _loop(code, sources, threaded, head, back):
+    opcode = code[back][0]
+    counter = bound = None
+    if opcode == "jump" and back - 7 >= head and _is(code[back - 1], "if_equal", back + 2):
+        # 後判定でi == nで終了
+        counter = _increment(code, back - 7)
+        if counter is not None:
+            bound = _compare(code, back - 3, counter, "any")
+        form, body, increment = "until", (head, back - 7), back - 4
+        control = range(back - 6, back + 1)
+    elif opcode == "jump" and back - 4 >= head + 3:
+        # 前判定
+        counter = _increment(code, back - 4)
+        test = code[head + 2]
+        if counter is not None and test[0] in ("if_equal", "if_greater", "if_less") and test[1][0] == back + 2:
+            order = {"if_equal": "any", "if_greater": "last", "if_less": "first"}[test[0]]
+            bound = _compare(code, head, counter, order)
+        form = "equal" if test[0] == "if_equal" else "greater"
+        body, increment = (head + 3, back - 4), back - 1
+        control = [head + 1, head + 2, back - 3, back - 2, back - 1, back]
+    elif opcode in ("if_less", "if_greater") and back - 6 >= head:
+        # i < nの間繰り返す
+        counter = _increment(code, back - 6)
+        if counter is not None:
+            bound = _compare(code, back - 2, counter, "last" if opcode == "if_less" else "first")
+        form, body, increment = "less", (head, back - 6), back - 3
+        control = range(back - 5, back + 1)
+    if counter is None or bound is None or head == 0 or not _is(code[head - 1], f"store_{counter[0]}", counter[1]):
+        return None
+
+    # 外から本体へ・本体から比較・増分の途中へ分岐しない．本体でi・nを書き換えない
+    if any(pc in sources for pc in control):
+        return None
+    rebound = set()
+    for pc in range(head, back + 1):
+        opcode, operand = code[pc]
+        if opcode in _CALL_OPCODES:
+            return None
+        if any(not head <= source <= back for source in sources.get(pc, ())):
+            return None
+        if opcode in _REBIND_OPCODES and pc != increment:
+            rebound.add(_var(opcode, operand))
+    if counter in rebound or bound in rebound:
+        return None
+    loop = Loop(head - 1, counter, bound, form)
+    _accesses(loop, code, sources, body, rebound)
+    if threaded and any(area == "global" for area, _ in [counter, bound, *loop.arrays]):
+        return None
+    return loop
+
+# 本体の配列命令のうち，添字がi・定数で配列変数を書き換えないものを記録する
+# 要素型は格納する値の型から求める (整数の配列から読み出した値は整数になるため，変わらなくなるまで繰り返す)
+def _accesses(loop, code, sources, body, rebound):
+    elements = {}
+    for _ in range(4):
+        accesses, stored = _simulate(code, sources, body, loop.counter, elements)
+        new = {var: next(iter(types)) for var, types in stored.items() if len(types) == 1 and var not in rebound}
+        if new == elements:
+            break
+        elements = new
+    else:
+        return
+    # 要素型を前提にした配列は入口で要素型を確かめる
+    for var, element in elements.items():
+        loop.arrays[var] = [element, False, -1]
+    for pc, kind, var, index, value in accesses:
+        if var in rebound or len(stored.get(var, ())) > 1 or (kind == "store" and value is None):
+            continue
+        if index is _COUNTER:
+            counted, constant = True, -1
+        elif index is not None and index[0] == "const" and type(index[1]) is int and index[1] >= 0:
+            counted, constant = False, index[1]
+        else:
+            continue
+        entry = loop.arrays.setdefault(var, [None, False, -1])
+        entry[1] = entry[1] or counted
+        entry[2] = max(entry[2], constant)
+        if kind == "store" and entry[0] is not None and _type(value) is entry[0]:
+            kind = "store_typed"
+        loop.accesses.append((pc, kind, var))
+
+def _type(value):
+    if value is None or value is _UNKNOWN:
+        return None
+    if value is _COUNTER:
+        return int
+    return type(value[1]) if value[0] == "const" else value[1]
+
+# 本体を先頭から順に実行したときのスタック上の値を追う (分岐先では分からなくなる)
+# elementsは配列変数 -> 要素型．(配列命令の一覧, 配列変数 -> 格納する値の型の集合) を返す
+def _simulate(code, sources, body, counter, elements):
+    stack = []
+    accesses = []
+    stored = {}
+    pop = lambda: stack.pop() if stack else None
+    for pc in range(*body):
+        opcode, operand = code[pc]
+        if pc in sources:
+            stack = []
+        match opcode:
+            case "":
+                pass
+            case "push_int" | "push_float" | "push_char":
+                stack.append(("const", operand[0]))
+            case "load_local" | "load_global":
+                stack.append(_COUNTER if _var(opcode, operand) == counter else _UNKNOWN)
+            case "load_local_array" | "load_global_array":
+                var = _var(opcode, operand)
+                accesses.append((pc, "load", var, pop(), None))
+                stack.append(("type", int) if elements.get(var) is int else _UNKNOWN)
+            case "store_local_array" | "store_global_array":
+                var = _var(opcode, operand)
+                index = pop()
+                value = pop()
+                accesses.append((pc, "store", var, index, value))
+                if _type(value) is not None:
+                    stored.setdefault(var, set()).add(_type(value))
+            case "add" | "sub" | "mul":
+                x = _type(pop())
+                y = _type(pop())
+                stack.append(("type", x) if x is y and x in (int, float) else _UNKNOWN)
+            case "dup":
+                value = pop() or _UNKNOWN
+                stack += [value, value]
+            case "store_local" | "store_global" | "print" | "print_char":
+                pop()
+            case "if_equal" | "if_greater" | "if_less":
+                pop()
+                pop()
+            case _:
+                stack = []
+        if opcode in ("jump", "exit"):
+            stack = []
+    return accesses, stored
+
+
+# ==============================
+#           実行
+# ==============================
+# 高速な実行ループの表に，入口の検査と検査なしの配列命令を追加する
+# handlers・opcodesは命令の番号 -> 実行関数・位置 -> 命令の番号 (quickenerがあればその表に追加する)
+# 本体の配列命令は通常の版から始める (実行ループに入り直したときはループの途中の可能性がある)
+def install(vm, loops, handlers, opcodes, quickener=None):
+    program = vm.program
+    if quickener is None:
+        handlers = list(handlers)
+        opcodes = array.array("I", opcodes)
+
+    def add(name, handler):
+        handlers.append(handler)
+        if quickener is not None:
+            quickener.names.append(name)
+        return len(handlers) - 1
+
+    def base(pc):
+        op = program.opcodes[pc]
+        return op if quickener is None else quickener.adaptive_ids.get(op, op)
+
+    unchecked = {} # (命令の種類, 領域) -> 番号
+    for loop in loops:
+        fast = []
+        checked = []
+        for pc, kind, (area, _) in loop.accesses:
+            if (kind, area) not in unchecked:
+                unchecked[kind, area] = add(f"{kind}_{area}_array_unchecked", _UNCHECKED[kind](vm, area))
+            fast.append((pc, unchecked[kind, area]))
+            checked.append((pc, base(pc)))
+            opcodes[pc] = base(pc)
+        store = handlers[program.opcodes[loop.guard]]
+        opcodes[loop.guard] = add("hoist_guard", _guard(vm, loop, store, opcodes, fast, checked))
+    return handlers, opcodes
+
+# カウンタ変数を初期化してから，本体の配列命令を検査なし・通常の版に切り替える
+def _guard(vm, loop, store, opcodes, fast, checked):
+    def guard(operand):
+        store(operand)
+        for pc, op in (fast if loop.valid(vm) else checked):
+            opcodes[pc] = op
+    return guard
+
+
+# ===== 検査なしの配列命令 =====
+# 添字(スタックの先頭)は範囲内の整数，配列変数は要素型の配列であることを入口で確かめている
+def _load(vm, area):
+    items = vm.data_stack.items
+    if area == "global":
+        global_items = vm.global_area.items
+        def load_global_array(operand):
+            items[-1] = global_items[operand[0]].items[items[-1]]
+        return load_global_array
+    def load_local_array(operand):
+        items[-1] = vm.local_area.items[operand[0]].items[items[-1]]
+    return load_local_array
+
+# 格納する値の型が決まらない場合は要素型だけを検査する
+def _store(vm, area):
+    items = vm.data_stack.items
+    if area == "global":
+        global_items = vm.global_area.items
+        def store_global_array(operand):
+            array = global_items[operand[0]]
+            if type(items[-2]) is not array.type:
+                raise vm_error.Error("ERROR_MISMATCHING_ARRAY_TYPE")
+            array.items[items[-1]] = items[-2]
+            del items[-2:]
+        return store_global_array
+    def store_local_array(operand):
+        array = vm.local_area.items[operand[0]]
+        if type(items[-2]) is not array.type:
+            raise vm_error.Error("ERROR_MISMATCHING_ARRAY_TYPE")
+        array.items[items[-1]] = items[-2]
+        del items[-2:]
+    return store_local_array
+
+def _store_typed(vm, area):
+    items = vm.data_stack.items
+    if area == "global":
+        global_items = vm.global_area.items
+        def store_global_array(operand):
+            global_items[operand[0]].items[items[-1]] = items[-2]
+            del items[-2:]
+        return store_global_array
+    def store_local_array(operand):
+        vm.local_area.items[operand[0]].items[items[-1]] = items[-2]
+        del items[-2:]
+    return store_local_array
+
+_UNCHECKED = {"load": _load, "store": _store, "store_typed": _store_typed}
@@ -0,0 +1,216 @@
+import array
+
+# ==============================
+#     小さなサブルーチンのインライン展開
+# ==============================
+# 構文チェック後のプログラムについて，callの飛び先からcall graphを作り，
+# 再帰しない・exitが末尾の1つだけ・命令数がmax_size以下のサブルーチンを呼び出し箇所に展開する．
+# 展開した本体のローカル変数は呼び出し元のフレームの未使用の番号に付け替え，分岐先は展開後の位置に付け替える．
+# 元のサブルーチンはそのまま残す (他の呼び出し箇所・フォールスルーで使われる可能性がある)
+
+# オペランドが行番号の命令
+_LINE_OPCODES = {"jump", "if_equal", "if_greater", "if_less", "call", "parallel_for", "spawn"}
+_BRANCH_OPCODES = {"jump", "if_equal", "if_greater", "if_less"}
+
+# オペランドがローカル変数の番号の命令 (store_local以外は変数が定義済みである必要がある)
+_LOCAL_OPCODES = {
+    "store_local",
+    "load_local",
+    "free_local",
+    "store_local_array",
+    "load_local_array",
+    "sync_local_array",
+    "read_local_array",
+    "print_local_array",
+    "print_local_array_slice",
+    "store_local_matrix",
+    "load_local_matrix",
+}
+
+
+# サブルーチンの先頭(0始まりの位置)から到達する命令の位置 (callは呼び出し先に入らず次の命令へ進む)
+def _reachable(code, start):
+    seen = set()
+    work = [start]
+    while work:
+        pc = work.pop()
+        if pc in seen or not 0 <= pc < len(code):
+            continue
+        seen.add(pc)
+        work.extend(_successors(code, pc))
+    return seen
+
+def _successors(code, pc):
+    opcode = code[pc][0]
+    if opcode == "exit":
+        return []
+    if opcode == "jump":
+        return [code[pc][1][0] - 1]
+    if opcode in _BRANCH_OPCODES:
+        return [pc + 1, code[pc][1][0] - 1]
+    return [pc + 1]
+
+
+# ===== call graph =====
+# 飛び先 -> 本体から呼び出す飛び先の集合
+def call_graph(code):
+    targets = {line[1][0] - 1 for line in code if line[0] == "call"}
+    graph = {}
+    for target in targets:
+        graph[target] = {code[pc][1][0] - 1 for pc in _reachable(code, target)
+                         if code[pc][0] == "call"}
+    return graph
+
+def _is_recursive(graph, target):
+    seen = set()
+    work = list(graph.get(target, ()))
+    while work:
+        node = work.pop()
+        if node == target:
+            return True
+        if node not in seen:
+            seen.add(node)
+            work.extend(graph.get(node, ()))
+    return False
+
+
+# ===== 展開できるか =====
+# 展開できれば本体の範囲(先頭, exitの位置)，できなければ理由を返す
+def _body(code, graph, target, max_size):
+    if not 0 <= target < len(code):
+        return "out of range"
+    reachable = _reachable(code, target)
+    end = max(reachable)
+    if reachable != set(range(target, end + 1)):
+        return "not contiguous"
+    if code[end][0] != "exit" or [pc for pc in reachable if code[pc][0] == "exit"] != [end]:
+        return "multiple exits"
+    if end - target > max_size:
+        return "too large"
+    if _is_recursive(graph, target):
+        return "recursive"
+    if not _defined_before_use(code, target, end):
+        return "local used before store"
+    return (target, end)
+
+# 本体の全ての経路で，ローカル変数を格納してから参照しているか
+# (展開後の変数は呼び出し毎に空にならないため，未定義の参照をエラーにできない)
+def _defined_before_use(code, start, end):
+    body = range(start, end + 1)
+    slots = {code[pc][1][0] for pc in body if code[pc][0] in _LOCAL_OPCODES}
+    defined_in = {pc: set(slots) for pc in body}
+    defined_in[start] = set()
+    changed = True
+    while changed:
+        changed = False
+        for pc in body:
+            defined = set(defined_in[pc])
+            opcode = code[pc][0]
+            if opcode == "store_local":
+                defined.add(code[pc][1][0])
+            elif opcode == "free_local":
+                defined.discard(code[pc][1][0])
+            for succ in _successors(code, pc):
+                if start <= succ <= end and not defined >= defined_in[succ]:
+                    defined_in[succ] &= defined
+                    changed = True
+    for pc in body:
+        opcode = code[pc][0]
+        if opcode in _LOCAL_OPCODES and opcode != "store_local" and code[pc][1][0] not in defined_in[pc]:
+            return False
+    return True
+
+
+# ==============================
+#          展開
+# ==============================
+# programの命令列を展開後の命令列に置き換え，source_map(展開後の位置 -> 元の位置)と
+# inlined(展開の記録)を設定する．展開した命令の合計がbudgetを超える呼び出し箇所は展開しない
+def inline(program, max_size=8, budget=1000):
+    code = program.instructions()
+    graph = call_graph(code)
+    bodies = {}
+    skipped = {}
+    for target in sorted(graph):
+        body = _body(code, graph, target, max_size)
+        if isinstance(body, tuple):
+            bodies[target] = body
+        else:
+            skipped[target + 1] = body
+
+    # 展開するローカル変数の番号は，プログラム中のどの番号とも重ならない番号から割り当てる
+    next_slot = 1 + max((line[1][0] for line in code if line[0] in _LOCAL_OPCODES), default=-1)
+    sites = {}
+    for pc, line in enumerate(code):
+        target = line[1][0] - 1 if line[0] == "call" else None
+        if target not in bodies:
+            continue
+        start, end = bodies[target]
+        if start <= pc <= end or budget < end - start:
+            continue
+        budget -= end - start
+        sites[pc] = (start, end, next_slot)
+        used = [code[i][1][0] for i in range(start, end) if code[i][0] in _LOCAL_OPCODES]
+        next_slot += 1 + max(used, default=-1)
+
+    # 命令列の組み立て (行番号のオペランドは後で付け替える)
+    result = []
+    source_map = []
+    first = [] # 元の位置 -> 展開後の最初の位置
+    patches = [] # (展開後の位置, 元の飛び先の位置 または ("inline", 展開後の飛び先の位置))
+    for pc, line in enumerate(code):
+        first.append(len(result))
+        if pc not in sites:
+            if line[0] in _LINE_OPCODES:
+                patches.append((len(result), line[1][0] - 1))
+            result.append((line[0], list(line[1])))
+            source_map.append(pc)
+            continue
+        start, end, base = sites[pc]
+        copy_start = len(result)
+        for i in range(start, end):
+            opcode = code[i][0]
+            operand = list(code[i][1])
+            if opcode in _LOCAL_OPCODES:
+                operand[0] += base
+            if opcode in _BRANCH_OPCODES and start <= operand[0] - 1 <= end:
+                # 本体内への分岐 (exitへの分岐は呼び出しの次の命令へ)
+                destination = operand[0] - 1
+                patches.append((len(result), ("inline", copy_start + destination - start) if destination < end else pc + 1))
+            elif opcode in _LINE_OPCODES:
+                patches.append((len(result), operand[0] - 1))
+            result.append((opcode, operand))
+            source_map.append(i)
+        if start == end:
+            # 本体がexitだけなら何もしない命令を置く
+            result.append(("", []))
+            source_map.append(pc)
+    first.append(len(result))
+
+    for index, destination in patches:
+        if isinstance(destination, tuple):
+            line = destination[1] + 1
+        elif 0 <= destination <= len(code):
+            line = first[destination] + 1
+        else:
+            line = destination + 1 + len(result) - len(code)
+        result[index][1][0] = line
+
+    program.set_instructions(result)
+    program.source_map = array.array("q", source_map + [len(code)])
+    program.inlined = [{"line": start + 1, "size": end - start,
+                        "sites": [pc + 1 for pc, site in sites.items() if site[0] == start]}
+                       for start, end in sorted(bodies.values())]
+    program.inline_skipped = skipped
+    return program
+
+
+# 展開の記録の表示
+def report(program):
+    lines = []
+    for entry in program.inlined:
+        sites = ", ".join(map(str, entry["sites"])) or "-"
+        lines.append(f"inline: sub_{entry['line']} ({entry['size']} instructions) at line {sites}")
+    for line, reason in sorted(program.inline_skipped.items()):
+        lines.append(f"inline: sub_{line} skipped ({reason})")
+    return "\n".join(lines)
@@ -0,0 +1,111 @@
+import codecs
+import re
+import sys
+from . import vm_error
+
+BUFFER_SIZE = 1 << 20 # 1回に読み込むバイト数
+
+_TOKEN = re.compile(r"\S+")
+
+
+# 入力の終端を表す値 (if_equalでpush_eofの値と比較する)
+class _EOF:
+    def __repr__(self):
+        return "EOF"
+
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return False
+
+EOF = _EOF()
+
+
+# ==============================
+#       バッファ付き入力
+# ==============================
+# 整数・実数は空白区切りの単語として，文字は空白も含めて1文字ずつ読み込む
+# streamはバイナリストリーム (UTF-8として逐次デコードする)
+class Reader:
+    def __init__(self, stream):
+        # read1は届いている分だけを返すため，パイプや端末からの入力を待ち続けない
+        self.read = getattr(stream, "read1", stream.read)
+        self.decoder = codecs.getincrementaldecoder("utf8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    # バッファの残りに次のチャンクを連結 (これ以上読めなければFalse)
+    def _fill(self):
+        chunk = ""
+        while not chunk:
+            if self.eof:
+                return False
+            data = self.read(BUFFER_SIZE)
+            if not data:
+                self.eof = True
+            chunk = self.decoder.decode(data, final=self.eof)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    # ===== 1文字 =====
+    def char(self):
+        if self.pos >= len(self.buffer) and not self._fill():
+            return EOF
+        c = self.buffer[self.pos]
+        self.pos += 1
+        return c
+
+    def chars(self, n):
+        result = []
+        while len(result) < n:
+            if self.pos >= len(self.buffer) and not self._fill():
+                break
+            chunk = self.buffer[self.pos:self.pos + n - len(result)]
+            self.pos += len(chunk)
+            result.extend(chunk)
+        return result
+
+    # ===== 単語 =====
+    # 最大n個の単語を読み込む (単語がバッファの終端で切れている可能性があれば補充する)
+    def tokens(self, n):
+        result = []
+        while len(result) < n:
+            for match in _TOKEN.finditer(self.buffer, self.pos):
+                if match.end() == len(self.buffer) and not self.eof:
+                    break
+                result.append(match.group())
+                self.pos = match.end()
+                if len(result) == n:
+                    return result
+            else:
+                self.pos = len(self.buffer)
+            if not self._fill():
+                if self.pos < len(self.buffer):
+                    continue # 最後の単語
+                break
+        return result
+
+    def ints(self, n):
+        try:
+            return [int(token) for token in self.tokens(n)]
+        except ValueError:
+            raise vm_error.Error("ERROR_INVALID_INPUT")
+
+    def floats(self, n):
+        try:
+            return [float(token) for token in self.tokens(n)]
+        except ValueError:
+            raise vm_error.Error("ERROR_INVALID_INPUT")
+
+
+# 入力元を開く (pathがNoneなら標準入力)
+def open_input(path=None):
+    if path is None:
+        return Reader(sys.stdin.buffer)
+    try:
+        return Reader(open(path, "rb", buffering=BUFFER_SIZE))
+    except OSError:
+        raise vm_error.Error("ERROR_INPUT")
@@ -0,0 +1,309 @@
+from . import vm_array
+import math
+
+# ==============================
+#   ホットループ用トレーシングJIT
+# ==============================
+# 後方分岐の飛び先ごとに実行回数を数え，閾値に達したら1周分の命令列を記録する．
+# 記録した命令列は，観測した型と分岐方向をガードにしたPython関数へコンパイルされ，
+# ガードが外れた時点でスタックを復元してインタプリタへ戻る．
+
+# 命令がスタックからpopする個数
+_POPS = {
+    "": 0,
+    "push_int": 0,
+    "push_float": 0,
+    "push_char": 0,
+    "add": 2,
+    "sub": 2,
+    "mul": 2,
+    "div": 2,
+    "dup": 1,
+    "store_global": 1,
+    "load_global": 0,
+    "store_local": 1,
+    "load_local": 0,
+    "store_local_array": 2,
+    "store_global_array": 2,
+    "load_local_array": 1,
+    "load_global_array": 1,
+    "print": 1,
+    "if_equal": 2,
+    "if_greater": 2,
+    "if_less": 2,
+    "jump": 0,
+}
+
+# 定数のソースコード表現 (inf・nanはリテラルで書けない)
+def _constant(value):
+    if type(value) is float and not math.isfinite(value):
+        return f"float({str(value)!r})"
+    return repr(value)
+
+_BINARY_OPERATORS = {"add": "+", "sub": "-", "mul": "*", "div": "/"}
+_COMPARE_OPERATORS = {"if_equal": "==", "if_greater": ">", "if_less": "<"}
+
+
+class JIT:
+    def __init__(self, threshold=50, max_trace_length=200, max_aborts=3):
+        self.threshold = threshold               # 記録を開始する後方分岐の回数
+        self.max_trace_length = max_trace_length # 記録する命令数の上限
+        self.max_aborts = max_aborts             # 記録を諦めるまでの中断回数
+        self.counters = {}    # 飛び先の行番号 -> 後方分岐の回数
+        self.aborts = {}      # 飛び先の行番号 -> 記録を中断した回数
+        self.traces = {}      # 飛び先の行番号 -> コンパイル済みトレース
+        self.sources = {}     # 飛び先の行番号 -> 生成したソースコード
+        self.recording = False
+        self.active = None    # 実行中のトレースの飛び先の行番号 (実行中の状態の出力で参照する)
+        self.stats = {"compiled": 0, "entered": 0, "aborted": 0}
+
+    # ===== 後方分岐 =====
+    # 飛び先へ分岐した直後(vm.pcは飛び先の1つ前)に呼ばれる
+    def backward(self, vm, line):
+        if self.recording or vm.hooks.is_active():
+            return
+        trace = self.traces.get(line)
+        if trace is None:
+            count = self.counters.get(line, 0) + 1
+            self.counters[line] = count
+            if count < self.threshold:
+                return
+            trace = self._record(vm, line)
+            if trace is None:
+                return
+        self.stats["entered"] += 1
+        self.active = line
+        try:
+            vm.retired += trace(vm)
+        finally:
+            self.active = None
+
+    # ===== 記録 =====
+    def _record(self, vm, line):
+        start = line - 1
+        program = vm.program
+        stack = vm.data_stack.items
+        records = []
+        self.recording = True
+        try:
+            while True:
+                pc = vm.pc + 1
+                if pc >= len(program) or len(records) >= self.max_trace_length:
+                    return self._abort(line)
+                opcode = program.opcode(pc)
+                operand = program.operand(pc)
+                if opcode not in _POPS:
+                    return self._abort(line)
+
+                # 実行前に観測した型
+                popped = [type(stack[-1 - i]) for i in range(min(_POPS[opcode], len(stack)))]
+                element = None
+                if opcode.endswith("_array"):
+                    space = vm.global_area if "global" in opcode else vm.local_area
+                    array = space.items.get(operand[0])
+                    if type(array) is not vm_array.Array:
+                        return self._abort(line)
+                    element = array.type
+
+                vm.pc = pc
+                vm.retired += 1
+                vm._execute(opcode, operand)
+
+                # 実行後に観測した型・分岐方向
+                pushed = type(stack[-1]) if stack else None
+                taken = vm.pc != pc
+                records.append((pc, opcode, operand, popped, pushed, element, taken))
+                if vm.pc + 1 == start:
+                    break
+        finally:
+            self.recording = False
+
+        try:
+            source, namespace = _Compiler(records, start).compile()
+        except NotImplementedError:
+            return self._abort(line)
+        exec(compile(source, f"<jit trace: line {line}>", "exec"), namespace)
+        trace = namespace["_trace"]
+        self.traces[line] = trace
+        self.sources[line] = source
+        self.stats["compiled"] += 1
+        return trace
+
+    # 記録を中断 (一定回数中断した飛び先は二度と記録しない)
+    def _abort(self, line):
+        self.stats["aborted"] += 1
+        self.aborts[line] = self.aborts.get(line, 0) + 1
+        if self.aborts[line] >= self.max_aborts:
+            self.counters[line] = float("-inf")
+        else:
+            self.counters[line] = 0
+        return None
+
+
+# ==============================
+#      トレースのコンパイル
+# ==============================
+# スタックの値はループ1周の間Pythonのローカル変数(シンボリックスタック)として扱い，
+# 脱出時とループの終端でのみ実際のスタックへ書き戻す．
+# トレース関数は実行した命令数を返す
+class _Compiler:
+    def __init__(self, records, start):
+        self.records = records
+        self.start = start
+        self.code = []      # ループ本体のソースコード
+        self.sym = []       # シンボリックスタック: (式, 型)
+        self.n_var = 0
+        self.index = 0      # コード生成中の命令の位置
+        self.namespace = {"_missing": object(), "Array": vm_array.Array}
+        self.type_names = {}
+
+    def compile(self):
+        for self.index, record in enumerate(self.records):
+            self._instruction(*record)
+        self._emit(self._flush())
+        self._emit(f"retired += {len(self.records)}")
+        # 実行中にフックが登録されたらループの先頭でインタプリタへ戻る
+        self._emit(f"if hooks.changed: vm.pc = {self.start - 1}; return retired")
+        source = "def _trace(vm):\n"\
+                 "    hooks = vm.hooks\n"\
+                 "    stack = vm.data_stack.items\n"\
+                 "    local_items = vm.local_area.items\n"\
+                 "    global_items = vm.global_area.items\n"\
+                 "    retired = 0\n"\
+                 "    while True:\n"
+        source += "".join(f"        {line}\n" for line in self.code if line)
+        return source, self.namespace
+
+    # ===== コード生成の補助 =====
+    def _emit(self, line):
+        self.code.append(line)
+
+    def _var(self):
+        self.n_var += 1
+        return f"v{self.n_var}"
+
+    def _type(self, t):
+        if t not in self.type_names:
+            name = f"T{len(self.type_names)}"
+            self.type_names[t] = name
+            self.namespace[name] = t
+        return self.type_names[t]
+
+    # シンボリックスタックを実際のスタックへ書き戻すコード
+    def _flush(self):
+        sym = self.sym
+        if not sym:
+            return ""
+        if len(sym) == 1:
+            return f"stack.append({sym[0][0]}); "
+        return f"stack.extend(({', '.join(expr for expr, _ in sym)},)); "
+
+    # 命令pcの実行前の状態でインタプリタへ戻る
+    # (executedはループ1周の中で実行済みの命令数)
+    def _exit(self, pc, executed=None):
+        executed = self.index if executed is None else executed
+        return f"{self._flush()}vm.pc = {pc - 1}; return retired + {executed}"
+
+    # n個の値をpopせずに参照する (先頭から順に)
+    def _peek(self, pc, n, types):
+        values = list(reversed(self.sym[-n:])) if n else []
+        rest = n - len(values)
+        if rest > 0:
+            self._emit(f"if len(stack) < {rest}: {self._exit(pc)}")
+            for i in range(rest):
+                t = types[len(values)]
+                var = self._var()
+                self._emit(f"{var} = stack[{-1 - i}]")
+                self._emit(f"if type({var}) is not {self._type(t)}: {self._exit(pc)}")
+                values.append((var, t))
+        return values
+
+    # 参照したn個の値をpopする
+    def _consume(self, n):
+        from_sym = min(n, len(self.sym))
+        if from_sym:
+            del self.sym[-from_sym:]
+        if n > from_sym:
+            self._emit(f"del stack[{from_sym - n}:]")
+
+    def _push(self, expr, t):
+        var = self._var()
+        self._emit(f"{var} = {expr}")
+        self.sym.append((var, t))
+
+    # ===== 命令毎のコード生成 =====
+    def _instruction(self, pc, opcode, operand, popped, pushed, element, taken):
+        n = _POPS[opcode]
+        if len(popped) < n:
+            raise NotImplementedError(opcode)
+        match opcode:
+            case "" | "jump":
+                pass
+            case "push_int" | "push_float" | "push_char":
+                self.sym.append((_constant(operand[0]), type(operand[0])))
+            case "add" | "sub" | "mul" | "div":
+                (a, _), (b, _) = self._peek(pc, 2, popped)
+                if opcode == "div":
+                    self._emit(f"if {b} == 0: {self._exit(pc)}")
+                self._consume(2)
+                self._push(f"{a} {_BINARY_OPERATORS[opcode]} {b}", pushed)
+            case "dup":
+                value, = self._peek(pc, 1, popped)
+                self._consume(1)
+                self.sym.append(value)
+                self.sym.append(value)
+            case "store_global" | "store_local":
+                items = opcode.split("_")[1] + "_items"
+                (value, _), = self._peek(pc, 1, popped)
+                self._consume(1)
+                self._emit(f"{items}[{operand[0]!r}] = {value}")
+            case "load_global" | "load_local":
+                items = opcode.split("_")[1] + "_items"
+                var = self._var()
+                self._emit(f"{var} = {items}.get({operand[0]!r}, _missing)")
+                self._emit(f"if type({var}) is not {self._type(pushed)}: {self._exit(pc)}")
+                self.sym.append((var, pushed))
+            case "store_global_array" | "store_local_array":
+                array = self._array(pc, opcode, operand, element)
+                (index, index_type), (value, value_type) = self._peek(pc, 2, popped)
+                if index_type is not int or value_type is not element:
+                    raise NotImplementedError(opcode)
+                self._emit(f"if not 0 <= {index} < len({array}): {self._exit(pc)}")
+                self._consume(2)
+                self._emit(f"{array}[{index}] = {value}")
+            case "load_global_array" | "load_local_array":
+                array = self._array(pc, opcode, operand, element)
+                (index, index_type), = self._peek(pc, 1, popped)
+                if index_type is not int:
+                    raise NotImplementedError(opcode)
+                self._emit(f"if not 0 <= {index} < len({array}): {self._exit(pc)}")
+                var = self._var()
+                self._emit(f"{var} = {array}[{index}]")
+                self._emit(f"if type({var}) is not {self._type(pushed)}: {self._exit(pc)}")
+                self._consume(1)
+                self.sym.append((var, pushed))
+            case "print":
+                (value, _), = self._peek(pc, 1, popped)
+                self._consume(1)
+                self._emit(f"print({value})")
+            case "if_equal" | "if_greater" | "if_less":
+                (a, _), (b, _) = self._peek(pc, 2, popped)
+                self._consume(2)
+                condition = f"{a} {_COMPARE_OPERATORS[opcode]} {b}"
+                # 記録時と逆方向に分岐したらインタプリタへ戻る
+                if taken:
+                    self._emit(f"if not ({condition}): {self._exit(pc + 1, self.index + 1)}")
+                else:
+                    self._emit(f"if {condition}: {self._exit(operand[0] - 1, self.index + 1)}")
+            case _:
+                raise NotImplementedError(opcode)
+
+    # 配列変数の要素リストを取り出すコード (配列でない・要素型が異なる場合は脱出)
+    def _array(self, pc, opcode, operand, element):
+        items = opcode.split("_")[1] + "_items"
+        array = self._var()
+        self._emit(f"{array} = {items}.get({operand[0]!r}, _missing)")
+        self._emit(f"if type({array}) is not Array or {array}.type is not {self._type(element)}: {self._exit(pc)}")
+        elements = self._var()
+        self._emit(f"{elements} = {array}.items")
+        return elements
@@ -0,0 +1,151 @@
+import operator
+from . import vm_error
+from . import vm_array
+
+# NumPyは読み込みに時間がかかるため，最初に2次元配列を作るときに読み込む
+# (NumPyがなければNoneにしてPythonのリストで計算する)
+_NOT_LOADED = object()
+numpy = _NOT_LOADED
+
+def _load_numpy():
+    global numpy
+    if numpy is _NOT_LOADED:
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        numpy = module
+    return numpy
+
+
+# ==============================
+#         2次元の数値配列
+# ==============================
+# 要素は整数型または実数型．NumPyがあればndarray，なければ行のリストのリストに格納する
+# (NumPyの整数型の要素はPythonの整数のobject配列にして，桁あふれせずリストと同じ結果にする)
+# 添字は負の値を含めて範囲外ならエラー
+class Matrix:
+    def __init__(self, element_type, rows, cols, data=None):
+        self.type = element_type
+        self.rows = rows
+        self.cols = cols
+        if data is None:
+            zero = element_type(0)
+            if _load_numpy() is not None:
+                data = numpy.zeros((rows, cols), dtype=_dtype(element_type))
+            else:
+                data = [[zero] * cols for _ in range(rows)]
+        self.data = data
+
+    # ===== 要素 =====
+    def _check(self, row, col):
+        if type(row) is not int or type(col) is not int or not (0 <= row < self.rows and 0 <= col < self.cols):
+            raise vm_error.Error("ERROR_ARRAY_INDEX_OUT_OF_RANGE")
+
+    def store(self, row, col, value):
+        self._check(row, col)
+        if type(value) is not self.type:
+            raise vm_error.Error("ERROR_MISMATCHING_ARRAY_TYPE")
+        if type(self.data) is list:
+            self.data[row][col] = value
+        else:
+            self.data[row, col] = value
+
+    def load(self, row, col):
+        self._check(row, col)
+        if type(self.data) is list:
+            return self.data[row][col]
+        value = self.data[row, col]
+        return value.item() if isinstance(value, numpy.generic) else value
+
+    def tolist(self):
+        return self.data if type(self.data) is list else self.data.tolist()
+
+    # ===== 行列演算 =====
+    def matmul(self, other):
+        if not isinstance(other, Matrix) or self.cols != other.rows:
+            raise vm_error.Error("ERROR_MATRIX_SHAPE")
+        element_type = float if float in (self.type, other.type) else int
+        if type(self.data) is not list:
+            return Matrix(element_type, self.rows, other.cols, (self.data @ other.data).astype(_dtype(element_type)))
+        columns = list(zip(*other.data))
+        data = [[sum(map(operator.mul, row, column)) for column in columns] for row in self.data]
+        if element_type is float:
+            data = [[float(x) for x in row] for row in data]
+        return Matrix(element_type, self.rows, other.cols, data)
+
+    def transpose(self):
+        if type(self.data) is not list:
+            return Matrix(self.type, self.cols, self.rows, self.data.T.copy())
+        return Matrix(self.type, self.cols, self.rows, [list(column) for column in zip(*self.data)])
+
+    # 行毎・列毎の合計 (要素型の配列)
+    def row_sum(self):
+        return self._array([sum(row) for row in self.data] if type(self.data) is list else self.data.sum(axis=1).tolist())
+
+    def col_sum(self):
+        return self._array([sum(column) for column in zip(*self.data)] if type(self.data) is list else self.data.sum(axis=0).tolist())
+
+    def _array(self, values):
+        array = vm_array.Array(self.type, len(values))
+        array.store_many(0, [self.type(x) for x in values])
+        return array
+
+    # ===== 要素毎の演算 (add・sub・mul・div) =====
+    # 相手は同じ大きさの行列または数値
+    def _elementwise(self, other, function, reverse=False):
+        if isinstance(other, Matrix):
+            if (self.rows, self.cols) != (other.rows, other.cols):
+                raise vm_error.Error("ERROR_MATRIX_SHAPE")
+            types = {self.type, other.type}
+            other_data = other.data
+        elif type(other) in (int, float):
+            types = {self.type, type(other)}
+            other_data = other
+        else:
+            return NotImplemented
+        left, right = (other_data, self.data) if reverse else (self.data, other_data)
+        element_type = float if float in types or function is operator.truediv else int
+        if type(self.data) is not list:
+            # NumPyは0除算でinfを返すため，Pythonの計算と同じく例外にする
+            if function is operator.truediv and not numpy.all(right):
+                raise ZeroDivisionError("division by zero")
+            return Matrix(element_type, self.rows, self.cols, function(left, right).astype(_dtype(element_type)))
+        if isinstance(other, Matrix):
+            data = [list(map(function, a, b)) for a, b in zip(left, right)]
+        elif reverse:
+            data = [[function(left, x) for x in row] for row in right]
+        else:
+            data = [[function(x, right) for x in row] for row in left]
+        return Matrix(element_type, self.rows, self.cols, data)
+
+    def __add__(self, other):
+        return self._elementwise(other, operator.add)
+
+    def __radd__(self, other):
+        return self._elementwise(other, operator.add, True)
+
+    def __sub__(self, other):
+        return self._elementwise(other, operator.sub)
+
+    def __rsub__(self, other):
+        return self._elementwise(other, operator.sub, True)
+
+    def __mul__(self, other):
+        return self._elementwise(other, operator.mul)
+
+    def __rmul__(self, other):
+        return self._elementwise(other, operator.mul, True)
+
+    def __truediv__(self, other):
+        return self._elementwise(other, operator.truediv)
+
+    def __rtruediv__(self, other):
+        return self._elementwise(other, operator.truediv, True)
+
+    # printでは1行ずつ空白区切りで出力
+    def __str__(self):
+        return "\n".join(" ".join(map(str, row)) for row in self.tolist())
+
+def _dtype(element_type):
+    return object if element_type is int else numpy.float64
@@ -0,0 +1,208 @@
+import json
+import sys
+import time
+import weakref
+from . import vm_address_space
+from . import vm_array
+from . import vm_matrix
+from . import vm_stack
+
+# ==============================
+#       メモリプロファイラ
+# ==============================
+# 確保した配列(new_array_*・new_matrix_*・行列演算の結果)，callで確保したフレーム，スタックの伸びを
+# 確保した命令の位置(行, 命令名)毎に記録する．配列は弱参照で回収を検知し，生存しているバイト数・最大値と
+# その推移を記録する．終了時(エラー終了を含む)に生存している配列を確保した位置毎に集計して出力し，
+# スナップショット(JSON)同士を比較してリークを探せる:
+#   python -m vm_modules.vm_memory 前のスナップショット 後のスナップショット
+# 無効な場合はVMのmemoryがNoneになり，配列の確保とcall・exitで判定が1回増えるだけ
+
+# フレーム1つ分のバイト数 (空のローカル変数領域と，リターンスタック・ローカル変数領域のスタックの要素)
+FRAME_BYTES = sys.getsizeof(vm_address_space.AddressSpace()) + sys.getsizeof({}) + 2 * 8
+STACK_SLOT_BYTES = 8 # スタックの要素1つ分(参照)のバイト数
+
+class MemoryProfiler:
+    def __init__(self, interval=0.01):
+        self.interval = interval # 推移を記録する最小の間隔(秒)
+        self.vm = None
+        self.live = {}           # id -> (位置, バイト数, 弱参照) 生存している配列
+        self.allocated = {}      # 位置 -> [確保した数, 確保したバイト数] (回収済みを含む)
+        self.frames = []         # 生存しているフレームの (位置, バイト数)
+        self.array_bytes = 0
+        self.frame_bytes = 0
+        self.peak_bytes = 0
+        self.peak_site = None    # 最大値になったときに確保した位置
+        self.stack_peak = (0, None) # (データスタックの最大の深さ, そのときの位置)
+        self.timeline = []       # (開始からの秒数, 生存しているバイト数)
+        self.start_time = time.perf_counter()
+        self.last_time = None
+
+    def start(self, vm):
+        self.vm = vm
+        self.start_time = time.perf_counter()
+
+    # 深さの最大値を記録するデータスタック
+    def stack(self):
+        return _ProfiledStack(self)
+
+    # ===== 記録 =====
+    # 実行中の命令の位置 (行, 命令名)
+    def _site(self):
+        vm = self.vm
+        if not 0 <= vm.pc < len(vm.program):
+            return (0, "")
+        return (vm.program.source_index(vm.pc) + 1, vm.program.opcode(vm.pc))
+
+    def allocate(self, value):
+        key = id(value)
+        if key in self.live:
+            # 再利用プールから取り出した配列は確保し直した位置に付け替える
+            self._free(key)
+        site = self._site()
+        size = nbytes(value)
+        self.live[key] = (site, size, weakref.ref(value, lambda ref, key=key: self._collected(key, ref)))
+        counts = self.allocated.setdefault(site, [0, 0])
+        counts[0] += 1
+        counts[1] += size
+        self.array_bytes += size
+        self._update(site)
+        return value
+
+    def _collected(self, key, ref):
+        entry = self.live.get(key)
+        if entry is not None and entry[2] is ref:
+            self._free(key)
+            self._update()
+
+    def _free(self, key):
+        _, size, _ = self.live.pop(key)
+        self.array_bytes -= size
+
+    def call(self):
+        site = self._site()
+        self.frames.append((site, FRAME_BYTES))
+        self.frame_bytes += FRAME_BYTES
+        self._update(site)
+
+    def exit(self):
+        if self.frames:
+            _, size = self.frames.pop()
+            self.frame_bytes -= size
+            self._update()
+
+    def stack_grew(self, depth):
+        self.stack_peak = (depth, self._site())
+
+    def _update(self, site=None):
+        live = self.array_bytes + self.frame_bytes
+        if live > self.peak_bytes:
+            self.peak_bytes = live
+            self.peak_site = site
+        now = time.perf_counter()
+        if self.last_time is None or now - self.last_time >= self.interval:
+            self.last_time = now
+            self.timeline.append((round(now - self.start_time, 6), live))
+
+    # ===== 出力 =====
+    def snapshot(self):
+        live = {}
+        for site, size, _ in self.live.values():
+            entry = live.setdefault(_site_name(site), {"count": 0, "bytes": 0})
+            entry["count"] += 1
+            entry["bytes"] += size
+        frames = {}
+        for site, size in self.frames:
+            entry = frames.setdefault(_site_name(site), {"count": 0, "bytes": 0})
+            entry["count"] += 1
+            entry["bytes"] += size
+        depth, site = self.stack_peak
+        return {
+            "live_bytes": self.array_bytes + self.frame_bytes,
+            "live_array_bytes": self.array_bytes,
+            "live_frame_bytes": self.frame_bytes,
+            "peak_bytes": self.peak_bytes,
+            "peak_site": _site_name(self.peak_site) if self.peak_site else None,
+            "data_stack_peak": {"depth": depth, "bytes": depth * STACK_SLOT_BYTES,
+                                "site": _site_name(site) if site else None},
+            "live": live,
+            "frames": frames,
+            "allocated": {_site_name(site): {"count": count, "bytes": size}
+                          for site, (count, size) in self.allocated.items()},
+            "timeline": self.timeline,
+        }
+
+    # 生存している配列・フレームの確保した位置毎の上位n件
+    def table(self, n=20):
+        snapshot = self.snapshot()
+        lines = [f"live: {snapshot['live_bytes']} bytes (arrays {snapshot['live_array_bytes']}, frames {snapshot['live_frame_bytes']})",
+                 f"peak: {snapshot['peak_bytes']} bytes at {snapshot['peak_site']}",
+                 f"data stack peak: {snapshot['data_stack_peak']['depth']} at {snapshot['data_stack_peak']['site']}",
+                 f"{'bytes':>12} {'count':>8}  site"]
+        rows = [(entry["bytes"], entry["count"], site) for site, entry in snapshot["live"].items()]
+        rows += [(entry["bytes"], entry["count"], f"{site} (frames)") for site, entry in snapshot["frames"].items()]
+        for size, count, site in sorted(rows, reverse=True)[:n]:
+            lines.append(f"{size:>12} {count:>8}  {site}")
+        return "\n".join(lines)
+
+    def write(self, path):
+        with open(path, "w", encoding="utf8") as f:
+            json.dump(self.snapshot(), f)
+
+
+class _ProfiledStack(vm_stack.TrackedStack):
+    def __init__(self, profiler):
+        super().__init__()
+        self.profiler = profiler
+
+    def push(self, item):
+        self.items.append(item)
+        if len(self.items) > self.max_depth:
+            self.max_depth = len(self.items)
+            self.profiler.stack_grew(self.max_depth)
+
+
+# 配列・2次元配列のバイト数 (それ以外はNone)
+def nbytes(value):
+    if isinstance(value, vm_array.Array):
+        return vm_array._nbytes(value)
+    if isinstance(value, vm_matrix.Matrix):
+        return value.rows * value.cols * 8
+    return None
+
+def _site_name(site):
+    line, opcode = site
+    return f"line {line} {opcode}"
+
+
+# ==============================
+#      スナップショットの比較
+# ==============================
+# 生存している配列・フレームの確保した位置毎の増減 (バイト数の増加が大きい順，変化のない位置は除く)
+def compare(before, after):
+    rows = []
+    for kind in ("live", "frames"):
+        sites = set(before.get(kind, {})) | set(after.get(kind, {}))
+        for site in sites:
+            old = before.get(kind, {}).get(site, {"count": 0, "bytes": 0})
+            new = after.get(kind, {}).get(site, {"count": 0, "bytes": 0})
+            if old != new:
+                name = site if kind == "live" else f"{site} (frames)"
+                rows.append((new["bytes"] - old["bytes"], new["count"] - old["count"], name))
+    rows.sort(key=lambda row: (-row[0], row[2]))
+    return rows
+
+def main():
+    if len(sys.argv) != 3:
+        print("比較する2つのスナップショットを指定してください")
+        sys.exit(1)
+    snapshots = []
+    for path in sys.argv[1:]:
+        with open(path, "r", encoding="utf8") as f:
+            snapshots.append(json.load(f))
+    print(f"live: {snapshots[1]['live_bytes'] - snapshots[0]['live_bytes']:+} bytes, "
+          f"peak: {snapshots[1]['peak_bytes'] - snapshots[0]['peak_bytes']:+} bytes")
+    for size, count, site in compare(*snapshots):
+        print(f"{size:>+12} {count:>+8}  {site}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+import collections
+import signal
+import sys
+import threading
+import time
+from . import vm_memory
+
+# ==============================
+#       実行中の状態の出力
+# ==============================
+# SIGUSR1を受け取ったとき，およびheartbeat秒毎に，実行中の位置(pc・行)，実行した命令数と前回からの命令数/秒，
+# スタック・リターンスタックの深さ，前回からよく実行された行の上位，生存している配列のバイト数を出力する．
+# 実行ループには手を加えない: 行はsample_interval秒毎にpcを読むスレッドでサンプリングし，
+# 実行した命令数は実行ループのローカル変数の値をフレームから読む
+# (分岐の直後に読んだpcは飛び先の前の行を指すため，サンプルがその行に数えられることがある)
+# JITのトレースの実行中はvm.pcが更新されないため，位置・サンプルはトレースの先頭の行とし，
+# 実行した命令数はループ1周毎にしか増えない (jit_traceにトレースの先頭の行を出力する)
+class Monitor:
+    def __init__(self, heartbeat=None, path=None, top=10, sample_interval=0.01):
+        self.heartbeat = heartbeat # 定期的に出力する間隔(秒) (Noneならシグナルを受け取ったときだけ)
+        self.path = path           # 出力先ファイル (Noneなら標準エラー出力，ファイルには追記する)
+        self.top = top             # よく実行された行の表示件数
+        self.sample_interval = sample_interval
+        self.samples = collections.Counter() # 前回の出力からの 行 -> サンプル数
+        self.vm = None
+        self.main_thread = None
+        self.thread = None
+        self.stopped = threading.Event()
+        self.lock = threading.RLock() # シグナルとスレッドからの出力を直列化する
+        self.previous_handler = None
+        self.start_time = 0.0
+        self.last_time = 0.0
+        self.last_retired = 0
+
+    # ===== 開始・終了 =====
+    def start(self, vm):
+        self.vm = vm
+        self.main_thread = threading.main_thread().ident
+        self.start_time = self.last_time = time.perf_counter()
+        self.last_retired = vm.retired
+        if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+            self.previous_handler = signal.signal(signal.SIGUSR1, self._on_signal)
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.vm is None:
+            return
+        self.stopped.set()
+        self.thread.join()
+        if self.previous_handler is not None:
+            signal.signal(signal.SIGUSR1, self.previous_handler)
+            self.previous_handler = None
+        self.vm = None
+
+    def _on_signal(self, signum, frame):
+        if self.vm is not None:
+            self.dump(frame)
+
+    # サンプリングと定期的な出力
+    def _run(self):
+        next_dump = None if self.heartbeat is None else time.perf_counter() + self.heartbeat
+        while not self.stopped.wait(self.sample_interval):
+            self.sample()
+            if next_dump is not None and time.perf_counter() >= next_dump:
+                next_dump += self.heartbeat
+                self.dump(sys._current_frames().get(self.main_thread))
+
+    # ===== 記録 =====
+    def sample(self):
+        vm = self.vm
+        if vm is None:
+            return
+        pc = _current_pc(vm)
+        if 0 <= pc < len(vm.program):
+            with self.lock:
+                self.samples[vm.program.source_index(pc) + 1] += 1
+
+    # ===== 出力 =====
+    # frameは実行中のVMのフレーム (実行ループで数えている途中の命令数を読む)
+    def report(self, frame=None):
+        vm = self.vm
+        now = time.perf_counter()
+        retired = live_retired(vm, frame)
+        with self.lock:
+            samples, self.samples = self.samples, collections.Counter()
+            rate = (retired - self.last_retired) / (now - self.last_time) if now > self.last_time else 0.0
+            self.last_time = now
+            self.last_retired = retired
+        total = sum(samples.values())
+        pc = _current_pc(vm)
+        line = vm.program.source_index(pc) + 1
+        hot = samples.most_common(self.top)
+        code = _source_lines(vm, [line] + [n for n, _ in hot])
+        trace = vm.jit.active if vm.jit is not None else None
+        return {
+            "elapsed": now - self.start_time,
+            "pc": pc,
+            "line": line,
+            "code": code.get(line, ""),
+            "jit_trace": None if trace is None else vm.program.source_index(trace - 1) + 1,
+            "instructions_retired": retired,
+            "instructions_per_second": rate,
+            "data_stack_depth": len(vm.data_stack.items),
+            "return_stack_depth": len(vm.return_stack.items),
+            "hot_lines": [(n, count / total, code.get(n, "")) for n, count in hot],
+            "live_array_bytes": live_array_bytes(vm),
+        }
+
+    def dump(self, frame=None):
+        with self.lock:
+            report = self.report(frame)
+            lines = [f"monitor: elapsed {report['elapsed']:.1f}s"]
+            for key, value in report.items():
+                if key in ("elapsed", "hot_lines"):
+                    continue
+                lines.append(f"{key}: {value}")
+            lines.append("hot_lines:")
+            for n, share, code in report["hot_lines"]:
+                lines.append(f"{n:>8} {100 * share:>6.1f}%  {code}")
+            text = "\n".join(lines) + "\n"
+            if self.path is None:
+                sys.stderr.write(text)
+                sys.stderr.flush()
+            else:
+                with open(self.path, "a", encoding="utf8") as f:
+                    f.write(text)
+
+
+# 実行した命令数 (高速な実行ループ・JITのトレースは命令数をローカル変数で数え，抜けるときにvm.retiredへ加える)
+def live_retired(vm, frame=None):
+    retired = vm.retired
+    while frame is not None:
+        name = frame.f_code.co_name
+        if name == "_run_fast" and frame.f_locals.get("self") is vm:
+            return retired + frame.f_locals.get("retired", 0)
+        if name == "_trace" and frame.f_locals.get("vm") is vm:
+            retired += frame.f_locals.get("retired", 0)
+        frame = frame.f_back
+    return retired
+
+# 実行中の命令の位置 (トレースの実行中はトレースの先頭)
+def _current_pc(vm):
+    trace = vm.jit.active if vm.jit is not None else None
+    return vm.pc if trace is None else trace - 1
+
+# 変数領域とスタックから参照されている配列・行列の合計バイト数 (同じ配列は1回だけ数える)
+def live_array_bytes(vm):
+    areas = [vm.global_area.items.values(), vm.local_area.items.values(), vm.data_stack.items]
+    areas.extend(area.items.values() for area in vm.local_area_stack.items)
+    seen = set()
+    total = 0
+    for values in areas:
+        for value in list(values):
+            size = vm_memory.nbytes(value)
+            if size is not None and id(value) not in seen:
+                seen.add(id(value))
+                total += size
+    return total
+
+# 行番号 -> 元のプログラムの行 (ファイルは1回だけ読む)
+def _source_lines(vm, lines):
+    lines = [n for n in lines if n >= 1]
+    return {index + 1: line.strip() for index, line in vm.program.source_lines(n - 1 for n in lines).items()}
@@ -0,0 +1,198 @@
+import functools
+import io
+import multiprocessing
+import os
+import sys
+from contextlib import redirect_stdout, redirect_stderr
+from . import vm_error
+from . import vm_array
+
+# ==============================
+#        データ並列実行
+# ==============================
+# parallel_for n m: 添字の範囲を分割し，各添字についてn行目のサブルーチンをワーカープロセスで呼び出す．
+# ワーカーにはグローバル配列変数mと，サブルーチンから到達できる命令が参照するグローバル変数だけを渡す．
+# 整数・実数型の配列は共有メモリに置いて全てのワーカーから読み書きし (ファイルをマップした配列は
+# 各ワーカーが同じファイルをマップし直す)，それ以外のグローバル変数は開始時点の値のコピーを渡す．
+# 各呼び出しは開始時点のグローバル変数から始まり，store_global等の書き込みは後の呼び出しにも
+# 呼び出し元にも反映されない (ワーカー数に関わらず同じ結果になるよう，逐次実行でも同じ)．
+# 標準出力は範囲の先頭の分割から順に書き出し，最初にエラーになった分割のエラーで終了する
+
+workers = None # ワーカープロセス数 (Noneならコア数，1以下なら呼び出し元のプロセスで実行)
+CHUNKS_PER_WORKER = 4 # 1ワーカーあたりの分割数 (処理時間の偏りを均す)
+
+_pool = None
+_pool_size = 0
+_in_worker = False # ワーカー内のparallel_forは逐次実行する
+
+
+# サブルーチンを呼び出し，戻るまで実行して戻り値(スタックの先頭)を返す
+def call(vm, line, index):
+    program = vm.program
+    program_lenght = len(program)
+    names = program.names
+    opcodes = program.opcodes
+    constants = program.constants
+    operands = program.operands
+    base = len(vm.return_stack.items)
+    vm.data_stack.push(index)
+    vm.cmd_call([line])
+    while len(vm.return_stack.items) > base:
+        vm.pc += 1
+        if vm.pc >= program_lenght:
+            vm_error.index_error_pc(program.source_index(vm.pc) + 1)
+        vm.retired += 1
+        vm._execute(names[opcodes[vm.pc]], constants[operands[vm.pc]])
+    return vm.data_stack.pop()
+
+# start番からcount個の添字について呼び出し，戻り値をarrayに格納
+# (呼び出し毎にグローバル変数の束縛を開始時点に戻す)
+def run_sequential(vm, line, array, start, count):
+    items = vm.global_area.items
+    saved = dict(items)
+    try:
+        for index in range(start, start + count):
+            array.store(index, call(vm, line, index))
+            if items != saved:
+                items.clear()
+                items.update(saved)
+    finally:
+        items.clear()
+        items.update(saved)
+
+
+# slot番のグローバル配列変数に，n行目のサブルーチンの各添字の戻り値を格納する
+def parallel_for(vm, line, slot, start, count):
+    array = vm.global_area.items[slot]
+    n_workers = (workers or os.cpu_count() or 1) if not _in_worker else 1
+    if n_workers <= 1 or count <= 1:
+        run_sequential(vm, line, array, start, count)
+        return
+
+    # 渡すグローバル変数 (8バイトに収まらない整数があれば逐次実行)
+    shared = {}  # 変数番号 -> (配列, 共有メモリ上のコピー)
+    mapped = {}  # 変数番号 -> (ファイル名, 要素の型, モード)
+    scalars = {} # 変数番号 -> 値 (コピーを渡す)
+    try:
+        for referenced in referenced_globals(vm.program, line) | {slot}:
+            value = vm.global_area.items.get(referenced, _MISSING)
+            if value is _MISSING:
+                continue
+            if type(value) is vm_array.MappedArray and value.mode != vm_array.MAP_COPY:
+                mapped[referenced] = (value.path, value.type, value.mode)
+            elif type(value) in (vm_array.Array, vm_array.MappedArray, vm_array.SharedArray) and value.type in (int, float):
+                items = _elements(value)
+                copy = vm_array.SharedArray(value.type, len(items))
+                shared[referenced] = (value, copy)
+                copy.store_many(0, items)
+            else:
+                scalars[referenced] = value
+    except OverflowError:
+        _close(shared)
+        run_sequential(vm, line, array, start, count)
+        return
+    try:
+        if slot not in shared and slot not in mapped:
+            # 対象の配列が共有できない (文字型など) 場合は逐次実行
+            run_sequential(vm, line, array, start, count)
+            return
+        arrays = {referenced: (copy.type, len(copy.items), copy.memory.name) for referenced, (_, copy) in shared.items()}
+        n_chunks = min(count, n_workers * CHUNKS_PER_WORKER)
+        bounds = [start + count * i // n_chunks for i in range(n_chunks + 1)]
+        tasks = [(vm.program, vm.pc, line, slot, bounds[i], bounds[i + 1], scalars, arrays, mapped)
+                 for i in range(n_chunks)]
+        results = _get_pool(n_workers).map(_run_chunk, tasks, chunksize=1)
+
+        # 書き込まれた配列を呼び出し元へ戻す
+        for value, copy in shared.values():
+            items = copy.items.tolist()
+            if items != _elements(value):
+                value.store_many(0, items)
+    finally:
+        _close(shared)
+
+    for out, err, code, retired in results:
+        vm.retired += retired
+        sys.stdout.write(out)
+        if code is not None:
+            sys.stderr.write(err)
+            sys.exit(code)
+
+_MISSING = object()
+
+# n行目のサブルーチンから到達できる命令が参照するグローバル変数の番号
+# (分岐・call・入れ子のparallel_forの飛び先をたどる)
+@functools.lru_cache(maxsize=64)
+def referenced_globals(program, line):
+    slots = set()
+    seen = set()
+    pending = [line - 1]
+    while pending:
+        pc = pending.pop()
+        if pc in seen or not 0 <= pc < len(program):
+            continue
+        seen.add(pc)
+        opcode = program.opcode(pc)
+        operand = program.operand(pc)
+        if "global" in opcode:
+            slots.add(operand[0])
+        if opcode == "parallel_for":
+            slots.add(operand[1])
+            pending.append(operand[0] - 1)
+        elif opcode in ("if_equal", "if_greater", "if_less", "jump", "call", "spawn"):
+            pending.append(operand[0] - 1)
+        if opcode not in ("jump", "exit"):
+            pending.append(pc + 1)
+    return frozenset(slots)
+
+# 配列の要素のリスト
+def _elements(value):
+    items = value.items
+    return items.tolist() if type(items) is memoryview else list(items)
+
+def _close(shared):
+    for _, copy in shared.values():
+        copy.close(unlink=True)
+
+def _get_pool(n_workers):
+    global _pool, _pool_size
+    if _pool is None or _pool_size != n_workers:
+        if _pool is not None:
+            _pool.terminate()
+        _pool = multiprocessing.Pool(n_workers, initializer=_init_worker)
+        _pool_size = n_workers
+    return _pool
+
+def _init_worker():
+    global _in_worker
+    _in_worker = True
+
+
+# ===== ワーカー =====
+# 分割1つ分を実行して (標準出力, 標準エラー出力, 終了コード(正常ならNone), 実行した命令数) を返す
+def _run_chunk(task):
+    from . import virtual_machine
+    program, pc, line, target, start, stop, scalars, arrays, mapped = task
+    attached = {slot: vm_array.SharedArray(t, size, name) for slot, (t, size, name) in arrays.items()}
+    out = io.StringIO()
+    err = io.StringIO()
+    code = None
+    vm = virtual_machine.VirtualMachine(program, False)
+    vm.global_area.items.update(scalars)
+    vm.global_area.items.update(attached)
+    vm.pc = pc
+    try:
+        with redirect_stdout(out), redirect_stderr(err):
+            try:
+                for slot, (path, array_type, mode) in mapped.items():
+                    vm.global_area.items[slot] = vm_array.MappedArray(path, array_type, mode)
+                run_sequential(vm, line, vm.global_area.items[target], start, stop - start)
+            except vm_error.Error as e:
+                vm._error(e)
+    except SystemExit as e:
+        code = e.code
+    finally:
+        vm.global_area.items.clear()
+        for shared in attached.values():
+            shared.close()
+    return out.getvalue(), err.getvalue(), code, vm.retired
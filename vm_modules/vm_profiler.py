@@ -0,0 +1,89 @@
+import collections
+import signal
+
+# ==============================
+#   サンプリングプロファイラ
+# ==============================
+# 一定のCPU時間毎(SIGPROF)，または一定の命令数毎にVMのコールスタックを記録する．
+# コールスタックはリターンスタック上の呼び出し元から，各callの飛び先(サブルーチンの先頭行)を求めて
+# "main;sub_8;sub_8" の形で表す (flamegraph.pl等で使えるcollapsed stack形式)
+class SamplingProfiler:
+    def __init__(self, interval=0.005, every=None):
+        self.interval = interval # サンプリング間隔(CPU秒)
+        self.every = every       # 指定した場合は命令数毎にサンプリング (タイマーは使わない)
+        self.samples = collections.Counter() # コールスタック -> サンプル数
+        self.vm = None
+        self.count = 0
+        self.previous_handler = None
+
+    # ===== 開始・終了 =====
+    def start(self, vm):
+        self.vm = vm
+        if self.every is None and hasattr(signal, "setitimer"):
+            self.previous_handler = signal.signal(signal.SIGPROF, self._on_signal)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            # タイマーが使えない環境では命令数毎にサンプリング
+            self.every = self.every or 1000
+            vm.hooks.add_trace(self._on_instruction)
+
+    def stop(self):
+        if self.vm is None:
+            return
+        if self.previous_handler is not None:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, self.previous_handler)
+            self.previous_handler = None
+        elif self._on_instruction in self.vm.hooks.traces:
+            self.vm.hooks.remove_trace(self._on_instruction)
+        self.vm = None
+
+    def _on_signal(self, signum, frame):
+        if self.vm is not None:
+            self.sample(self.vm)
+
+    def _on_instruction(self, vm, line, opcode, operand):
+        self.count += 1
+        if self.count >= self.every:
+            self.count = 0
+            self.sample(vm)
+
+    # ===== 記録 =====
+    def sample(self, vm):
+        self.samples[call_stack(vm)] += 1
+
+    # ===== 出力 =====
+    def collapsed(self):
+        return "".join(f"{';'.join(stack)} {n}\n" for stack, n in sorted(self.samples.items()))
+
+    # サブルーチン毎のinclusive(呼び出し先を含む)・exclusive(自身のみ)のサンプル数の上位n件
+    def table(self, n=20):
+        total = sum(self.samples.values())
+        inclusive = collections.Counter()
+        exclusive = collections.Counter()
+        for stack, count in self.samples.items():
+            exclusive[stack[-1]] += count
+            for frame in set(stack):
+                inclusive[frame] += count
+        lines = [f"{'inclusive':>16} {'exclusive':>16}  subroutine"]
+        for frame, count in inclusive.most_common(n):
+            lines.append(f"{count:>8} {_percent(count, total):>7} {exclusive[frame]:>8} {_percent(exclusive[frame], total):>7}  {frame}")
+        lines.append(f"total samples: {total}")
+        return "\n".join(lines)
+
+    def write(self, path):
+        with open(path, "w", encoding="utf8") as f:
+            f.write(self.collapsed())
+
+
+# VMのコールスタック (呼び出し元から順に，サブルーチンの先頭行で表す)
+def call_stack(vm):
+    program = vm.program
+    stack = ["main"]
+    for pc in vm.return_stack.items:
+        # インライン展開後の飛び先は元のプログラムの行に戻す
+        stack.append(f"sub_{program.source_index(program.operand(pc)[0] - 1) + 1}")
+    return tuple(stack)
+
+def _percent(count, total):
+    return f"{100 * count / total:.1f}%" if total else "-"
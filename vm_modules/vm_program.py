@@ -0,0 +1,177 @@
+import array
+import itertools
+import re
+
+_COMMENT = re.compile(r"#.*")
+
+# ==============================
+#      パース済みプログラム
+# ==============================
+# 命令は列毎の配列で保持する (1命令あたり数バイト)
+#   opcodes:   命令名の番号 (names[番号]が命令名，未定義の命令名も実行時のエラーのために登録する)
+#   operands:  オペランドの定数表の番号 (constants[番号]がオペランドのタプル，同じ値は共有する)
+#   source_map: 変換後の命令の位置 -> 元の行の位置 (インライン展開した場合のみ)
+# プログラムの文字列(ファイルから読み込んだ場合はファイル名)はエラーメッセージを表示するときだけ参照する．
+# 同じプログラムを繰り返し実行する場合は，Programを作って各VirtualMachineに渡す
+# (構文チェックは最初の実行時に1回だけ行う)
+class Program:
+    def __init__(self, text=None, path=None):
+        self.text = text # プログラムの文字列 (ファイルから読み込んだ場合はNone)
+        self.path = path # プログラムのファイル名
+        self.names = []
+        self.opcodes = array.array("B")
+        self.operands = array.array("I")
+        self.constants = []
+        self.verified = False # 構文チェック済みか
+        self.source_map = None # 変換後の命令の位置 -> 元の行の位置 (Noneなら変換していない)
+        self.inlined = None # インライン展開の記録 (Noneなら展開していない)
+        self.loops = None # 配列の検査を入口にまとめるループ (Noneなら解析していない)
+        if text is not None:
+            self._parseLines(_split_lines(text))
+            if path is not None:
+                self.text = None # 元の行はファイルから読む
+        else:
+            with open(path, "r", encoding="utf8") as f:
+                self._parseLines(_file_lines(f))
+
+    # ファイルから1行ずつ読み込んで構文解析する (プログラムの文字列は保持しない)
+    @classmethod
+    def load(cls, path):
+        return cls(path=path)
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    # ===== 命令 =====
+    def opcode(self, pc):
+        return self.names[self.opcodes[pc]]
+
+    def operand(self, pc):
+        return self.constants[self.operands[pc]]
+
+    # (命令名, オペランド)のリスト
+    def instructions(self):
+        names = self.names
+        constants = self.constants
+        return [(names[op], constants[arg]) for op, arg in zip(self.opcodes, self.operands)]
+
+    # 命令列を置き換える (オペランドは変換済みの値)
+    def set_instructions(self, instructions):
+        self.names = []
+        self.opcodes = array.array("B")
+        self.operands = array.array("I")
+        self.constants = []
+        self.loops = None
+        builder = _Builder(self)
+        for opcode, operand in instructions:
+            builder.append(opcode, tuple(operand))
+
+    # ===== 元のプログラム =====
+    # 命令の位置に対応する元のプログラムの位置 (エラーメッセージ・実行統計の行番号に使う)
+    def source_index(self, pc):
+        if self.source_map is None or not 0 <= pc < len(self.source_map):
+            return pc
+        return self.source_map[pc]
+
+    # 元のプログラムのindex行目 (0始まり)
+    def source_line(self, index):
+        return self.source_lines([index]).get(index, "")
+
+    # 元のプログラムの複数の行 index -> 行 (ファイルは先頭から必要な行まで1回だけ読む)
+    def source_lines(self, indices):
+        wanted = set(indices)
+        if not wanted:
+            return {}
+        last = max(wanted)
+        lines = {}
+        if self.path is not None:
+            with open(self.path, "r", encoding="utf8") as f:
+                self._collect_lines(_file_lines(f), wanted, last, lines)
+        else:
+            self._collect_lines(_split_lines(self.text), wanted, last, lines)
+        return lines
+
+    @staticmethod
+    def _collect_lines(source, wanted, last, lines):
+        for index, line in enumerate(itertools.islice(source, last + 1)):
+            if index in wanted:
+                lines[index] = line
+
+    # ===== 構文解析 =====
+    def _parseLines(self, lines):
+        builder = _Builder(self)
+        empty_last = False
+        for line in lines:
+            empty_last = line == ""
+            if "#" in line:
+                line = _COMMENT.sub("", line) # コメント除去
+            data = line.split()
+
+            opcode = data[0] if len(data) else "" # オペコードがあれば取得
+            builder.append_text(opcode, data[1:]) # オペランドがあれば取得
+        # 末尾の改行の後の空行は命令に含めない
+        if empty_last:
+            builder.pop()
+
+
+# 命令を追加する補助 (命令名・オペランドの番号を割り当てる)
+class _Builder:
+    def __init__(self, program):
+        self.program = program
+        self.name_ids = {name: i for i, name in enumerate(program.names)}
+        self.constant_ids = {}
+
+    def append(self, opcode, operand):
+        self._append_opcode(opcode)
+        # 1と1.0，0.0と-0.0のように等しい値を区別する
+        key = tuple((float, x.hex()) if type(x) is float else (type(x), x) for x in operand)
+        self.program.operands.append(self._constant(key, operand))
+
+    # オペランドを文字列のまま受け取る (同じ文字列は実数に変換しない)
+    def append_text(self, opcode, words):
+        self._append_opcode(opcode)
+        key = tuple(words)
+        arg = self.constant_ids.get(key)
+        if arg is None:
+            arg = self._constant(key, tuple(float(x) for x in words))
+        self.program.operands.append(arg)
+
+    def _append_opcode(self, opcode):
+        program = self.program
+        op = self.name_ids.get(opcode)
+        if op is None:
+            op = self.name_ids[opcode] = len(program.names)
+            program.names.append(opcode)
+            if op > 0xff and program.opcodes.typecode == "B":
+                program.opcodes = array.array("H", program.opcodes)
+        program.opcodes.append(op)
+
+    def _constant(self, key, operand):
+        arg = self.constant_ids.get(key)
+        if arg is None:
+            arg = self.constant_ids[key] = len(self.program.constants)
+            self.program.constants.append(operand)
+        return arg
+
+    def pop(self):
+        self.program.opcodes.pop()
+        self.program.operands.pop()
+
+
+# ファイルの各行 (text.split("\n")と同じく，改行で終わるファイルは最後に空行を返す)
+def _file_lines(f):
+    line = "\n" # 空のファイルは空行1つ
+    for line in f:
+        yield line[:-1] if line.endswith("\n") else line
+    if line.endswith("\n"):
+        yield ""
+
+def _split_lines(text):
+    start = 0
+    while True:
+        end = text.find("\n", start)
+        if end < 0:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
@@ -0,0 +1,348 @@
+import array
+import operator
+from . import vm_array
+from . import vm_stack
+
+# ==============================
+#   実行時の命令の特殊化 (quickening)
+# ==============================
+# 高速な実行ループが引く命令名の番号の配列をVM毎に複製し，特殊化できる命令をまず適応版に置き換える．
+# 適応版は命令の位置毎に実行回数を数え，threshold回目に実行時の値・変数を見てその位置を特殊化版へ書き換える:
+#   add・sub・mul・if_*:  2つの値が整数(実数)なら整数(実数)専用版 (_int・_float)
+#   load_local・store_local・load_global: 変数領域の辞書を直接読み書きする版 (_fast)
+#   load_global_array・store_global_array: その位置で参照した配列をキャッシュした版 (_cached)
+#   load_local_array・store_local_array:   要素型の配列(Array)専用版 (_list)
+# 特殊化版は前提(ガード)が成り立たなければ汎用版を実行し，その位置を適応版へ戻す (脱最適化)．
+# 配列の添字が負・範囲外の場合も汎用版を実行してエラーにする．
+# max_deopts回脱最適化した位置は汎用版に固定する．Programは書き換えないため，
+# 複数のVMで共有していても各VMが個別に特殊化する
+
+_MISSING = object()
+_ARITHMETIC = {"add": operator.add, "sub": operator.sub, "mul": operator.mul}
+_COMPARE = {"if_equal": operator.eq, "if_greater": operator.gt, "if_less": operator.lt}
+_LOADABLE_ARRAYS = (vm_array.Array, vm_array.MappedArray, vm_array.SharedArray)
+_STORABLE_ARRAYS = (vm_array.Array, vm_array.SharedArray)
+
+
+class Quickener:
+    # handlersは命令名の番号 -> 汎用版の実行関数 (高速な実行ループの表)
+    # count_hitsなら特殊化版の実行回数を数える (統計の表示用，実行は遅くなる)
+    def __init__(self, vm, handlers, threshold=8, max_deopts=4, count_hits=False):
+        program = vm.program
+        self.vm = vm
+        self.threshold = threshold
+        self.max_deopts = max_deopts
+        self.count_hits = count_hits
+        self.handlers = list(handlers) # 番号 -> 実行関数 (適応版・特殊化版を後ろに追加する)
+        self.names = list(program.names)
+        self.adaptive_ids = {} # 汎用版の番号 -> 適応版の番号
+        self.shared_ids = {}   # 位置に依らない特殊化版の名前 -> 番号
+        self.counters = {}     # 位置 -> 適応版の実行回数
+        self.deopts = {}       # 位置 -> 脱最適化した回数
+        self.stats = {}        # 特殊化版の名前 -> [特殊化した回数, 実行回数, 脱最適化した回数]
+        for op, name in enumerate(program.names):
+            if name in _SPECIALIZERS:
+                self.adaptive_ids[op] = self._add(name + "_adaptive", self._adaptive(op, name))
+        adaptive_ids = self.adaptive_ids
+        self.opcodes = array.array("I", [adaptive_ids.get(op, op) for op in program.opcodes])
+
+    def _add(self, name, handler):
+        self.names.append(name)
+        self.handlers.append(handler)
+        return len(self.handlers) - 1
+
+    # ===== 適応版 =====
+    def _adaptive(self, op, name):
+        generic = self.handlers[op]
+        vm = self.vm
+        counters = self.counters
+        threshold = self.threshold
+        def adaptive(operand):
+            pc = vm.pc
+            count = counters.get(pc, 0) + 1
+            if count < threshold:
+                counters[pc] = count
+                generic(operand)
+                return
+            counters.pop(pc, None)
+            self._specialize(pc, op, name, operand)
+            self.handlers[self.opcodes[pc]](operand)
+        return adaptive
+
+    # 実行前の状態を見て特殊化版へ書き換える (特殊化できなければ汎用版に固定する)
+    def _specialize(self, pc, op, name, operand):
+        kind, factory = _SPECIALIZERS[name](self.vm, operand)
+        if kind is None:
+            self.opcodes[pc] = op
+            return
+        kind = f"{name}_{kind}"
+        counts = self.stats.setdefault(kind, [0, 0, 0])
+        counts[0] += 1
+        if kind in self.shared_ids:
+            self.opcodes[pc] = self.shared_ids[kind]
+            return
+        deopt = lambda operand: self._deopt(op, counts, operand)
+        handler = factory(self.vm, deopt)
+        if self.count_hits:
+            handler = _counted(handler, counts)
+        new_op = self._add(kind, handler)
+        if not factory.per_pc:
+            self.shared_ids[kind] = new_op
+        self.opcodes[pc] = new_op
+
+    # ガードが成り立たなかった: 汎用版を実行し，その位置を適応版(一定回数を超えたら汎用版)へ戻す
+    def _deopt(self, op, counts, operand):
+        pc = self.vm.pc
+        deopts = self.deopts.get(pc, 0) + 1
+        self.deopts[pc] = deopts
+        self.opcodes[pc] = op if deopts >= self.max_deopts else self.adaptive_ids[op]
+        counts[2] += 1
+        self.handlers[op](operand)
+
+    # ===== 統計 =====
+    def totals(self):
+        totals = {"specializations": 0, "hits": 0, "deopts": 0}
+        for specializations, executed, deopts in self.stats.values():
+            totals["specializations"] += specializations
+            totals["hits"] += executed - deopts
+            totals["deopts"] += deopts
+        return totals
+
+    def report(self):
+        lines = ["quicken: " + " ".join(f"{k}={v}" for k, v in self.totals().items())]
+        for kind, (specializations, executed, deopts) in sorted(self.stats.items()):
+            lines.append(f"  {kind} specializations={specializations} hits={executed - deopts} deopts={deopts}")
+        return "\n".join(lines)
+
+
+def _counted(handler, counts):
+    def counted(operand):
+        counts[1] += 1
+        handler(operand)
+    return counted
+
+# 特殊化版を作る関数 (per_pcなら位置毎に作る)
+def _factory(per_pc=False):
+    def decorate(factory):
+        factory.per_pc = per_pc
+        return factory
+    return decorate
+
+# データスタックに積む関数 (最大の深さを記録するスタックはpushを経由する)
+def _push(vm):
+    stack = vm.data_stack
+    return stack.items.append if type(stack) is vm_stack.Stack else stack.push
+
+
+# ==============================
+#         特殊化版
+# ==============================
+# 各命令について，実行前の状態から (特殊化版の種類, 特殊化版を作る関数) を選ぶ (できなければ (None, None))
+# 特殊化版を作る関数は factory(vm, deopt) で，deopt(operand)はガードが成り立たないときに呼ぶ
+
+# ===== 四則演算 =====
+def _arithmetic(name):
+    function = _ARITHMETIC[name]
+    def specializer(vm, operand):
+        items = vm.data_stack.items
+        if len(items) >= 2 and type(items[-1]) is type(items[-2]) and type(items[-1]) in (int, float):
+            return type(items[-1]).__name__, _typed_arithmetic(function, type(items[-1]))
+        return None, None
+    return specializer
+
+def _typed_arithmetic(function, value_type):
+    @_factory()
+    def factory(vm, deopt):
+        items = vm.data_stack.items
+        def typed(operand):
+            if len(items) >= 2:
+                x = items[-1]
+                y = items[-2]
+                if type(x) is value_type and type(y) is value_type:
+                    del items[-1]
+                    items[-1] = function(x, y)
+                    return
+            deopt(operand)
+        return typed
+    return factory
+
+# ===== 比較して分岐 =====
+def _compare(name):
+    function = _COMPARE[name]
+    def specializer(vm, operand):
+        items = vm.data_stack.items
+        if len(items) >= 2 and type(items[-1]) is type(items[-2]) and type(items[-1]) in (int, float):
+            return type(items[-1]).__name__, _typed_compare(function, type(items[-1]))
+        return None, None
+    return specializer
+
+def _typed_compare(function, value_type):
+    @_factory()
+    def factory(vm, deopt):
+        items = vm.data_stack.items
+        branch = vm._branch
+        def typed(operand):
+            if len(items) >= 2:
+                x = items[-1]
+                y = items[-2]
+                if type(x) is value_type and type(y) is value_type:
+                    del items[-2:]
+                    if function(x, y):
+                        branch(operand[0])
+                    return
+            deopt(operand)
+        return typed
+    return factory
+
+# ===== 変数 =====
+def _load_local(vm, operand):
+    return ("fast", _load_local_fast) if operand[0] in vm.local_area.items else (None, None)
+
+@_factory()
+def _load_local_fast(vm, deopt):
+    push = _push(vm)
+    def load_local(operand):
+        try:
+            value = vm.local_area.items[operand[0]]
+        except KeyError:
+            deopt(operand)
+            return
+        push(value)
+    return load_local
+
+def _store_local(vm, operand):
+    return "fast", _store_local_fast
+
+@_factory()
+def _store_local_fast(vm, deopt):
+    items = vm.data_stack.items
+    def store_local(operand):
+        if items:
+            vm.local_area.items[operand[0]] = items.pop()
+        else:
+            deopt(operand)
+    return store_local
+
+def _load_global(vm, operand):
+    return ("fast", _load_global_fast) if operand[0] in vm.global_area.items else (None, None)
+
+@_factory()
+def _load_global_fast(vm, deopt):
+    push = _push(vm)
+    global_items = vm.global_area.items
+    def load_global(operand):
+        try:
+            value = global_items[operand[0]]
+        except KeyError:
+            deopt(operand)
+            return
+        push(value)
+    return load_global
+
+# ===== 配列 =====
+# グローバル配列: 特殊化した時点の配列をキャッシュし，変数がその配列を指している間だけ使う
+def _load_global_array(vm, operand):
+    array = vm.global_area.items.get(operand[0])
+    if type(array) not in _LOADABLE_ARRAYS:
+        return None, None
+    @_factory(per_pc=True)
+    def factory(vm, deopt):
+        items = vm.data_stack.items
+        global_items = vm.global_area.items
+        slot = operand[0]
+        def cached(operand):
+            if items and global_items.get(slot, _MISSING) is array:
+                try:
+                    index = items[-1]
+                    if index >= 0:
+                        items[-1] = array.items[index]
+                        return
+                except (IndexError, TypeError):
+                    pass
+            deopt(operand)
+        return cached
+    return "cached", factory
+
+def _store_global_array(vm, operand):
+    array = vm.global_area.items.get(operand[0])
+    if type(array) not in _STORABLE_ARRAYS:
+        return None, None
+    @_factory(per_pc=True)
+    def factory(vm, deopt):
+        items = vm.data_stack.items
+        global_items = vm.global_area.items
+        slot = operand[0]
+        element_type = array.type
+        def cached(operand):
+            if len(items) >= 2 and type(items[-2]) is element_type and global_items.get(slot, _MISSING) is array:
+                try:
+                    index = items[-1]
+                    if index >= 0:
+                        array.items[index] = items[-2]
+                        del items[-2:]
+                        return
+                except (IndexError, TypeError):
+                    pass
+            deopt(operand)
+        return cached
+    return "cached", factory
+
+# ローカル配列: フレーム毎に変わるため，要素型の配列であることだけを前提にする
+def _load_local_array(vm, operand):
+    return ("list", _load_local_array_list) if type(vm.local_area.items.get(operand[0])) is vm_array.Array else (None, None)
+
+@_factory()
+def _load_local_array_list(vm, deopt):
+    items = vm.data_stack.items
+    Array = vm_array.Array
+    def load_local_array(operand):
+        array = vm.local_area.items.get(operand[0])
+        if items and type(array) is Array:
+            try:
+                index = items[-1]
+                if index >= 0:
+                    items[-1] = array.items[index]
+                    return
+            except (IndexError, TypeError):
+                pass
+        deopt(operand)
+    return load_local_array
+
+def _store_local_array(vm, operand):
+    return ("list", _store_local_array_list) if type(vm.local_area.items.get(operand[0])) is vm_array.Array else (None, None)
+
+@_factory()
+def _store_local_array_list(vm, deopt):
+    items = vm.data_stack.items
+    Array = vm_array.Array
+    def store_local_array(operand):
+        array = vm.local_area.items.get(operand[0])
+        if len(items) >= 2 and type(array) is Array and type(items[-2]) is array.type:
+            try:
+                index = items[-1]
+                if index >= 0:
+                    array.items[index] = items[-2]
+                    del items[-2:]
+                    return
+            except (IndexError, TypeError):
+                pass
+        deopt(operand)
+    return store_local_array
+
+
+# 命令名 -> 特殊化版を選ぶ関数
+_SPECIALIZERS = {
+    "add": _arithmetic("add"),
+    "sub": _arithmetic("sub"),
+    "mul": _arithmetic("mul"),
+    "if_equal": _compare("if_equal"),
+    "if_greater": _compare("if_greater"),
+    "if_less": _compare("if_less"),
+    "load_local": _load_local,
+    "store_local": _store_local,
+    "load_global": _load_global,
+    "load_global_array": _load_global_array,
+    "store_global_array": _store_global_array,
+    "load_local_array": _load_local_array,
+    "store_local_array": _store_local_array,
+}
@@ -0,0 +1,238 @@
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import sys
+from contextlib import redirect_stdout, redirect_stderr
+from . import virtual_machine
+from . import vm_input
+from . import vm_jit
+
+# ==============================
+#    プログラムの実行結果のキャッシュ
+# ==============================
+# 同じプログラムを同じ入力で実行した結果(標準出力・標準エラー出力・終了コード)を，プログラム・入力・
+# VMのソースコードのハッシュ値をキーにしてディレクトリへ保存し，2回目以降は実行せずに同じ結果を返す．
+# 出力以外の副作用がある・結果が実行毎に変わりうる命令(ファイルのマップ・スレッド)を含むプログラムと，
+# 実行時間・統計等を出力する指定がある場合はキャッシュを使わずに実行する．
+# 入力を読み込むプログラムは入力を最後まで読んでからキーに含めて実行する．
+# ディレクトリの合計がmax_bytesを超えると，最後に使った時刻(更新時刻)が古いエントリから削除する．
+# ヒット・ミス数はディレクトリのstats.jsonに記録する (複数のプロセスから同時に更新すると数え漏れることがある)
+#   python -m vm_modules.vm_result_cache ディレクトリ   # 統計の表示
+
+# 出力以外の副作用がある・結果が実行毎に変わりうる命令
+UNCACHEABLE_OPCODES = {
+    "map_file_int",
+    "map_file_float",
+    "sync_global_array",
+    "sync_local_array",
+    "spawn",
+    "join",
+    "lock",
+    "unlock",
+}
+# 入力を読み込む命令
+READ_OPCODES = {"read_int", "read_float", "read_char", "read_global_array", "read_local_array"}
+# 2次元配列の命令 (NumPyの有無で計算方法が変わるためキーに含める)
+MATRIX_OPCODES = {"matmul", "transpose", "row_sum", "col_sum"}
+
+_STATS_FILE = "stats.json"
+_SUFFIX = ".json"
+
+
+class ResultCache:
+    def __init__(self, directory, max_bytes=64 << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes # エントリの合計バイト数の上限
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    # ===== エントリ =====
+    # 結果 {"stdout", "stderr", "exit_code"} (なければNone)．使った時刻を更新する
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf8") as f:
+                result = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return result
+
+    def put(self, key, result):
+        _write_json(self._path(key), result)
+        self.evict()
+
+    # 合計がmax_bytes以下になるまで古いエントリから削除して，削除した数を返す
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(_SUFFIX) and name != _STATS_FILE:
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        if evicted:
+            self.record("evictions", evicted)
+        return evicted
+
+    # ===== 統計 =====
+    # eventは "hits"・"misses"・"uncacheable"・"evictions"
+    def record(self, event, n=1):
+        stats = self._load_stats()
+        stats[event] = stats.get(event, 0) + n
+        _write_json(os.path.join(self.directory, _STATS_FILE), stats)
+
+    def _load_stats(self):
+        try:
+            with open(os.path.join(self.directory, _STATS_FILE), "r", encoding="utf8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def stats(self):
+        stats = {"hits": 0, "misses": 0, "uncacheable": 0, "evictions": 0}
+        stats.update(self._load_stats())
+        requests = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / requests, 3) if requests else 0.0
+        sizes = [os.path.getsize(os.path.join(self.directory, name)) for name in os.listdir(self.directory)
+                 if name.endswith(_SUFFIX) and name != _STATS_FILE]
+        stats["entries"] = len(sizes)
+        stats["bytes"] = sum(sizes)
+        return stats
+
+
+# 一時ファイルに書いてから置き換える (読み込み途中のエントリを見せない)
+def _write_json(path, value):
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, "w", encoding="utf8") as f:
+        json.dump(value, f)
+    os.replace(temp, path)
+
+
+# ==============================
+#          キー
+# ==============================
+# VMのソースコードのハッシュ値 (VMを変更すると以前の結果は使わない)
+_version = None
+
+def vm_version():
+    global _version
+    if _version is None:
+        digest = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".py"):
+                with open(os.path.join(directory, name), "rb") as f:
+                    digest.update(name.encode("utf8") + b"\0" + f.read())
+        _version = digest.hexdigest()
+    return _version
+
+def cacheable(program):
+    return not UNCACHEABLE_OPCODES.intersection(program.names)
+
+def reads_input(program):
+    return bool(READ_OPCODES.intersection(program.names))
+
+# プログラムの文字列・入力のバイト列(読み込まないならNone)のキー
+def key(text, program, input_data):
+    digest = hashlib.sha256()
+    digest.update(vm_version().encode("ascii") + b"\0")
+    if MATRIX_OPCODES.intersection(program.names) or any("matrix" in name for name in program.names):
+        digest.update(b"numpy\0" if importlib.util.find_spec("numpy") is not None else b"list\0")
+    digest.update(text.encode("utf8") + b"\0")
+    if input_data is not None:
+        digest.update(b"input\0" + input_data)
+    return digest.hexdigest()
+
+# 実行時間・統計等を出力する指定 (キャッシュした結果では再現できない)
+def _diagnostics_enabled():
+    vm = virtual_machine
+    return bool(vm.time_flag or vm.stats_format or vm.profile_path or vm.monitor_flag or vm.heartbeat_interval
+                or vm.memory_profile_path or vm.jit_stats_flag or vm.inline_report_flag or vm.quicken_stats_flag)
+
+
+# ==============================
+#           実行
+# ==============================
+# キャッシュにあれば実行せずに結果を出力し，なければ実行して結果を保存する (どちらも終了コードで終了する)
+# キャッシュできないプログラムは通常どおり実行する
+def run(cache, text, load_ns=0, path=None):
+    try:
+        program = virtual_machine.Program(text, path)
+    except Exception:
+        # 構文エラーは通常の実行で報告する
+        virtual_machine.run(text, load_ns, path)
+        return
+    if not cacheable(program) or _diagnostics_enabled():
+        cache.record("uncacheable")
+        virtual_machine.run(program, load_ns)
+        return
+
+    input_data = _read_input() if reads_input(program) else None
+    entry_key = key(text, program, input_data)
+    result = cache.get(entry_key)
+    if result is not None:
+        cache.record("hits")
+    else:
+        cache.record("misses")
+        result = _execute(program, input_data)
+        cache.put(entry_key, result)
+    sys.stdout.write(result["stdout"])
+    sys.stdout.flush()
+    sys.stderr.write(result["stderr"])
+    sys.exit(result["exit_code"])
+
+def _read_input():
+    if virtual_machine.input_path is None:
+        return sys.stdin.buffer.read()
+    try:
+        with open(virtual_machine.input_path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None # 開けない入力は実行時のエラーにする
+
+# 出力を取り込んで実行する (VMのエラー以外の例外は保存せずにそのまま送出する)
+def _execute(program, input_data):
+    out = io.StringIO()
+    err = io.StringIO()
+    code = 0
+    try:
+        with redirect_stdout(out), redirect_stderr(err):
+            jit = vm_jit.JIT(virtual_machine.jit_threshold) if virtual_machine.jit_flag else None
+            vm = virtual_machine.VirtualMachine(program, False, jit)
+            if input_data is not None:
+                vm.input = vm_input.Reader(io.BytesIO(input_data))
+            vm.run()
+    except SystemExit as e:
+        code = e.code
+    except BaseException:
+        sys.stdout.write(out.getvalue())
+        sys.stderr.write(err.getvalue())
+        raise
+    return {"stdout": out.getvalue(), "stderr": err.getvalue(), "exit_code": code}
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("キャッシュのディレクトリを指定してください")
+        sys.exit(1)
+    print(json.dumps(ResultCache(sys.argv[1]).stats(), indent=2))
+
+if __name__ == '__main__':
+    main()
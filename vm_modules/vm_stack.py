@@ -15,3 +15,14 @@ class Stack:
     
     def is_empty(self):
         return not self.items
+
+# 最大の深さを記録するスタック (実行統計用)
+class TrackedStack(Stack):
+    def __init__(self):
+        super().__init__()
+        self.max_depth = 0
+
+    def push(self, item):
+        self.items.append(item)
+        if len(self.items) > self.max_depth:
+            self.max_depth = len(self.items)
@@ -0,0 +1,84 @@
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+# ==============================
+#         実行統計
+# ==============================
+# フェーズ: load(ファイル読み込み), parse(構文解析), verify(check_syntax), execute(実行)
+class Metrics:
+    def __init__(self, load_ns=0):
+        self.phases_ns = {"load": load_ns, "parse": 0, "verify": 0, "execute": 0}
+        self.phase = None       # 計測中のフェーズ
+        self.phase_start = 0
+        self.exit_code = None
+        self.error = None       # VMのエラー以外で終了した場合の例外名
+
+    # ===== フェーズの計測 =====
+    # 計測中のフェーズを終了して，次のフェーズを開始
+    def enter(self, phase):
+        now = time.perf_counter_ns()
+        if self.phase is not None:
+            self.phases_ns[self.phase] += now - self.phase_start
+        self.phase = phase
+        self.phase_start = now
+
+    def finish(self):
+        self.enter(None)
+
+    # ===== 出力 =====
+    def report(self, vm):
+        execute_ns = self.phases_ns["execute"]
+        result = {
+            "exit_code": self.exit_code,
+            "error": self.error,
+            "phases_ns": dict(self.phases_ns),
+            "total_ns": sum(self.phases_ns.values()),
+            "instructions_retired": 0,
+            "instructions_per_second": 0.0,
+            "max_data_stack_depth": 0,
+            "max_return_stack_depth": 0,
+            "calls": 0,
+            "arrays_allocated": 0,
+            "peak_rss_bytes": peak_rss_bytes(),
+        }
+        if vm is not None:
+            result["line"] = vm.program.source_index(vm.pc) + 1
+            result["instructions_retired"] = vm.retired
+            if execute_ns:
+                result["instructions_per_second"] = vm.retired * 1e9 / execute_ns
+            result["max_data_stack_depth"] = getattr(vm.data_stack, "max_depth", None)
+            result["max_return_stack_depth"] = getattr(vm.return_stack, "max_depth", None)
+            result["calls"] = vm.calls
+            result["arrays_allocated"] = vm.arrays_allocated
+            if vm.array_pool is not None:
+                result["array_pool"] = vm.array_pool.stats()
+            if vm.jit is not None:
+                result["jit"] = dict(vm.jit.stats)
+        return result
+
+    def emit(self, vm, fmt="json", path=None):
+        report = self.report(vm)
+        if fmt == "json":
+            text = json.dumps(report)
+        else:
+            text = "\n".join(f"{key}: {value}" for key, value in report.items())
+        if path is None:
+            print(text, file=sys.stderr)
+        else:
+            with open(path, "w", encoding="utf8") as f:
+                f.write(text + "\n")
+
+
+# プロセスの最大常駐メモリ量 (取得できない環境ではNone)
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOSはバイト単位，Linuxはキロバイト単位
+    return peak if sys.platform == "darwin" else peak * 1024
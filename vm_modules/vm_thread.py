@@ -0,0 +1,96 @@
+import itertools
+import sys
+import threading
+from . import vm_error
+from . import vm_parallel
+
+# ==============================
+#          VMスレッド
+# ==============================
+# spawn n: スタックからpopした値を引数として，n行目のサブルーチンを新しいスレッドで呼び出し，スレッド番号をpush
+# join:    スタックからスレッド番号をpopし，スレッドの終了を待って戻り値(スタックの先頭)をpush
+# lock n / unlock n: n番のロックを獲得・解放する
+# スレッドはデータスタック・リターンスタック・ローカル変数領域を個別に持ち，グローバル変数領域と配列を共有する．
+# グローバル変数・配列の要素1つの読み書きは不可分 (辞書・リストの1回の操作)．複数の値にまたがる更新は
+# lockとunlockで囲む．フリースレッドの処理系では並列に実行し，GILのある処理系でも(直列に)同じ結果になる．
+# スレッドがエラーで終了した場合は，そのスレッドがエラーメッセージを出力し，joinしたスレッドも同じ終了コードで終了する
+
+# GILを無効にした処理系で実行しているか (並列に実行される)
+def free_threaded():
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+class Threads:
+    def __init__(self):
+        self.lock = threading.Lock() # スレッド・ロックの表の更新を直列化する
+        self.threads = {}            # スレッド番号 -> _VMThread (joinしていないもの)
+        self.locks = {}              # ロック番号 -> threading.Lock
+        self.ids = itertools.count()
+
+    # ===== スレッド =====
+    def spawn(self, vm, line, argument):
+        # 同じプログラム・グローバル変数領域・スレッドの表を使う別のVM (フック・JIT・再利用プールは使わない)
+        child = type(vm)(vm.program, False)
+        child.global_area = vm.global_area
+        child.threads = self
+        child.input = vm.input
+        child.array_pool = None
+        child.pc = vm.pc
+        thread = _VMThread(child, line, argument)
+        with self.lock:
+            handle = next(self.ids)
+            self.threads[handle] = thread
+        thread.start()
+        return handle
+
+    # 終了を待って戻り値を返す (実行した命令数はjoinしたVMに加える)
+    def join(self, vm, handle):
+        with self.lock:
+            thread = self.threads.pop(handle, None)
+        if thread is None:
+            raise vm_error.Error("ERROR_INVALID_THREAD")
+        thread.join()
+        vm.retired += thread.vm.retired
+        if thread.exception is not None:
+            raise thread.exception
+        if thread.code is not None:
+            sys.exit(thread.code)
+        return thread.result
+
+    # ===== ロック =====
+    def acquire(self, n):
+        with self.lock:
+            lock = self.locks.get(n)
+            if lock is None:
+                lock = self.locks[n] = threading.Lock()
+        lock.acquire()
+
+    def release(self, n):
+        lock = self.locks.get(n)
+        if lock is None or not lock.locked():
+            raise vm_error.Error("ERROR_UNLOCKED_LOCK")
+        lock.release()
+
+
+class _VMThread(threading.Thread):
+    def __init__(self, vm, line, argument):
+        # 終了していないスレッドがあってもexitでプロセスを終了できるようにする
+        super().__init__(daemon=True)
+        self.vm = vm
+        self.line = line
+        self.argument = argument
+        self.result = None
+        self.code = None      # エラーで終了した場合の終了コード (エラーメッセージは出力済み)
+        self.exception = None # VMのエラー以外の例外
+
+    def run(self):
+        try:
+            try:
+                self.result = vm_parallel.call(self.vm, self.line, self.argument)
+            except vm_error.Error as e:
+                self.vm._error(e)
+        except SystemExit as e:
+            self.code = e.code
+        except BaseException as e:
+            self.exception = e